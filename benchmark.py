@@ -0,0 +1,163 @@
+"""
+Benchmarks on generated availability (see generate_availability.py).
+
+python benchmark.py engines [num_employees] [num_days] [num_shifts] [seed]
+    compare the greedy and the min-cost flow engines of Scheduler.assign_work
+    by coverage (unassigned main shifts, unmet special requirement headcount) and runtime.
+
+python benchmark.py suite [--output results.json] [--repeat N] [--quick]
+    time each phase separately (csv ingestion, shift availability, assign_work, validate_schedule, writers, verify_schedule)
+    over sweeps of the number of employees, days and shifts, and save the results as json.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from generate_availability import GENERATED_METADATA, generate_availability_data, write_availability_file
+from test import RecordingInstrumentation, Scheduler, is_hard_violation, load_availability, verify_schedule
+
+
+def configure_scheduler(availability_data, total_workload_limit, instrumentation=None):
+    # last shift is even numbered, with the second to last shift as backup; the special requirement staffs the evening
+    scheduler = Scheduler(availability_data, metadata=None, total_workload_limit=total_workload_limit, instrumentation=instrumentation)
+    shift_labels = availability_data.shift_labels
+    scheduler.set_backup_shift(shift_labels[-2], shift_labels[-1])
+    scheduler.set_even_numbered_shifts(shift_labels[-1])
+    closing_shift = scheduler.get_shift(scheduler.num_shifts - 1)
+    special_requirement = {
+        "start_time": closing_shift.start_time,
+        "end_time": closing_shift.end_time,
+        "num_assignees_required": 2,
+        "shift_to_assign_extra": closing_shift.label,
+    }
+    return scheduler, special_requirement
+
+
+def measure_engine(availability_data, total_workload_limit, engine):
+    with contextlib.redirect_stdout(io.StringIO()):
+        scheduler, special_requirement = configure_scheduler(availability_data, total_workload_limit)
+        start = time.perf_counter()
+        scheduler.assign_work(scheduling_priority=[], special_requirement=special_requirement, engine=engine)
+        elapsed = time.perf_counter() - start
+    num_unassigned_shifts, missing_headcount, _ = scheduler.score_schedule(special_requirement)
+    num_violations = sum(1 for violation in verify_schedule(scheduler, special_requirement=special_requirement) if is_hard_violation(violation))
+    return num_unassigned_shifts, missing_headcount, scheduler.total_workload, num_violations, elapsed
+
+
+def compare_engines(num_employees=500, num_days=28, num_shifts=20, seed=0):
+    availability_data = generate_availability_data(num_employees, num_days, num_shifts, overlap=6.0, seed=seed)
+    print(f"{num_employees} employees, {num_days} days, {len(availability_data.shift_labels)} shifts")
+    print(f"{'workload limit':>15} {'engine':>7} {'unassigned':>11} {'unmet':>6} {'workload':>9} {'violations':>10} {'seconds':>8}")
+    shift_lengths = [end_time - start_time for start_time, end_time in (map(int, label.split("->")) for label in availability_data.shift_labels)]
+    mean_shift_length = sum(shift_lengths) / len(shift_lengths)
+    # from a limit too tight to staff every shift to no limit at all
+    for shifts_per_employee in (1, 1.5, 2.5, None):
+        total_workload_limit = round(shifts_per_employee * mean_shift_length * num_employees) if shifts_per_employee else None
+        for engine in ("greedy", "flow"):
+            num_unassigned_shifts, missing_headcount, total_workload, num_violations, elapsed = measure_engine(availability_data, total_workload_limit, engine)
+            print(f"{str(total_workload_limit):>15} {engine:>7} {num_unassigned_shifts:>11} {missing_headcount:>6} {total_workload:>9} {num_violations:>10} {elapsed:>8.3f}")
+
+
+def time_phases(file_path, total_workload_limit, output_dir):
+    # seconds spent in each phase of one run on the availability file
+    timings = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        availability_data = load_availability(file_path, GENERATED_METADATA)
+        timings["load_availability"] = time.perf_counter() - start
+
+        instrumentation = RecordingInstrumentation()
+        start = time.perf_counter()
+        scheduler, special_requirement = configure_scheduler(availability_data, total_workload_limit, instrumentation)
+        phase_seconds = instrumentation.report.phase_seconds
+        timings["create_shift_availability"] = phase_seconds["create_shift_availability"]
+        timings["scheduler_init"] = time.perf_counter() - start - timings["create_shift_availability"]
+
+        # validate_schedule (with exchange_assignment) runs at the end of assign_work, it is timed on its own
+        start = time.perf_counter()
+        scheduler.assign_work(scheduling_priority=[], special_requirement=special_requirement)
+        timings["validate_schedule"] = phase_seconds["validate_schedule"]
+        timings["assign_work"] = time.perf_counter() - start - timings["validate_schedule"]
+
+        start = time.perf_counter()
+        scheduler.write_outputs(os.path.join(output_dir, "schedule.csv"), os.path.join(output_dir, "assignment.csv"))
+        timings["writers"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        violations = verify_schedule(scheduler, special_requirement=special_requirement)
+        timings["verify_schedule"] = time.perf_counter() - start
+    num_unassigned_shifts, missing_headcount, workload_variance = scheduler.score_schedule(special_requirement)
+    score = {"unassigned_shifts": num_unassigned_shifts, "missing_headcount": missing_headcount, "workload_variance": workload_variance}
+    score["violations"] = sum(1 for violation in violations if is_hard_violation(violation))
+    score["counters"] = instrumentation.report.counters
+    return timings, score
+
+
+def get_sweeps(quick=False):
+    # (num_employees, num_days, num_shifts): one sweep per dimension around a base size
+    if quick:
+        base, employees, days, shifts = (100, 7, 8), (50, 100, 200), (7, 14), (8, 12)
+    else:
+        base, employees, days, shifts = (500, 28, 12), (100, 250, 500, 1000, 2000, 4000), (7, 14, 28, 56), (6, 12, 20, 30)
+    sizes = [(num_employees, base[1], base[2]) for num_employees in employees]
+    sizes += [(base[0], num_days, base[2]) for num_days in days]
+    sizes += [(base[0], base[1], num_shifts) for num_shifts in shifts]
+    return list(dict.fromkeys(sizes))
+
+
+def run_suite(output_path, repeat=3, quick=False, hours_per_employee=40):
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for num_employees, num_days, num_shifts in get_sweeps(quick):
+            file_path = os.path.join(temp_dir, "availability.csv")
+            write_availability_file(file_path, num_employees, num_days, num_shifts, overlap=3.0, seed=0)
+            total_workload_limit = hours_per_employee * num_employees * num_days // 7
+            runs = [time_phases(file_path, total_workload_limit, temp_dir) for _ in range(repeat)]
+            # fastest run of each phase
+            timings = {phase: min(run_timings[phase] for run_timings, _ in runs) for phase in runs[0][0]}
+            results.append({
+                "num_employees": num_employees,
+                "num_days": num_days,
+                "num_shifts": num_shifts,
+                "total_workload_limit": total_workload_limit,
+                "seconds": timings,
+                "score": runs[0][1],
+            })
+            print(f"{num_employees:>6} employees {num_days:>3} days {num_shifts:>3} shifts: "
+                  + ", ".join(f"{phase} {seconds:.4f}s" for phase, seconds in timings.items()))
+    report = {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "results": results,
+    }
+    with open(output_path, mode='w') as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"Results are written to {output_path}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the scheduler on generated availability.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    engines_parser = subparsers.add_parser("engines", help="compare the greedy and min-cost flow engines")
+    engines_parser.add_argument("sizes", type=int, nargs="*", help="num_employees num_days num_shifts seed (default 500 28 20 0)")
+    suite_parser = subparsers.add_parser("suite", help="time each phase over size sweeps")
+    suite_parser.add_argument("--output", default="benchmark_results.json", help="path of the json results")
+    suite_parser.add_argument("--repeat", type=int, default=3, help="runs per size, the fastest is kept")
+    suite_parser.add_argument("--quick", action="store_true", help="small sizes only")
+    args = parser.parse_args()
+    if args.command == "engines":
+        compare_engines(*args.sizes)
+    else:
+        run_suite(args.output, repeat=args.repeat, quick=args.quick)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Generate synthetic availability files in the format read by load_availability:
+a header row, then one row per employee with the registration timestamp, the employee name
+and, for each day, either "off", "free" or a comma separated list of shift labels such as "8->12, 14->18".
+
+Usage: python generate_availability.py output.csv [--employees N] [--days N] [--shifts N] [--overlap X]
+                                       [--off-ratio X] [--free-ratio X] [--timestamp-spread DAYS] [--seed N]
+"""
+import argparse
+import csv
+import datetime
+import random
+
+from test import AvailabilityData
+
+# metadata to read the generated files with
+GENERATED_METADATA = {
+    "EMPLOYEE_NAME_COL_INDEX": 1,
+    "AVAILABILITY_START_COL_INDEX": 2,
+    "DELIMITER": ",",
+    "TIMESTAMP_COL_INDEX": 0,
+    "TIMESTAMP_FORMAT": "%m/%d/%Y %H:%M:%S",
+}
+
+
+def generate_shift_labels(num_shifts, overlap=2.0, opening_time=6, closing_time=24, rng=random):
+    """
+    Shift templates between opening and closing time; the first one starts at opening time and the last one ends at closing time.
+    overlap is the mean number of templates covering an hour of the day, it sets the mean shift length.
+    """
+    span = closing_time - opening_time
+    mean_length = min(span, max(2, round(overlap * span / num_shifts)))
+    shift_labels = {f"{opening_time}->{opening_time + mean_length}", f"{closing_time - mean_length}->{closing_time}"}
+    # there are only so many distinct templates of lengths mean_length +- 2
+    max_shifts = sum(span - length + 1 for length in range(max(1, mean_length - 2), min(span, mean_length + 2) + 1))
+    while len(shift_labels) < min(num_shifts, max_shifts):
+        length = min(span, max(1, mean_length + rng.randint(-2, 2)))
+        start_time = rng.randint(opening_time, closing_time - length)
+        shift_labels.add(f"{start_time}->{start_time + length}")
+    return sorted(shift_labels, key=lambda label: tuple(map(int, label.split("->"))))
+
+
+def generate_day_availability(num_shifts, off_ratio, free_ratio, mean_shifts_per_day, rng):
+    # "off", "free" or a sorted list of shift ids
+    draw = rng.random()
+    if draw < off_ratio:
+        return "off"
+    if draw < off_ratio + free_ratio:
+        return "free"
+    num_available_shifts = min(num_shifts, max(1, round(rng.expovariate(1 / mean_shifts_per_day))))
+    return sorted(rng.sample(range(num_shifts), num_available_shifts))
+
+
+def generate_availability_data(num_employees, num_days, num_shifts, overlap=2.0, off_ratio=0.2, free_ratio=0.1,
+                               mean_shifts_per_day=None, seed=0):
+    """
+    Generate availability in memory, as load_availability would return it for a generated file
+    (employees in registration order).
+    """
+    rng = random.Random(seed)
+    shift_labels = generate_shift_labels(num_shifts, overlap=overlap, rng=rng)
+    num_shifts = len(shift_labels)
+    mean_shifts_per_day = mean_shifts_per_day or max(1, num_shifts / 4)
+    day_labels = [f"Day {day + 1}" for day in range(num_days)]
+    employee_names = [f"Employee {employee_id + 1}" for employee_id in range(num_employees)]
+    availability = []
+    for _ in range(num_employees):
+        employee_availability = []
+        for _ in range(num_days):
+            day_availability = generate_day_availability(num_shifts, off_ratio, free_ratio, mean_shifts_per_day, rng)
+            if day_availability == "off":
+                day_availability = []
+            elif day_availability == "free":
+                day_availability = list(range(num_shifts))
+            employee_availability.append(day_availability)
+        availability.append(employee_availability)
+    return AvailabilityData(day_labels, shift_labels, employee_names, availability)
+
+
+def write_availability_file(file_path, num_employees, num_days, num_shifts, overlap=2.0, off_ratio=0.2, free_ratio=0.1,
+                            mean_shifts_per_day=None, timestamp_spread=14, seed=0):
+    """
+    Write a generated availability file, readable with GENERATED_METADATA.
+    Registration timestamps are spread uniformly over timestamp_spread days and written in random order.
+    """
+    rng = random.Random(seed)
+    shift_labels = generate_shift_labels(num_shifts, overlap=overlap, rng=rng)
+    num_shifts = len(shift_labels)
+    mean_shifts_per_day = mean_shifts_per_day or max(1, num_shifts / 4)
+    first_timestamp = datetime.datetime(2024, 8, 1)
+    with open(file_path, mode='w', newline='') as csvfile:
+        writer = csv.writer(csvfile, delimiter=GENERATED_METADATA["DELIMITER"])
+        writer.writerow(["Timestamp", "Name"] + [f"Day {day + 1}" for day in range(num_days)])
+        for employee_id in range(num_employees):
+            timestamp = first_timestamp + datetime.timedelta(seconds=rng.uniform(0, timestamp_spread * 24 * 3600))
+            row = [timestamp.strftime(GENERATED_METADATA["TIMESTAMP_FORMAT"]), f"Employee {employee_id + 1}"]
+            for _ in range(num_days):
+                day_availability = generate_day_availability(num_shifts, off_ratio, free_ratio, mean_shifts_per_day, rng)
+                if isinstance(day_availability, list):
+                    day_availability = ", ".join(shift_labels[shift_id] for shift_id in day_availability)
+                row.append(day_availability)
+            writer.writerow(row)
+    return shift_labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic availability file.")
+    parser.add_argument("output", help="path of the csv file to write")
+    parser.add_argument("--employees", type=int, default=100)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--shifts", type=int, default=8, help="number of shift templates")
+    parser.add_argument("--overlap", type=float, default=2.0, help="mean number of shift templates covering an hour")
+    parser.add_argument("--off-ratio", type=float, default=0.2, help="share of days marked 'off'")
+    parser.add_argument("--free-ratio", type=float, default=0.1, help="share of days marked 'free'")
+    parser.add_argument("--timestamp-spread", type=float, default=14, help="days over which registrations are spread")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    shift_labels = write_availability_file(
+        args.output, args.employees, args.days, args.shifts, overlap=args.overlap, off_ratio=args.off_ratio,
+        free_ratio=args.free_ratio, timestamp_spread=args.timestamp_spread, seed=args.seed,
+    )
+    print(f"Availability is written to {args.output}, shifts: {', '.join(shift_labels)}")
+    print(f"Metadata: {GENERATED_METADATA}")
+
+
+if __name__ == "__main__":
+    main()
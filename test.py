@@ -1,8 +1,33 @@
+import argparse
+import array
+import asyncio
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import copy
+import cProfile
+import functools
 import heapq
+import itertools
+import json
+import math
+import multiprocessing
+import operator
+import os
+import pstats
+import random
 import re
+import signal
+import socket
+import stat
+import struct
 import sys
 import csv
 import datetime
+import hashlib
+import time
+import zlib
 
 def binary_search(arr, target):
     left = 0
@@ -18,27 +43,88 @@ def binary_search(arr, target):
     return -1
 
 
+def to_bitmask(ids):
+    mask = 0
+    for i in ids:
+        mask |= 1 << i
+    return mask
+
+
+def iter_bits(mask):
+    # yield the indices of the set bits of mask in ascending order
+    while mask:
+        lowest_bit = mask & -mask
+        yield lowest_bit.bit_length() - 1
+        mask ^= lowest_bit
+
+
+def take_fitting(items, budget, key):
+    # the items whose keys fit in budget together, smallest first
+    fitting = []
+    for item in sorted(items, key=key):
+        budget -= key(item)
+        if budget < 0:
+            break
+        fitting.append(item)
+    return fitting
+
+
 class Employee:
-    def __init__(self, id, name, availability) -> None:
+    __slots__ = ("id", "name", "availability_in_week", "availability_mask", "is_active", "workloads", "workload_index")
+
+    def __init__(self, id, name, availability, workloads=None) -> None:
+        """
+        workloads is the array the workload is kept in, at index id (the Scheduler's workloads, shared by all employees);
+        without it the employee gets its own
+        """
         self.id = id
         self.name = name
         self.availability_in_week = availability # availability[day] = list of shifts that employee is available in that day
-        self.workload = 0
+        self.availability_mask = [to_bitmask(day_availability) for day_availability in availability] # availability_mask[day] = bitmask of shifts that employee is available in that day
+        self.is_active = True # removed employees keep their id but are no longer scheduled nor written
+        if workloads is None:
+            self.workloads, self.workload_index = array.array('q', [0]), 0
+        else:
+            self.workloads, self.workload_index = workloads, id
+
+    @property
+    def workload(self):
+        return self.workloads[self.workload_index]
+
+    def copy(self, workloads):
+        # same employee with its workload kept in workloads; availability lists are shared, the mask list is not (set_day_availability changes it in place)
+        employee = Employee.__new__(Employee)
+        employee.id = self.id
+        employee.name = self.name
+        employee.availability_in_week = self.availability_in_week
+        employee.availability_mask = list(self.availability_mask)
+        employee.is_active = self.is_active
+        employee.workloads, employee.workload_index = workloads, self.id
+        return employee
 
     
     def is_available(self, day_index, shift_index):
-        return shift_index in self.availability_in_week[day_index]
+        return (self.availability_mask[day_index] >> shift_index) & 1 == 1
 
 
     def get_day_availability(self, day_index):
         return self.availability_in_week[day_index]
+
+
+    def set_day_availability(self, day_index, shift_ids):
+        # copy, the availability lists may be shared with the AvailabilityData the employee was created from
+        self.availability_in_week = list(self.availability_in_week)
+        self.availability_in_week[day_index] = sorted(shift_ids)
+        self.availability_mask[day_index] = to_bitmask(shift_ids)
     
     
     def set_workload(self, workload):
-        self.workload = workload
+        self.workloads[self.workload_index] = workload
 
 
 class Shift:
+    __slots__ = ("id", "label", "start_time", "end_time", "workload_value", "is_main_shift", "is_even_numbered_shift", "backup_shift_id")
+
     def __init__(self, id, label, is_main_shift=True, is_even_numbered_shift=False) -> None:
         self.id = id
         self.label = label
@@ -63,128 +149,969 @@ class Shift:
 
 
 
-class EmployeeComparator:
-    def __init__(self, employee, day, shift) -> None:
-        self.employee = employee
-        self.compared_day = day
-        self.compared_shift = shift
+class IndexedHeap:
+    def __init__(self, keyed_items) -> None:
+        """
+        Binary min-heap of items ordered by their key, with an index of each item's position
+        so that the key of an item already in the heap can be decreased or increased in O(log n).
+        keyed_items is an iterable of (key, item); keys must be totally ordered (e.g. tuples) and items hashable.
+        """
+        self.heap = sorted(keyed_items) # a sorted list is a valid heap
+        self.position = {item: index for index, (_, item) in enumerate(self.heap)}
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __contains__(self, item):
+        return item in self.position
+
+    def is_empty(self):
+        return len(self.heap) == 0
+
+    def get_key(self, item):
+        return self.heap[self.position[item]][0]
+
+    def push(self, item, key):
+        self.heap.append((key, item))
+        self.position[item] = len(self.heap) - 1
+        self._sift_up(len(self.heap) - 1)
+
+    def pop(self):
+        key, item = self.heap[0]
+        last = self.heap.pop()
+        del self.position[item]
+        if self.heap:
+            self.heap[0] = last
+            self.position[last[1]] = 0
+            self._sift_down(0)
+        return item
+
+    def update(self, item, key):
+        # decrease or increase the key of an item in the heap
+        index = self.position[item]
+        old_key = self.heap[index][0]
+        self.heap[index] = (key, item)
+        if key < old_key:
+            self._sift_up(index)
+        else:
+            self._sift_down(index)
+
+    def _sift_up(self, index):
+        heap, position = self.heap, self.position
+        entry = heap[index]
+        while index > 0:
+            parent_index = (index - 1) >> 1
+            parent = heap[parent_index]
+            if entry[0] >= parent[0]:
+                break
+            heap[index] = parent
+            position[parent[1]] = index
+            index = parent_index
+        heap[index] = entry
+        position[entry[1]] = index
+
+    def _sift_down(self, index):
+        heap, position = self.heap, self.position
+        size = len(heap)
+        entry = heap[index]
+        while True:
+            child_index = 2 * index + 1
+            if child_index >= size:
+                break
+            if child_index + 1 < size and heap[child_index + 1][0] < heap[child_index][0]:
+                child_index += 1
+            child = heap[child_index]
+            if child[0] >= entry[0]:
+                break
+            heap[index] = child
+            position[child[1]] = index
+            index = child_index
+        heap[index] = entry
+        position[entry[1]] = index
 
 
-    # compare employees
+class TiedKeyEntry:
+    __slots__ = ("key", "item")
+
+    def __init__(self, key, item) -> None:
+        self.key = key
+        self.item = item
+
     def __lt__(self, other):
-        # TODO: more criteria to prioritize employees when assigning work can be added here
-        # first compare by workload
-        if self.employee.workload != other.employee.workload:
-            return self.employee.workload < other.employee.workload
-        
-        # then compare by today's availability from starting from the shift
-        employee_today_availability = self.employee.get_day_availability(self.compared_day)
-        other_today_availability = other.employee.get_day_availability(self.compared_day)
-        employee_shift_index = binary_search(employee_today_availability, self.compared_shift)
-        other_shift_index = binary_search(other_today_availability, self.compared_shift)
-        employee_num_available_shifts = len(employee_today_availability) - employee_shift_index
-        other_num_available_shifts = len(other_today_availability) - other_shift_index
-        return employee_num_available_shifts <= other_num_available_shifts
-        
+        # equal keys compare as less, as EmployeeComparator's <= did
+        return self.key <= other.key
+
 
 class PriorityQueue:
-    def __init__(self, iterable) -> None:
-        self.queue = iterable
+    def __init__(self, keyed_items) -> None:
+        """
+        heapq heap of items by key, built per use, where equal keys compare as less (see TiedKeyEntry):
+        ties pop in the order heapq's layout gives them, which depends on the order of keyed_items,
+        exactly as the heap of EmployeeComparator objects it replaces. keyed_items is an iterable of (key, item).
+        """
+        self.queue = [TiedKeyEntry(key, item) for key, item in keyed_items]
         heapq.heapify(self.queue)
 
-    def push(self, item):
-        heapq.heappush(self.queue, item)
+    def __len__(self):
+        return len(self.queue)
+
+    def push(self, item, key):
+        heapq.heappush(self.queue, TiedKeyEntry(key, item))
 
     def pop(self):
-        return heapq.heappop(self.queue)
-    
+        return heapq.heappop(self.queue).item
+
     def is_empty(self):
         return len(self.queue) == 0
 
 
+class MinCostFlow:
+    def __init__(self, num_nodes) -> None:
+        """
+        Min-cost max-flow on a directed graph with integer capacities and non-negative integer costs.
+        Edges are stored in flat lists; edge e and its residual edge e ^ 1 are added together.
+        """
+        self.num_nodes = num_nodes
+        self.graph = [[] for _ in range(num_nodes)] # graph[node] = list of outgoing edge ids
+        self.edge_to = []
+        self.edge_capacity = []
+        self.edge_cost = []
+
+    def add_node(self):
+        self.graph.append([])
+        self.num_nodes += 1
+        return self.num_nodes - 1
+
+    def add_edge(self, from_node, to_node, capacity, cost):
+        edge_id = len(self.edge_to)
+        self.edge_to += [to_node, from_node]
+        self.edge_capacity += [capacity, 0]
+        self.edge_cost += [cost, -cost]
+        self.graph[from_node].append(edge_id)
+        self.graph[to_node].append(edge_id + 1)
+        return edge_id
+
+    def get_flow(self, edge_id):
+        # flow on an edge is the capacity of its residual edge
+        return self.edge_capacity[edge_id ^ 1]
+
+    def solve(self, source, sink, deadline=None):
+        """
+        Primal-dual successive shortest paths: Dijkstra on reduced costs gives the node potentials,
+        then a blocking flow (as in Dinic) is pushed along all shortest paths at once.
+        Return (flow, cost), or None if time.perf_counter() passes the deadline.
+        """
+        INF = float('inf')
+        graph, edge_to, edge_capacity, edge_cost = self.graph, self.edge_to, self.edge_capacity, self.edge_cost
+        potential = [0] * self.num_nodes
+        total_flow = total_cost = 0
+        while True:
+            if deadline is not None and time.perf_counter() > deadline:
+                return None
+            # shortest distances from source on reduced costs
+            distance = [INF] * self.num_nodes
+            distance[source] = 0
+            queue = [(0, source)]
+            while queue:
+                node_distance, node = heapq.heappop(queue)
+                if node_distance > distance[node]:
+                    continue
+                node_potential = potential[node]
+                for edge_id in graph[node]:
+                    if edge_capacity[edge_id]:
+                        next_node = edge_to[edge_id]
+                        next_distance = node_distance + edge_cost[edge_id] + node_potential - potential[next_node]
+                        if next_distance < distance[next_node]:
+                            distance[next_node] = next_distance
+                            heapq.heappush(queue, (next_distance, next_node))
+            if distance[sink] == INF:
+                return total_flow, total_cost
+            for node in range(self.num_nodes):
+                if distance[node] != INF:
+                    potential[node] += distance[node]
+
+            # blocking flows on the admissible graph (residual edges with zero reduced cost)
+            while True:
+                level = [-1] * self.num_nodes
+                level[source] = 0
+                bfs_queue = [source]
+                for node in bfs_queue:
+                    for edge_id in graph[node]:
+                        next_node = edge_to[edge_id]
+                        if level[next_node] == -1 and edge_capacity[edge_id] and edge_cost[edge_id] + potential[node] == potential[next_node]:
+                            level[next_node] = level[node] + 1
+                            bfs_queue.append(next_node)
+                if level[sink] == -1:
+                    break
+                next_edge = [0] * self.num_nodes # current-arc pointers
+                while True:
+                    path = []
+                    node = source
+                    while node != sink:
+                        edges = graph[node]
+                        index = next_edge[node]
+                        while index < len(edges):
+                            edge_id = edges[index]
+                            next_node = edge_to[edge_id]
+                            if edge_capacity[edge_id] and level[next_node] == level[node] + 1 and edge_cost[edge_id] + potential[node] == potential[next_node]:
+                                break
+                            index += 1
+                        next_edge[node] = index
+                        if index < len(edges):
+                            path.append(edges[index])
+                            node = edge_to[edges[index]]
+                        elif path:
+                            # dead end, retreat and skip the edge that led here
+                            level[node] = -1
+                            node = edge_to[path.pop() ^ 1]
+                            next_edge[node] += 1
+                        else:
+                            break
+                    if node != sink:
+                        break
+                    flow = min(edge_capacity[edge_id] for edge_id in path)
+                    for edge_id in path:
+                        edge_capacity[edge_id] -= flow
+                        edge_capacity[edge_id ^ 1] += flow
+                        total_cost += flow * edge_cost[edge_id]
+                    total_flow += flow
+
+
+class ShiftIntervalIndex:
+    def __init__(self, shifts) -> None:
+        """
+        Index over shifts sorted by start time, answering "which shifts cover this time range" with a bisect
+        on the start times. Answers are memoized since the same ranges are queried over and over.
+        """
+        self.shifts = shifts
+        self.start_times = [shift.start_time for shift in shifts]
+        self.covering_shift_ids = {} # covering_shift_ids[(start_time, end_time)] = ids of shifts covering that time range
+
+    def get_shifts_covering_time_range(self, start_time, end_time):
+        shift_ids = self.covering_shift_ids.get((start_time, end_time))
+        if shift_ids is None:
+            # only shifts starting at or before start_time can cover the range
+            num_candidates = bisect.bisect_right(self.start_times, start_time)
+            shift_ids = [shift.id for shift in self.shifts[:num_candidates] if shift.end_time >= end_time]
+            self.covering_shift_ids[(start_time, end_time)] = shift_ids
+        return shift_ids
+
+
+def get_special_requirement_list(special_requirement):
+    # a special requirement is a dict, or a list of dicts for several time windows and days
+    if not special_requirement:
+        return []
+    if isinstance(special_requirement, dict):
+        return [special_requirement]
+    return list(special_requirement)
+
+
+class CoverageRequirements:
+    def __init__(self, requirements, schedule, shift_interval_index) -> None:
+        """
+        Headcount requirements, keyed by (day, start_time, end_time): at least num_assignees_required employees must work
+        a shift covering the time range, extra_shift_id is the shift staffed to make up the difference.
+        requirements is a dict (day, start_time, end_time) -> (num_assignees_required, extra_shift_id).
+        The number of assignees of each requirement is counted on schedule[day][shift] once, then kept up to date
+        with add_assignees; each day has a heap of its requirements by deficit, so the largest one is found in O(log n).
+        """
+        self.keys = list(requirements) # keys[requirement_id] = (day, start_time, end_time)
+        self.num_assignees_required = [num_assignees_required for num_assignees_required, _ in requirements.values()]
+        self.extra_shift_ids = [extra_shift_id for _, extra_shift_id in requirements.values()]
+        self.num_assignees = [0] * len(self.keys)
+        num_days, num_shifts = len(schedule), len(shift_interval_index.shifts)
+        self.requirement_ids_by_day = [[] for _ in range(num_days)]
+        self.requirement_ids_by_shift = [[[] for _ in range(num_shifts)] for _ in range(num_days)] # [day][shift] = requirements the shift counts for
+        for requirement_id, (day_index, start_time, end_time) in enumerate(self.keys):
+            self.requirement_ids_by_day[day_index].append(requirement_id)
+            for shift_id in shift_interval_index.get_shifts_covering_time_range(start_time, end_time):
+                self.requirement_ids_by_shift[day_index][shift_id].append(requirement_id)
+                self.num_assignees[requirement_id] += len(schedule[day_index][shift_id])
+        self.deficit_heaps = [
+            IndexedHeap((self.get_heap_key(requirement_id), requirement_id) for requirement_id in requirement_ids)
+            for requirement_ids in self.requirement_ids_by_day
+        ]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get_deficit(self, requirement_id):
+        return self.num_assignees_required[requirement_id] - self.num_assignees[requirement_id]
+
+    def get_heap_key(self, requirement_id):
+        # largest deficit first, then in the order requirements were given
+        return (-self.get_deficit(requirement_id), requirement_id)
+
+    def add_assignees(self, day_index, shift_index, amount):
+        # amount employees were put on (or removed from, if negative) the shift in that day
+        heap = self.deficit_heaps[day_index]
+        for requirement_id in self.requirement_ids_by_shift[day_index][shift_index]:
+            self.num_assignees[requirement_id] += amount
+            if requirement_id in heap:
+                heap.update(requirement_id, self.get_heap_key(requirement_id))
+
+    def get_deficits(self):
+        """
+        Return list of (day_index, start_time, end_time, num_assignees_required, num_assignees) for the requirements not met
+        """
+        return [
+            (*self.keys[requirement_id], self.num_assignees_required[requirement_id], self.num_assignees[requirement_id])
+            for requirement_id in range(len(self.keys))
+            if self.get_deficit(requirement_id) > 0
+        ]
+
+
+class ConstrainedSlotQueue:
+    def __init__(self, slots, candidate_availability, occupancy, workloads, shift_workloads, workload_limit) -> None:
+        """
+        Queue of (day, shift) slots, the slot with the fewest remaining candidates first (as DSATUR colors the most
+        constrained vertex first). A remaining candidate is an employee available for the shift that day, not working
+        that day yet and whose workload leaves room for the shift under workload_limit.
+        candidate_availability, occupancy and workloads are the scheduler's own and are read as they change;
+        update_employee adjusts the counts of the slots an assignment change affects instead of recounting every slot.
+        """
+        self.candidate_availability = candidate_availability
+        self.occupancy = occupancy
+        self.workloads = workloads
+        self.shift_workloads = shift_workloads
+        self.workload_limit = workload_limit
+        self.room_masks = [ # room_masks[shift] = bitmask of employees whose workload leaves room for that shift
+            to_bitmask(employee_id for employee_id, workload in enumerate(workloads) if self.has_room(workload, shift_workload))
+            for shift_workload in shift_workloads
+        ]
+        self.num_candidates = {slot: self.count_candidates(*slot) for slot in slots} # for the slots in the queue
+        self.heap = IndexedHeap(((num_candidates, slot), slot) for slot, num_candidates in self.num_candidates.items())
+
+    def __len__(self):
+        return len(self.heap)
+
+    def has_room(self, workload, shift_workload):
+        # as can_assign checks the per-person workload limit
+        return workload < self.workload_limit and workload + shift_workload <= self.workload_limit
+
+    def count_candidates(self, day_index, shift_index):
+        return (self.candidate_availability[day_index][shift_index] & ~self.occupancy[day_index] & self.room_masks[shift_index]).bit_count()
+
+    def pop(self):
+        slot = self.heap.pop()
+        del self.num_candidates[slot]
+        return slot
+
+    def get_slots(self):
+        # slots still in the queue, in the order they would be popped if nothing changed
+        return [slot for _, slot in sorted(self.heap.heap)]
+
+    def add_candidates(self, slot, amount):
+        if slot in self.heap:
+            self.num_candidates[slot] += amount
+            self.heap.update(slot, (self.num_candidates[slot], slot))
+
+    def update_employee(self, employee_id, day_index, old_workload):
+        """
+        The employee was put on (or removed from) a shift of that day, occupancy and workloads are already updated.
+        Only the slots of that day and, if the employee's room for some shift changed, the slots of that shift change.
+        """
+        employee_bit = 1 << employee_id
+        workload = self.workloads[employee_id]
+        is_working = self.occupancy[day_index] & employee_bit
+        day_candidate_availability = self.candidate_availability[day_index]
+        for shift_index, shift_workload in enumerate(self.shift_workloads):
+            if day_candidate_availability[shift_index] & employee_bit:
+                if is_working and self.room_masks[shift_index] & employee_bit:
+                    self.add_candidates((day_index, shift_index), -1)
+                elif not is_working and self.has_room(workload, shift_workload):
+                    self.add_candidates((day_index, shift_index), 1)
+        if workload == old_workload:
+            return
+        for shift_index, shift_workload in enumerate(self.shift_workloads):
+            has_room = self.has_room(workload, shift_workload)
+            if has_room == bool(self.room_masks[shift_index] & employee_bit):
+                continue
+            self.room_masks[shift_index] ^= employee_bit
+            for other_day_index, day_occupancy in enumerate(self.occupancy):
+                if other_day_index != day_index and not day_occupancy & employee_bit \
+                        and self.candidate_availability[other_day_index][shift_index] & employee_bit:
+                    self.add_candidates((other_day_index, shift_index), 1 if has_room else -1)
+
+
+class ScheduleObjective:
+    def __init__(self, scheduler) -> None:
+        """
+        score_schedule of the scheduler's schedule, kept up to date as employees are put on and removed from shifts
+        (see Scheduler.improve_schedule), so a change is scored in O(1) instead of a pass over the schedule:
+        unassigned main shifts from the headcounts of the main shift and its backup, missing headcount from the deficits
+        of the coverage requirements the shift counts for, workload variance from the sum and sum of squares of the workloads.
+        """
+        self.schedule = scheduler.schedule
+        self.requirements = scheduler.coverage_requirements
+        self.num_employees = scheduler.num_employees
+        self.backup_shift_ids = [shift.backup_shift_id for shift in scheduler.shifts]
+        self.main_shift_ids = [[] for _ in range(scheduler.num_shifts)] # main_shift_ids[shift] = main shifts whose slot the shift fills, itself or those it is backup for
+        for shift in scheduler.shifts:
+            if shift.is_main_shift:
+                self.main_shift_ids[shift.id].append(shift.id)
+                if shift.backup_shift_id != -1:
+                    self.main_shift_ids[shift.backup_shift_id].append(shift.id)
+        self.num_unassigned_shifts = sum(len(scheduler.get_unassigned_shifts(day_index)) for day_index in range(scheduler.num_days))
+        requirements = self.requirements
+        self.missing_headcount = sum(max(0, requirements.get_deficit(requirement_id)) for requirement_id in range(len(requirements))) if requirements is not None else 0
+        self.total_workload = scheduler.total_workload
+        self.sum_squared_workloads = sum(workload * workload for workload in scheduler.workloads)
+
+    def update(self, day_index, shift_index, amount, workload, shift_workload):
+        # an employee was put on (amount 1) or removed from (amount -1) the shift, its workload is now workload;
+        # the schedule and the coverage requirement headcounts are already updated
+        day_schedule = self.schedule[day_index]
+        for main_shift_id in self.main_shift_ids[shift_index]:
+            backup_shift_id = self.backup_shift_ids[main_shift_id]
+            num_staffed = len(day_schedule[main_shift_id]) + (len(day_schedule[backup_shift_id]) if backup_shift_id != -1 else 0)
+            self.num_unassigned_shifts += (num_staffed == 0) - (num_staffed == amount)
+        if self.requirements is not None:
+            for requirement_id in self.requirements.requirement_ids_by_shift[day_index][shift_index]:
+                deficit = self.requirements.get_deficit(requirement_id)
+                self.missing_headcount += max(0, deficit) - max(0, deficit + amount)
+        old_workload = workload - amount * shift_workload
+        self.total_workload += amount * shift_workload
+        self.sum_squared_workloads += workload * workload - old_workload * old_workload
+
+    def get_score_key(self):
+        # score_schedule with the variance times num_employees ** 2, an integer, so keys compare exactly
+        return (self.num_unassigned_shifts, self.missing_headcount, self.num_employees * self.sum_squared_workloads - self.total_workload ** 2)
+
+    def get_min_variance_key(self):
+        # lowest variance key for the total workload, every workload within one hour of the mean
+        _, remainder = divmod(self.total_workload, self.num_employees)
+        return remainder * (self.num_employees - remainder)
+
+    def get_score(self):
+        num_unassigned_shifts, missing_headcount, variance_key = self.get_score_key()
+        return (num_unassigned_shifts, missing_headcount, variance_key / self.num_employees ** 2 if self.num_employees else 0)
+
+
+class AvailabilityData:
+    def __init__(self, day_labels, shift_labels, employee_names, availability) -> None:
+        """
+        Parsed content of an availability file.
+        Shift labels are sorted by start time, employees are sorted ascending by registration timestamp.
+        availability[employee][day] = list of shift ids that employee is available in that day
+        """
+        self.day_labels = day_labels
+        self.shift_labels = shift_labels
+        self.employee_names = employee_names
+        self.availability = availability
+
+
+def get_shift_label_sort_key(shift_label):
+    # shifts are ordered by start time, then end time
+    return tuple(map(int, re.findall(r'\d+', shift_label)))
+
+
+def load_availability(file_path, metadata) -> AvailabilityData:
+    """
+    Read the availability file in a single pass.
+    Each timestamp is parsed once and shift labels are given provisional ids through a dict while streaming;
+    the provisional ids are remapped to the final (start time ordered) shift ids once all labels are known.
+    """
+    AVAILABILITY_START_COL_INDEX = metadata["AVAILABILITY_START_COL_INDEX"]
+    EMPLOYEE_NAME_COL_INDEX = metadata["EMPLOYEE_NAME_COL_INDEX"]
+    DELIMITER = metadata["DELIMITER"]
+    TIMESTAMP_COL_INDEX = metadata["TIMESTAMP_COL_INDEX"]
+    TIMESTAMP_FORMAT = metadata["TIMESTAMP_FORMAT"]
+    FREE = None # placeholder for days the employee is available for every shift
+
+    provisional_shift_ids = {} # shift label -> provisional id, in order of first appearance
+    rows = [] # (timestamp, employee name, availability with provisional shift ids)
+    with open(file_path, newline='') as csvfile:
+        reader = csv.reader(csvfile, delimiter=DELIMITER)
+        header = next(reader)
+        day_labels = header[AVAILABILITY_START_COL_INDEX:]
+        strptime = datetime.datetime.strptime
+        for row in reader:
+            employee_availability = []
+            # day_availability is a string of comma separated shifts, containing the shifts that the employee is available for that day
+            for day_availability in row[AVAILABILITY_START_COL_INDEX:]:
+                day_availability = day_availability.lower().strip()
+                if day_availability == 'off':
+                    employee_availability.append([])
+                elif day_availability == 'free':
+                    employee_availability.append(FREE)
+                else:
+                    day_shift_ids = []
+                    for shift in day_availability.split(","):
+                        shift = shift.strip()
+                        shift_id = provisional_shift_ids.get(shift)
+                        if shift_id is None:
+                            shift_id = provisional_shift_ids[shift] = len(provisional_shift_ids)
+                        day_shift_ids.append(shift_id)
+                    employee_availability.append(day_shift_ids)
+            # a row with fewer day cells than the header is off on the missing days
+            employee_availability.extend([] for _ in range(len(day_labels) - len(employee_availability)))
+            rows.append((strptime(row[TIMESTAMP_COL_INDEX], TIMESTAMP_FORMAT), row[EMPLOYEE_NAME_COL_INDEX], employee_availability))
+
+    shift_labels = sorted(provisional_shift_ids, key=get_shift_label_sort_key)
+    final_shift_ids = [0] * len(shift_labels) # final_shift_ids[provisional id] = shift id
+    for shift_id, shift_label in enumerate(shift_labels):
+        final_shift_ids[provisional_shift_ids[shift_label]] = shift_id
+    all_shift_ids = list(range(len(shift_labels)))
+
+    # sort rows by timestamp (stable, so rows with the same timestamp keep their file order)
+    rows.sort(key=lambda row: row[0])
+    employee_names = [employee_name for _, employee_name, _ in rows]
+    availability = [
+        [
+            list(all_shift_ids) if day_shift_ids is FREE else [final_shift_ids[shift_id] for shift_id in day_shift_ids]
+            for day_shift_ids in employee_availability
+        ]
+        for _, _, employee_availability in rows
+    ]
+    return AvailabilityData(day_labels, shift_labels, employee_names, availability)
+
+
+AVAILABILITY_CACHE_MAGIC = b"AVLC"
+AVAILABILITY_CACHE_VERSION = 1
+AVAILABILITY_CACHE_HEADER = struct.Struct("<4sB32sIIII") # magic, version, key, num_employees, num_days, number of shift ids, labels size
+AVAILABILITY_CACHE_EXTENSION = ".avc"
+DEFAULT_AVAILABILITY_CACHE_DIR = ".availability_cache"
+
+
+def get_availability_cache_key(file_path, metadata):
+    # sha256 of the file content, the metadata it is read with and the cache format version
+    digest = hashlib.sha256()
+    with open(file_path, mode='rb') as availability_file:
+        for chunk in iter(lambda: availability_file.read(1 << 20), b""):
+            digest.update(chunk)
+    digest.update(json.dumps(metadata, sort_keys=True).encode())
+    digest.update(bytes([AVAILABILITY_CACHE_VERSION]))
+    return digest.digest()
+
+
+def write_availability_cache(cache_path, key, availability_data):
+    """
+    Write the parsed availability as:
+        header (AVAILABILITY_CACHE_HEADER), json labels {"day_labels", "shift_labels", "employee_names"},
+        uint32 offsets[num_employees * num_days + 1] and uint16 shift ids, little-endian:
+        the shift ids of (employee, day) are shift_ids[offsets[employee * num_days + day]:offsets[employee * num_days + day + 1]]
+    Shift ids keep the order of the file, so a cached load gives exactly what load_availability gives.
+    The file is written next to its final path and renamed, so readers never see a partial cache.
+    """
+    labels = json.dumps({
+        "day_labels": availability_data.day_labels,
+        "shift_labels": availability_data.shift_labels,
+        "employee_names": availability_data.employee_names,
+    }).encode()
+    offsets = array.array('I', [0])
+    shift_ids = array.array('H')
+    for employee_availability in availability_data.availability:
+        for day_availability in employee_availability:
+            shift_ids.extend(day_availability)
+            offsets.append(len(shift_ids))
+    if sys.byteorder == "big":
+        offsets.byteswap()
+        shift_ids.byteswap()
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, mode='wb') as cache_file:
+            cache_file.write(AVAILABILITY_CACHE_HEADER.pack(
+                AVAILABILITY_CACHE_MAGIC, AVAILABILITY_CACHE_VERSION, key,
+                len(availability_data.employee_names), len(availability_data.day_labels), len(shift_ids), len(labels),
+            ))
+            cache_file.write(labels)
+            cache_file.write(offsets.tobytes())
+            cache_file.write(shift_ids.tobytes())
+        os.replace(temp_path, cache_path)
+    except BaseException:
+        # no partial file is left behind in the cache directory
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
+
+
+def read_availability_cache(cache_path, key):
+    """
+    Read a cache written by write_availability_cache and return its AvailabilityData,
+    or None if the file is missing, truncated or written for another key.
+    The whole file is read at once: every cell becomes a list anyway, so mapping it would save nothing.
+    """
+    try:
+        with open(cache_path, mode='rb') as cache_file:
+            buffer = cache_file.read()
+        if len(buffer) < AVAILABILITY_CACHE_HEADER.size:
+            return None
+        magic, version, cache_key, num_employees, num_days, num_shift_ids, labels_size = AVAILABILITY_CACHE_HEADER.unpack_from(buffer)
+        offsets_start = AVAILABILITY_CACHE_HEADER.size + labels_size
+        shift_ids_start = offsets_start + (num_employees * num_days + 1) * 4
+        shift_ids_end = shift_ids_start + num_shift_ids * 2
+        if magic != AVAILABILITY_CACHE_MAGIC or version != AVAILABILITY_CACHE_VERSION or cache_key != key or len(buffer) != shift_ids_end:
+            return None
+        labels = json.loads(buffer[AVAILABILITY_CACHE_HEADER.size:offsets_start].decode())
+        offsets = array.array('I', buffer[offsets_start:shift_ids_start])
+        shift_ids = array.array('H', buffer[shift_ids_start:shift_ids_end])
+    except (OSError, ValueError):
+        return None
+    if sys.byteorder == "big":
+        offsets.byteswap()
+        shift_ids.byteswap()
+
+    shift_ids = shift_ids.tolist()
+    offsets = offsets.tolist()
+    cells = [shift_ids[start:end] for start, end in zip(offsets, itertools.islice(offsets, 1, None))]
+    availability = [cells[employee_id * num_days:(employee_id + 1) * num_days] for employee_id in range(num_employees)]
+    return AvailabilityData(labels["day_labels"], labels["shift_labels"], labels["employee_names"], availability)
+
+
+def load_availability_cached(file_path, metadata, cache_dir) -> AvailabilityData:
+    """
+    load_availability through an on-disk cache of the parsed file in cache_dir.
+    The cache is keyed by the file content and the metadata: when either changes the file is parsed again,
+    the new cache is written and the caches of earlier versions of the file are removed.
+    """
+    key = get_availability_cache_key(file_path, metadata)
+    # files with the same name in other directories get their own caches
+    path_digest = hashlib.sha256(os.path.abspath(file_path).encode()).hexdigest()[:8]
+    cache_prefix = os.path.join(cache_dir, f"{os.path.basename(file_path)}.{path_digest}.")
+    cache_path = cache_prefix + key.hex()[:32] + AVAILABILITY_CACHE_EXTENSION
+    availability_data = read_availability_cache(cache_path, key)
+    if availability_data is not None:
+        return availability_data
+
+    availability_data = load_availability(file_path, metadata)
+    os.makedirs(cache_dir, exist_ok=True)
+    for file_name in os.listdir(cache_dir):
+        stale_path = os.path.join(cache_dir, file_name)
+        if stale_path.startswith(cache_prefix) and stale_path.endswith(AVAILABILITY_CACHE_EXTENSION) and stale_path != cache_path:
+            with contextlib.suppress(OSError):
+                os.remove(stale_path)
+    write_availability_cache(cache_path, key, availability_data)
+    return availability_data
+
+
+class InstrumentationReport:
+    """
+    What a RecordingInstrumentation collected: seconds spent in each phase, counters and events.
+    Each event is a dict with its kind, a readable message and the fields of the event.
+    """
+    def __init__(self) -> None:
+        self.phase_seconds = {} # phase_seconds[phase] = total seconds spent in that phase
+        self.counters = {} # counters[name] = number of times it happened
+        self.events = [] # in the order they happened
+
+    def get_events(self, kind):
+        return [event for event in self.events if event["kind"] == kind]
+
+    def to_dict(self):
+        return {"phase_seconds": dict(self.phase_seconds), "counters": dict(self.counters), "events": list(self.events)}
+
+    def format(self):
+        lines = [event["message"] for event in self.events]
+        lines += [f"{phase}: {seconds:.4f}s" for phase, seconds in self.phase_seconds.items()]
+        lines += [f"{name}: {value}" for name, value in self.counters.items()]
+        return "\n".join(lines)
+
+
+class Instrumentation:
+    """
+    Hooks the scheduler reports to: phase(name) times a block, count(name, amount) adds to a counter
+    and event(kind, message, **fields) records a diagnostic such as an unmet requirement or a coverage gap.
+    This base class does nothing and is the default; hot loops count in local variables and call count() once per call,
+    so the default costs a few method calls per shift, not per heap pop. Callers check enabled before building an event,
+    so without a recording instrumentation no message is formatted (and no coverage gap searched for).
+    """
+    enabled = False
+
+    def phase(self, name):
+        return contextlib.nullcontext()
+
+    def count(self, name, amount=1):
+        pass
+
+    def event(self, kind, message, **fields):
+        pass
+
+
+class RecordingInstrumentation(Instrumentation):
+    # collect everything into self.report
+    enabled = True
+
+    def __init__(self) -> None:
+        self.report = InstrumentationReport()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.report.phase_seconds[name] = self.report.phase_seconds.get(name, 0) + time.perf_counter() - start
+
+    def count(self, name, amount=1):
+        self.report.counters[name] = self.report.counters.get(name, 0) + amount
+
+    def event(self, kind, message, **fields):
+        self.report.events.append({"kind": kind, "message": message, **fields})
+
+
+NO_INSTRUMENTATION = Instrumentation()
+
+
+def profile_call(function, *args, output_path=None, sort="cumulative", limit=30, **kwargs):
+    """
+    Run function(*args, **kwargs) once under cProfile and return its result.
+    The stats are saved to output_path if given (for pstats or snakeviz), otherwise the first `limit` entries sorted by `sort` are printed.
+    """
+    profiler = cProfile.Profile()
+    result = profiler.runcall(function, *args, **kwargs)
+    if output_path:
+        profiler.dump_stats(output_path)
+    else:
+        pstats.Stats(profiler).sort_stats(sort).print_stats(limit)
+    return result
+
+
+@contextlib.contextmanager
+def open_output(file, binary=False):
+    # file is a path, opened and closed here, or a file object the caller owns
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, mode='wb' if binary else 'w', **({} if binary else {"newline": ''})) as output_file:
+            yield output_file
+    else:
+        yield file
+
+
+class CsvOutputWriter:
+    # the semicolon separated tables written by the scheduler from the start
+    binary = False
+
+    def __init__(self, day_labels, shift_labels, employee_names) -> None:
+        self.day_labels = day_labels
+        self.shift_labels = shift_labels
+        self.employee_names = employee_names
+
+    def write_schedule(self, file, rows):
+        writer = csv.writer(file, delimiter=';')
+        writer.writerow(["Shifts"] + self.day_labels)
+        employee_names = self.employee_names
+        for shift_id, day_employee_ids in rows:
+            writer.writerow([self.shift_labels[shift_id]] + [
+                ", ".join([employee_names[employee_id] for employee_id in employee_ids]) if employee_ids else "None"
+                for employee_ids in day_employee_ids
+            ])
+
+    def write_assignment(self, file, rows):
+        writer = csv.writer(file, delimiter=';')
+        writer.writerow(["Employee"] + self.day_labels + ["Total Workload"])
+        shift_labels = self.shift_labels + ["None"] # shift id -1 is written as None
+        for employee_id, employee_assignment, workload in rows:
+            writer.writerow([self.employee_names[employee_id]] + [shift_labels[shift_id] for shift_id in employee_assignment] + [workload])
+
+
+class JsonLinesOutputWriter(CsvOutputWriter):
+    # one json object per shift (schedule) or per employee (assignment), keyed by day label
+    def iter_schedule_records(self, rows):
+        employee_names = self.employee_names
+        for shift_id, day_employee_ids in rows:
+            days = {day_label: [employee_names[employee_id] for employee_id in employee_ids] for day_label, employee_ids in zip(self.day_labels, day_employee_ids)}
+            yield {"shift": self.shift_labels[shift_id], "days": days}
+
+    def iter_assignment_records(self, rows):
+        shift_labels = self.shift_labels + [None]
+        for employee_id, employee_assignment, workload in rows:
+            days = {day_label: shift_labels[shift_id] for day_label, shift_id in zip(self.day_labels, employee_assignment)}
+            yield {"employee": self.employee_names[employee_id], "days": days, "total_workload": workload}
+
+    def write_schedule(self, file, rows):
+        for record in self.iter_schedule_records(rows):
+            file.write(json.dumps(record) + "\n")
+
+    def write_assignment(self, file, rows):
+        for record in self.iter_assignment_records(rows):
+            file.write(json.dumps(record) + "\n")
+
+
+class BinaryOutputWriter(CsvOutputWriter):
+    """
+    Columnar little-endian format for analytics, read back with read_binary_output:
+        magic b"SCHB", uint8 version, uint8 view (0 schedule, 1 assignment), uint32 header length, json header
+        {"days": day labels, "shifts": shift labels, "employees": employee names}, then the columns:
+        schedule: int32 offsets[num_shifts * num_days + 1] into int32 employee indexes, cells in shift-major order
+        assignment: one int32 column of shift ids (-1 for none) per day, then an int64 workload column, one row per employee
+    """
+    binary = True
+    MAGIC = b"SCHB"
+    VERSION = 1
+    SCHEDULE_VIEW, ASSIGNMENT_VIEW = 0, 1
+
+    def write_header(self, file, view, employee_names):
+        header = json.dumps({"days": self.day_labels, "shifts": self.shift_labels, "employees": employee_names}).encode()
+        file.write(self.MAGIC + struct.pack("<BBI", self.VERSION, view, len(header)) + header)
+
+    @staticmethod
+    def write_column(file, column):
+        if sys.byteorder == "big":
+            column.byteswap()
+        file.write(column.tobytes())
+
+    def write_schedule(self, file, rows):
+        self.write_header(file, self.SCHEDULE_VIEW, self.employee_names)
+        offsets = array.array('i', [0])
+        employee_indexes = array.array('i')
+        for _, day_employee_ids in rows:
+            for employee_ids in day_employee_ids:
+                employee_indexes.extend(employee_ids)
+                offsets.append(len(employee_indexes))
+        self.write_column(file, offsets)
+        self.write_column(file, employee_indexes)
+
+    def write_assignment(self, file, rows):
+        employee_names = []
+        day_columns = [array.array('i') for _ in self.day_labels]
+        workloads = array.array('q')
+        for employee_id, employee_assignment, workload in rows:
+            employee_names.append(self.employee_names[employee_id])
+            for day_column, shift_id in zip(day_columns, employee_assignment):
+                day_column.append(shift_id)
+            workloads.append(workload)
+        self.write_header(file, self.ASSIGNMENT_VIEW, employee_names)
+        for day_column in day_columns:
+            self.write_column(file, day_column)
+        self.write_column(file, workloads)
+
+
+OUTPUT_WRITERS = {"csv": CsvOutputWriter, "jsonl": JsonLinesOutputWriter, "binary": BinaryOutputWriter}
+OUTPUT_EXTENSIONS = {"csv": ".csv", "jsonl": ".jsonl", "binary": ".bin"}
+
+
+def read_binary_output(file):
+    """
+    Read a file written by BinaryOutputWriter (a path or a binary file object).
+    Return a dict with the header fields, "view" ("schedule" or "assignment") and the columns:
+    "offsets" and "employee_indexes" for the schedule, "days" columns as "shift_ids" and "workloads" for the assignment.
+    """
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, mode='rb') as input_file:
+            return read_binary_output(input_file)
+    magic = file.read(4)
+    if magic != BinaryOutputWriter.MAGIC:
+        raise ValueError("Not a binary schedule output")
+    version, view, header_length = struct.unpack("<BBI", file.read(6))
+    if version != BinaryOutputWriter.VERSION:
+        raise ValueError(f"Unsupported binary output version: {version}")
+    output = json.loads(file.read(header_length).decode())
+
+    def read_column(typecode, length):
+        column = array.array(typecode)
+        column.frombytes(file.read(length * column.itemsize))
+        if sys.byteorder == "big":
+            column.byteswap()
+        return column
+
+    num_days, num_shifts = len(output["days"]), len(output["shifts"])
+    if view == BinaryOutputWriter.SCHEDULE_VIEW:
+        output["view"] = "schedule"
+        output["offsets"] = read_column('i', num_shifts * num_days + 1)
+        output["employee_indexes"] = read_column('i', output["offsets"][-1])
+    else:
+        output["view"] = "assignment"
+        num_rows = len(output["employees"])
+        output["shift_ids"] = [read_column('i', num_rows) for _ in range(num_days)]
+        output["workloads"] = read_column('q', num_rows)
+    return output
+
+
 class Scheduler:
-    def __init__(self, availability_file_path, metadata, total_workload_limit=None) -> None:
+    def __init__(self, availability_file_path, metadata, total_workload_limit=None, check_consistency=False, instrumentation=None,
+                 availability_cache_dir=None) -> None:
         """
         Shifts are sorted by start time
         Employees, Employee availability, and Shift availability are sorted ascending by registration timestamp
+        With check_consistency, the occupancy index is cross-validated against the schedule after every change (for tests)
+        instrumentation (an Instrumentation) receives phase timings, counters and diagnostics; by default nothing is recorded
+        With availability_cache_dir, the parsed availability file is cached there (see load_availability_cached)
         """
-        self.day_labels, self.shift_labels = self.extract_shift_and_day_labels(availability_file_path, metadata)
+        self.instrumentation = instrumentation or NO_INSTRUMENTATION
+        if isinstance(availability_file_path, AvailabilityData):
+            availability_data = availability_file_path
+        else:
+            with self.instrumentation.phase("load_availability"):
+                if availability_cache_dir:
+                    availability_data = load_availability_cached(availability_file_path, metadata, availability_cache_dir)
+                else:
+                    availability_data = load_availability(availability_file_path, metadata)
+        self.day_labels = availability_data.day_labels
+        self.shift_labels = availability_data.shift_labels
 
-        employee_names, availability = self.extract_employee_availability(availability_file_path, metadata) # index of employee_names and availability corresponds to employee_id
+        employee_names = availability_data.employee_names
+        availability = availability_data.availability # index of employee_names and availability corresponds to employee_id
 
         self.num_employees = len(employee_names)
         self.num_days = len(self.day_labels)
         self.num_shifts = len(self.shift_labels)
 
         self.shifts = [Shift(i, self.shift_labels[i]) for i in range(self.num_shifts)]
+        self.shift_interval_index = ShiftIntervalIndex(self.shifts)
         self.covering_shifts_map = self.map_shifts_to_covering_shifts()
+        self.OPENING_TIME = self.shifts[0].start_time if self.shifts else 0
+        self.CLOSING_TIME = self.shifts[-1].end_time if self.shifts else 0
 
         
-        self.employees = [Employee(i, employee_names[i], availability[i]) for i in range(self.num_employees)]
+        self.workloads = array.array('q', [0]) * self.num_employees # workloads[employee] = hours assigned to that employee, shared with the Employee objects
+        self.employees = [Employee(i, employee_names[i], availability[i], self.workloads) for i in range(self.num_employees)]
         
+        self.total_workload_limit = total_workload_limit
         self.TOTAL_WORKLOAD_LIMIT = total_workload_limit if total_workload_limit else sys.maxsize
-        self.total_workload = 0
         self.WORKLOAD_LIMIT_PER_PERSON = total_workload_limit / self.num_employees if total_workload_limit else sys.maxsize
-        
-        self.shift_availability = self.create_shift_availability(availability)
+
+        with self.instrumentation.phase("create_shift_availability"):
+            self.shift_availability = self.create_shift_availability(availability)
+            self.candidate_availability = self.create_candidate_availability()
+        self.check_consistency = check_consistency
+        self.init_schedule_state()
+
+
+    def init_schedule_state(self):
+        # empty schedule and everything derived from it
+        self.total_workload = 0
+        self.total_workload_exceeded_reported = False # the total workload limit is reported once per assign_work
         self.schedule = [[[] for _ in range(self.num_shifts)] for _ in range(self.num_days)] # schedule[day][shift] = [employee_id] list of employees assigned to that shift in that day
-        self.assignment = [[-1 for _ in range(self.num_days)] for _ in range(self.num_employees)] # assignment[employee][day] = shift assigned to that employee in that day
-
-
-    def extract_shift_and_day_labels(self, file_path, metadata):
-        AVAILABILITY_START_COL_INDEX = metadata["AVAILABILITY_START_COL_INDEX"]
-        DELIMITER = metadata["DELIMITER"]
-        shift_labels = set()
-        with open(file_path, newline='') as csvfile:
-            reader = csv.reader(csvfile, delimiter=DELIMITER)
-            header = next(reader)
-            day_labels = header[AVAILABILITY_START_COL_INDEX:]
-            rows = [row for row in reader]
-            for row in rows:
-                # day_availability is a string of comma separated shifts, containing the shifts that the employee is available for that day
-                for day_availability in row[AVAILABILITY_START_COL_INDEX:]:
-                    day_availability = day_availability.lower().strip()
-                    if day_availability == 'off' or day_availability == 'free':
-                        continue
-                    for shift in day_availability.split(","):
-                        shift_labels.add(shift.strip())
-       
-        # sort shift labels by start time
-        START_TIME_INDEX = 0
-        shift_labels = sorted(shift_labels, key=lambda shift: int(re.findall(r'\d+', shift)[START_TIME_INDEX]))
-        print("Day labels:", day_labels)
-        print("Shift labels:", shift_labels)
-        return day_labels, shift_labels
-
-
-    def extract_employee_availability(self, file_path, metadata):
-        AVAILABILITY_START_COL_INDEX = metadata["AVAILABILITY_START_COL_INDEX"]
-        EMPLOYEE_NAME_COL_INDEX = metadata["EMPLOYEE_NAME_COL_INDEX"]
-        DELIMITER = metadata["DELIMITER"]
-        TIMESTAMP_COL_INDEX = metadata["TIMESTAMP_COL_INDEX"]
-        TIMESTAMP_FORMAT = metadata["TIMESTAMP_FORMAT"]
-
-        with open(file_path, newline='') as csvfile:
-            reader = csv.reader(csvfile, delimiter=DELIMITER)
-            next(reader) # skip header
-            rows = [row for row in reader]
-            # sort rows by timestamp
-            rows = sorted(rows, key=lambda row: datetime.datetime.strptime(row[TIMESTAMP_COL_INDEX], TIMESTAMP_FORMAT))
-            employee_names = [row[EMPLOYEE_NAME_COL_INDEX] for row in rows]
-            availability = []
-            for row in rows:
-                employee_availability = [[] for _ in range(len(self.day_labels))]
-                for day_index, day_availability in enumerate(row[AVAILABILITY_START_COL_INDEX:]):
-                    if day_availability.lower() == 'off':
-                        employee_availability[day_index] = []
-                    elif day_availability.lower() == 'free':
-                        employee_availability[day_index] = list(range(len(self.shift_labels)))
-                    else:
-                        for shift in day_availability.split(","):
-                            shift = shift.strip()
-                            employee_availability[day_index].append(self.shift_labels.index(shift))
-                availability.append(employee_availability)
-        return employee_names, availability
+        self.assignment = [self.create_employee_assignment() for _ in range(self.num_employees)] # assignment[employee][day] = shift assigned to that employee in that day, -1 for none
+        self.occupancy = [0] * self.num_days # occupancy[day] = bitmask of employees already working in that day
+        coverage_size = max((shift.end_time for shift in self.shifts), default=0) + 1
+        self.coverage_changes = [[0] * coverage_size for _ in range(self.num_days)] # coverage_changes[day][hour] = change in number of employees working at that hour; prefix sums give the coverage
+        self.range_headcounts = {} # range_headcounts[(day, start_time, end_time)] = number of employees working a shift covering that range, kept up to date once queried
+        self.headcount_ranges_by_shift = {} # headcount_ranges_by_shift[(day, shift)] = keys of range_headcounts the shift counts for
+        self.journal = None # when a list, every put/remove is recorded in it as (operation, employee_id, day, shift, position in schedule[day][shift])
+        self.special_requirement = None # special requirement of the last assign_work, used when repairing
+        self.coverage_requirements = None # its CoverageRequirements, kept up to date with the schedule
+        self.slot_queue = None # ConstrainedSlotQueue of the slots left, while assign_work fills them most constrained first
+        self.schedule_objective = None # ScheduleObjective of the schedule, while improve_schedule searches
+        self.employee_heaps = {} # employee_heaps[(day, shift)] = IndexedHeap of employees available for that shift in that day, kept across calls
+        self.deferred_heap_workloads = None # inside a trial, deferred_heap_workloads[employee] = workload in the employee's heap keys, if stale (see update_employee_priority)
+        self.employee_heap_memberships = [[] for _ in range(self.num_employees)] # employee_heap_memberships[employee] = heaps containing that employee
+        self.set_ordering_seed(None)
+
+
+    def copy_template(self, total_workload_limit=None, instrumentation=None):
+        """
+        Return a new Scheduler for the same availability and shift configuration with an empty schedule,
+        without parsing the file or building the availability indexes again (see SchedulingDaemon).
+        Read-only indexes are shared, everything a schedule or a configuration change modifies is copied.
+        """
+        scheduler = copy.copy(self)
+        scheduler.instrumentation = instrumentation or NO_INSTRUMENTATION
+        scheduler.shifts = [copy.copy(shift) for shift in self.shifts]
+        scheduler.shift_interval_index = ShiftIntervalIndex(scheduler.shifts)
+        scheduler.workloads = array.array('q', [0]) * self.num_employees
+        scheduler.employees = [employee.copy(scheduler.workloads) for employee in self.employees]
+        scheduler.shift_availability = [list(day_availability) for day_availability in self.shift_availability]
+        scheduler.candidate_availability = [list(day_availability) for day_availability in self.candidate_availability]
+        scheduler.init_schedule_state()
+        scheduler.total_workload_limit = total_workload_limit
+        scheduler.update_workload_limits()
+        return scheduler
+
+
+    def create_employee_assignment(self):
+        # one typed row per employee, a list of rows so employees can be added without copying the others
+        return array.array('i', [-1]) * self.num_days
 
 
     def get_shift_id_by_label(self, shift_label):
@@ -207,18 +1134,6 @@ class Scheduler:
         self.get_shift(shift_id).set_is_even_numbered_shift()
 
 
-    def merge_overlapping_shifts(self, shifts):
-        if not shifts:
-            return []
-        merged_shifts = [[shifts[0].start_time, shifts[0].end_time]]
-        for shift in shifts[1:]:
-            if shift.start_time <= merged_shifts[-1][1]:
-                merged_shifts[-1][1] = max(merged_shifts[-1][1], shift.end_time)
-            else:
-                merged_shifts.append([shift.start_time, shift.end_time])
-        return merged_shifts
-    
-    
     def get_employee(self, employee_id):
         return self.employees[employee_id]
 
@@ -228,15 +1143,37 @@ class Scheduler:
 
 
     def create_shift_availability(self, availability):
-        # shift_availability[day][shift] = list of people available for that shift in that day
-        shift_availability = [[[] for _ in range(self.num_shifts)] for _ in range(self.num_days)]
+        # shift_availability[day][shift] = bitmask of people available for that shift in that day (bit i is employee i)
+        shift_availability = [[0] * self.num_shifts for _ in range(self.num_days)]
         for person_id, person_availability in enumerate(availability):
+            person_bit = 1 << person_id
             # list of shifts that person is available for each day
             for day in range(self.num_days):
+                day_availability = shift_availability[day]
                 for shift in person_availability[day]:
-                    shift_availability[day][shift].append(person_id)
+                    day_availability[shift] |= person_bit
         return shift_availability
 
+
+    def create_candidate_availability(self):
+        # candidate_availability[day][shift] = bitmask of people available for that shift or for any shift covering it in that day
+        return [self.create_day_candidate_availability(day) for day in range(self.num_days)]
+
+
+    def create_day_candidate_availability(self, day):
+        day_availability = self.shift_availability[day]
+        day_candidate_availability = [0] * self.num_shifts
+        for shift in range(self.num_shifts):
+            mask = 0
+            for shift_id in self.covering_shifts_map[shift]:
+                mask |= day_availability[shift_id]
+            day_candidate_availability[shift] = mask
+        return day_candidate_availability
+
+
+    def count_available_employees(self, day_index, shift_index):
+        return self.shift_availability[day_index][shift_index].bit_count()
+
     def is_total_workload_exceeded(self, shift_index):
         shift_workload = self.get_shift(shift_index).get_workload_value()
         if self.total_workload >= self.TOTAL_WORKLOAD_LIMIT:
@@ -247,13 +1184,7 @@ class Scheduler:
     
 
     def get_shifts_covering_time_range(self, start_time, end_time):
-        shift_ids = []
-        for shift in self.shifts:
-            if shift.start_time <= start_time and shift.end_time >= end_time:
-                shift_ids.append(shift.id)
-            if shift.start_time >= end_time:
-                break
-        return shift_ids
+        return self.shift_interval_index.get_shifts_covering_time_range(start_time, end_time)
     
 
     """
@@ -267,11 +1198,59 @@ class Scheduler:
     
 
     def get_num_assignees_within_time_range(self, day_index, start_time, end_time):
-        shift_ids = self.get_shifts_covering_time_range(start_time, end_time)
-        num_assignees = 0
-        for shift_id in shift_ids:
-            num_assignees += len(self.schedule[day_index][shift_id])
-        return num_assignees
+        # counted on the schedule the first time a range is queried, then kept up to date by put and remove
+        key = (day_index, start_time, end_time)
+        if key not in self.range_headcounts:
+            day_schedule = self.schedule[day_index]
+            shift_ids = self.get_shifts_covering_time_range(start_time, end_time)
+            self.range_headcounts[key] = sum(len(day_schedule[shift_id]) for shift_id in shift_ids)
+            for shift_id in shift_ids:
+                self.headcount_ranges_by_shift.setdefault((day_index, shift_id), []).append(key)
+        return self.range_headcounts[key]
+
+
+    def get_coverage(self, day_index):
+        # coverage[hour] = number of employees working at that hour of the day
+        return list(itertools.accumulate(self.coverage_changes[day_index]))
+
+
+    def get_coverage_gaps(self, day_index):
+        """
+        Return list of [start_time, end_time] ranges between opening and closing time in which no employee is working
+        """
+        coverage = self.get_coverage(day_index)
+        gaps = []
+        for hour in range(self.OPENING_TIME, self.CLOSING_TIME):
+            if coverage[hour] == 0:
+                if gaps and gaps[-1][1] == hour:
+                    gaps[-1][1] = hour + 1
+                else:
+                    gaps.append([hour, hour + 1])
+        return gaps
+
+
+    def set_ordering_seed(self, seed):
+        """
+        With a seed, days are shuffled, shift priorities are perturbed and ties between employees are broken
+        in a random order, all drawn from random.Random(seed) so that the run can be reproduced.
+        With None, the default (deterministic) orderings are used: ties between employees pop
+        as they did from the former EmployeeComparator heap (see PriorityQueue).
+        """
+        self.ordering_random = random.Random(seed) if seed is not None else None
+        if self.ordering_random:
+            self.employee_tie_breakers = self.ordering_random.sample(range(self.num_employees), self.num_employees)
+        else:
+            self.employee_tie_breakers = list(range(self.num_employees))
+        # priority keys changed
+        self.reset_employee_heaps()
+
+
+    def reset_employee_heaps(self):
+        # heaps (and the partner days of even numbered shifts, which depend on the same availability) are rebuilt on next use
+        self.employee_heaps = {}
+        self.employee_heap_memberships = [[] for _ in range(self.num_employees)]
+        self.even_numbered_day_orders = {} # even_numbered_day_orders[shift] = days by scarcity, see get_even_numbered_partner_days
+        self.even_numbered_partner_days = {} # even_numbered_partner_days[(employee, shift)] = days the employee can pair that shift on
 
 
     def prioritize_shifts(self, day):
@@ -279,88 +1258,196 @@ class Scheduler:
         Return list of shift ids in order of priority
         """
         # TODO: more criteria to prioritize shifts can be added here
-        return sorted(range(self.num_shifts), key=lambda shift: len(self.shift_availability[day][shift]))
+        if self.ordering_random:
+            noise = [self.ordering_random.uniform(0.75, 1.25) for _ in range(self.num_shifts)]
+            return sorted(range(self.num_shifts), key=lambda shift: self.count_available_employees(day, shift) * noise[shift])
+        return sorted(range(self.num_shifts), key=lambda shift: self.count_available_employees(day, shift))
     
 
     def prioritize_days(self):
         # DEFAULT
-        return list(range(self.num_days))
+        day_ids = list(range(self.num_days))
+        if self.ordering_random:
+            self.ordering_random.shuffle(day_ids)
+        return day_ids
+
 
+    def get_employee_priority_key(self, employee, day_index, shift_index):
+        """
+        Employees with lower key are assigned first:
+        first by workload, then by number of shifts the employee is available for today starting from the shift.
+        With a seed, ties are broken in a random order (see set_ordering_seed); by default they are left to the
+        PriorityQueue of prioritize_employees, as EmployeeComparator left them to heapq
+        """
+        # TODO: more criteria to prioritize employees when assigning work can be added here
+        today_availability = employee.get_day_availability(day_index)
+        num_available_shifts = len(today_availability) - binary_search(today_availability, shift_index)
+        if self.ordering_random is None:
+            return (self.workloads[employee.id], num_available_shifts)
+        return (self.workloads[employee.id], num_available_shifts, self.employee_tie_breakers[employee.id])
 
-    def prioritize_employees(self, available_employee_ids, day_index, shift_index) -> PriorityQueue:
-        return PriorityQueue([EmployeeComparator(self.get_employee(employee_id), day_index, shift_index) for employee_id in available_employee_ids])
+
+    def prioritize_employees(self, day_index, shift_index):
+        """
+        Return the priority heap of employees available for the shift in that day.
+        By default it is a PriorityQueue built per call, which pops ties as the former EmployeeComparator heap did:
+        which tied employee comes first depends on heapq's layout of the whole candidate list, which no key of a persistent
+        heap reproduces. A default assign_work prioritizes each (day, shift) once, so there is no rebuild to save.
+        With a seed, keys are all distinct, so the IndexedHeap of the (day, shift) is built once
+        and its keys are updated whenever an employee's workload changes.
+        """
+        if self.ordering_random is None:
+            return PriorityQueue(
+                (self.get_employee_priority_key(self.get_employee(employee_id), day_index, shift_index), employee_id)
+                for employee_id in self.get_available_employee_ids_for_shift(day_index, shift_index)
+            )
+        if self.deferred_heap_workloads:
+            self.sync_deferred_employee_priorities()
+        heap = self.employee_heaps.get((day_index, shift_index))
+        if heap is None:
+            available_employee_ids = self.get_available_employee_ids_for_shift(day_index, shift_index)
+            heap = IndexedHeap(
+                (self.get_employee_priority_key(self.get_employee(employee_id), day_index, shift_index), employee_id)
+                for employee_id in available_employee_ids
+            )
+            self.employee_heaps[(day_index, shift_index)] = heap
+            for employee_id in available_employee_ids:
+                self.employee_heap_memberships[employee_id].append(heap)
+        return heap
+
+
+    def update_employee_priority(self, employee, old_workload):
+        # keep the priority heaps in sync with the employee's workload; inside a trial, not until the heaps are used or the trial ends
+        if self.deferred_heap_workloads is not None:
+            self.deferred_heap_workloads.setdefault(employee.id, old_workload)
+            return
+        for heap in self.employee_heap_memberships[employee.id]:
+            if employee.id in heap:
+                heap.update(employee.id, (self.workloads[employee.id], *heap.get_key(employee.id)[1:]))
+
+
+    def sync_deferred_employee_priorities(self):
+        # update the heaps of the employees whose workload changed during a trial, skipping those it changed back
+        deferred_heap_workloads, self.deferred_heap_workloads = self.deferred_heap_workloads, None
+        for employee_id, heap_workload in deferred_heap_workloads.items():
+            if self.workloads[employee_id] != heap_workload:
+                self.update_employee_priority(self.get_employee(employee_id), heap_workload)
+        self.deferred_heap_workloads = {}
 
     
+    def is_unassigned_shift(self, day_index, shift_index):
+        # main shift with nobody assigned to it nor to its backup shift
+        shift = self.get_shift(shift_index)
+        if not shift.is_main_shift or self.schedule[day_index][shift_index]:
+            return False
+        return shift.backup_shift_id == -1 or not self.schedule[day_index][shift.backup_shift_id]
+
+
     def get_unassigned_shifts(self, day_index):
-        shifts = []
-        for shift_index in range(self.num_shifts):
-            if self.get_shift(shift_index).is_main_shift and self.schedule[day_index][shift_index] == []:
-                backup_shift_id = self.get_shift(shift_index).backup_shift_id
-                if backup_shift_id == -1 or self.schedule[day_index][backup_shift_id] == []:
-                    shifts.append(shift_index)
-        return shifts
+        return [shift_index for shift_index in range(self.num_shifts) if self.is_unassigned_shift(day_index, shift_index)]
 
 
-    def handle_special_requirement(self, day_index, special_requirement=None):
-        if not special_requirement:
+    def handle_special_requirement(self, day_index):
+        """
+        Staff the extra shifts of the day's special requirements (see create_coverage_requirements), largest deficit first.
+        Headcounts are maintained as employees are put on shifts, so filling one requirement updates the deficits
+        of the others it overlaps with, without recounting the day.
+        """
+        requirements = self.coverage_requirements
+        if requirements is None:
             return
-        
-        # Get the current number of assignees within the extra requirement time range
-        current_num_assignees = self.get_num_assignees_within_time_range(
-            day_index, 
-            special_requirement["start_time"], 
-            special_requirement["end_time"]
-        )
-        
-        # Calculate the total number of assignees needed for the extra shift
-        current_num_assignees_at_shift = len(self.schedule[day_index][special_requirement["shift_id_to_assign_extra"]])
-        total_num_assignees_needed_for_shift = current_num_assignees_at_shift + (special_requirement["num_assignees_required"] - current_num_assignees)
-        
-        # Assign employees to the extra shift
-        assigned = self.assign_employees_to_shift(
-            day_index, 
-            special_requirement["shift_id_to_assign_extra"], 
-            total_num_assignees_needed_for_shift
-        )
-        
-        # If the number of assigned employees is less than required, print a message
-        if assigned < total_num_assignees_needed_for_shift:
-            print(
-                f"Extra requirement for day {self.day_labels[day_index]} is not met. "
-                f"Required: {special_requirement['num_assignees_required']}. "
-                f"Assigned: {self.get_num_assignees_within_time_range(day_index, special_requirement['start_time'], special_requirement['end_time'])}"
-            )
-        
+        heap = requirements.deficit_heaps[day_index]
+        popped_requirement_ids = [] # pushed back afterwards, for the next call on this day
+        while not heap.is_empty():
+            requirement_id = heap.pop()
+            popped_requirement_ids.append(requirement_id)
+            num_missing = requirements.get_deficit(requirement_id)
+            if num_missing <= 0:
+                break
 
-    def validate_schedule(self):
-        for day_index in range(self.num_days):
-            unassigned_shifts = self.get_unassigned_shifts(day_index)
-            for shift_index in unassigned_shifts:
-                self.exchange_assignment(day_index, shift_index)
-            
-            # Check if the shifts are continuous within the time range of the day
-            OPENING_TIME = self.shifts[0].start_time
-            CLOSING_TIME = self.shifts[-1].end_time
-
-            # Get all shifts for the given day that have assigned employees
-            today_shifts = [
-                self.get_shift(shift_index) 
-                for shift_index in range(self.num_shifts) 
-                if self.schedule[day_index][shift_index]
-            ]
-            merged_shifts = self.merge_overlapping_shifts(today_shifts)
-            if len(merged_shifts) == 0:
-                print(f"Day {self.day_labels[day_index]} has no employees.")
-            else:
-                if merged_shifts[0][0] > OPENING_TIME:
-                    print(f"Day {self.day_labels[day_index]} has no employees during the following time ranges:")
-                    print(f"{OPENING_TIME} - {merged_shifts[0][0]}")
-                for i in range(len(merged_shifts) - 1):
-                    print(f"Day {self.day_labels[day_index]} has no employees during the following time ranges:")
-                    print(f"{merged_shifts[i][1]} - {merged_shifts[i+1][0]}")
-                if merged_shifts[-1][1] < CLOSING_TIME:
-                    print(f"Day {self.day_labels[day_index]} has no employees during the following time ranges:")
-                    print(f"{merged_shifts[-1][1]} - {CLOSING_TIME}")
+            # Assign employees to the extra shift
+            extra_shift_id = requirements.extra_shift_ids[requirement_id]
+            total_num_assignees_needed_for_shift = len(self.schedule[day_index][extra_shift_id]) + num_missing
+            assigned = self.assign_employees_to_shift(day_index, extra_shift_id, total_num_assignees_needed_for_shift)
+
+            # If the number of assigned employees is less than required, report it
+            if assigned < total_num_assignees_needed_for_shift and self.instrumentation.enabled:
+                _, start_time, end_time = requirements.keys[requirement_id]
+                num_assignees_required = requirements.num_assignees_required[requirement_id]
+                num_assignees = requirements.num_assignees[requirement_id]
+                self.instrumentation.event(
+                    "unmet_special_requirement",
+                    f"Extra requirement for day {self.day_labels[day_index]} is not met. "
+                    f"Required: {num_assignees_required}. "
+                    f"Assigned: {num_assignees}",
+                    day=self.day_labels[day_index],
+                    start_time=start_time,
+                    end_time=end_time,
+                    required=num_assignees_required,
+                    assigned=num_assignees,
+                )
+        for requirement_id in popped_requirement_ids:
+            heap.push(requirement_id, requirements.get_heap_key(requirement_id))
+
+
+    def create_coverage_requirements(self, special_requirement, schedule=None):
+        """
+        Requirements table of a special requirement, counted on schedule (the current one by default); None if there is none.
+        special_requirement is a dict, or a list of dicts with different time ranges, headcounts and extra shifts:
+            start_time, end_time: time range that needs num_assignees_required employees
+            shift_to_assign_extra: shift label staffed to meet the headcount
+            days: optional list of day labels the requirement applies to, every day by default
+        A requirement for the same day and time range as an earlier one replaces it, so defaults can be listed
+        first and overridden for some days (e.g. weekend evenings).
+        """
+        requirements = {}
+        for requirement in get_special_requirement_list(special_requirement):
+            self.validate_special_requirement(requirement)
+            day_labels = requirement.get("days")
+            for day in day_labels or []:
+                if day not in self.day_labels:
+                    raise ValueError(f"Invalid day label: {day}")
+            day_ids = [self.day_labels.index(day) for day in day_labels] if day_labels else range(self.num_days)
+            for day_index in day_ids:
+                key = (day_index, requirement["start_time"], requirement["end_time"])
+                requirements[key] = (requirement["num_assignees_required"], requirement["shift_id_to_assign_extra"])
+        if not requirements:
+            return None
+        return CoverageRequirements(requirements, self.schedule if schedule is None else schedule, self.shift_interval_index)
+
+
+    def validate_schedule(self, repair="exchange"):
+        """
+        Try to fill the main shifts left unassigned, then report the time ranges without employees
+        as "coverage_gap" events (start_time and end_time are None when the day has no employees at all).
+        repair="exchange" tries a single swap per unassigned shift (exchange_assignment),
+        repair="matching" fills them through augmenting paths over all days at once, within the workload limits (repair_with_matching)
+        """
+        if repair not in ("exchange", "matching"):
+            raise ValueError(f"Invalid repair mode: {repair}")
+        with self.instrumentation.phase("validate_schedule"):
+            if repair == "matching":
+                self.repair_with_matching()
+
+            for day_index in range(self.num_days):
+                if repair == "exchange":
+                    unassigned_shifts = self.get_unassigned_shifts(day_index)
+                    for shift_index in unassigned_shifts:
+                        self.exchange_assignment(day_index, shift_index)
+
+                # Check if the shifts are continuous within the time range of the day, if anyone records it
+                if not self.instrumentation.enabled:
+                    continue
+                day_label = self.day_labels[day_index]
+                if self.occupancy[day_index] == 0:
+                    self.instrumentation.event("coverage_gap", f"Day {day_label} has no employees.", day=day_label, start_time=None, end_time=None)
+                else:
+                    for gap_start, gap_end in self.get_coverage_gaps(day_index):
+                        self.instrumentation.event(
+                            "coverage_gap",
+                            f"Day {day_label} has no employees during the following time ranges:\n{gap_start} - {gap_end}",
+                            day=day_label, start_time=gap_start, end_time=gap_end,
+                        )
             
 
     def can_assign(self, employee: Employee, day_index, shift_index):
@@ -368,96 +1455,240 @@ class Scheduler:
         shift_workload = self.get_shift(shift_index).get_workload_value()
         
         # Check if assigning this shift would exceed the employee's workload limit
-        if employee.workload >= self.WORKLOAD_LIMIT_PER_PERSON or employee.workload + shift_workload > self.WORKLOAD_LIMIT_PER_PERSON:
+        workload = self.workloads[employee.id]
+        if workload >= self.WORKLOAD_LIMIT_PER_PERSON or workload + shift_workload > self.WORKLOAD_LIMIT_PER_PERSON:
             return False
         
         # Ensure the employee is not already assigned to another shift on the same day
-        for shift in self.schedule[day_index]:
-            if employee.id in shift:
-                return False
+        if self.assignment[employee.id][day_index] != -1:
+            return False
         
         return True
     
     def put_employee_to_shift(self, employee, day_index, shift_index):
         # add employee to the shift
-        self.schedule[day_index][shift_index].append(employee.id)
+        employee_ids = self.schedule[day_index][shift_index]
+        employee_ids.append(employee.id)
         self.assignment[employee.id][day_index] = shift_index
+        self.occupancy[day_index] |= 1 << employee.id
+
+        # update coverage
+        shift = self.get_shift(shift_index)
+        self.coverage_changes[day_index][shift.start_time] += 1
+        self.coverage_changes[day_index][shift.end_time] -= 1
+        if self.range_headcounts:
+            for key in self.headcount_ranges_by_shift.get((day_index, shift_index), ()):
+                self.range_headcounts[key] += 1
 
         # update  workload
-        shift_workload = self.get_shift(shift_index).get_workload_value()
+        shift_workload = shift.get_workload_value()
         self.total_workload += shift_workload
-        employee.set_workload(employee.workload + shift_workload)
+        self.workloads[employee.id] += shift_workload
+        self.update_employee_priority(employee, self.workloads[employee.id] - shift_workload)
+        if self.coverage_requirements is not None:
+            self.coverage_requirements.add_assignees(day_index, shift_index, 1)
+        if self.slot_queue is not None:
+            self.slot_queue.update_employee(employee.id, day_index, self.workloads[employee.id] - shift_workload)
+        if self.schedule_objective is not None:
+            self.schedule_objective.update(day_index, shift_index, 1, self.workloads[employee.id], shift_workload)
+        if self.journal is not None:
+            self.journal.append(("put", employee.id, day_index, shift_index, len(employee_ids) - 1))
+
+        if self.check_consistency:
+            self.validate_occupancy()
     
 
     def remove_employee_from_shift(self, employee, day_index, shift_index):
         # remove employee from the shift
-        self.schedule[day_index][shift_index].remove(employee.id)
+        employee_ids = self.schedule[day_index][shift_index]
+        position = employee_ids.index(employee.id)
+        del employee_ids[position]
         self.assignment[employee.id][day_index] = -1
+        self.occupancy[day_index] &= ~(1 << employee.id)
+
+        # update coverage
+        shift = self.get_shift(shift_index)
+        self.coverage_changes[day_index][shift.start_time] -= 1
+        self.coverage_changes[day_index][shift.end_time] += 1
+        if self.range_headcounts:
+            for key in self.headcount_ranges_by_shift.get((day_index, shift_index), ()):
+                self.range_headcounts[key] -= 1
 
         # update workload
-        shift_workload = self.get_shift(shift_index).get_workload_value()
+        shift_workload = shift.get_workload_value()
         self.total_workload -= shift_workload
-        employee.set_workload(employee.workload - shift_workload)
+        self.workloads[employee.id] -= shift_workload
+        self.update_employee_priority(employee, self.workloads[employee.id] + shift_workload)
+        if self.coverage_requirements is not None:
+            self.coverage_requirements.add_assignees(day_index, shift_index, -1)
+        if self.slot_queue is not None:
+            self.slot_queue.update_employee(employee.id, day_index, self.workloads[employee.id] + shift_workload)
+        if self.schedule_objective is not None:
+            self.schedule_objective.update(day_index, shift_index, -1, self.workloads[employee.id], shift_workload)
+        if self.journal is not None:
+            self.journal.append(("remove", employee.id, day_index, shift_index, position))
+
+        if self.check_consistency:
+            self.validate_occupancy()
+
+
+    def validate_occupancy(self):
+        """
+        Cross-validate the occupancy index (assignment, occupancy, workloads) against the schedule.
+        Raise RuntimeError on the first inconsistency found.
+        """
+        workloads = [0] * self.num_employees
+        for day_index in range(self.num_days):
+            occupancy = 0
+            for shift_index, employee_ids in enumerate(self.schedule[day_index]):
+                for employee_id in employee_ids:
+                    if (occupancy >> employee_id) & 1:
+                        raise RuntimeError(f"Employee {employee_id} is assigned to more than one shift on day {self.day_labels[day_index]}")
+                    if self.assignment[employee_id][day_index] != shift_index:
+                        raise RuntimeError(f"assignment[{employee_id}][{day_index}] is {self.assignment[employee_id][day_index]}, schedule has shift {shift_index}")
+                    occupancy |= 1 << employee_id
+                    workloads[employee_id] += self.get_shift(shift_index).get_workload_value()
+            if occupancy != self.occupancy[day_index]:
+                raise RuntimeError(f"Occupancy of day {self.day_labels[day_index]} does not match the schedule")
+            coverage_changes = [0] * len(self.coverage_changes[day_index])
+            for shift_index, employee_ids in enumerate(self.schedule[day_index]):
+                coverage_changes[self.get_shift(shift_index).start_time] += len(employee_ids)
+                coverage_changes[self.get_shift(shift_index).end_time] -= len(employee_ids)
+            if coverage_changes != self.coverage_changes[day_index]:
+                raise RuntimeError(f"Coverage of day {self.day_labels[day_index]} does not match the schedule")
+            for employee_id in range(self.num_employees):
+                if not (occupancy >> employee_id) & 1 and self.assignment[employee_id][day_index] != -1:
+                    raise RuntimeError(f"assignment[{employee_id}][{day_index}] is set but employee is not in the schedule")
+        for employee in self.employees:
+            if employee.workload != workloads[employee.id]:
+                raise RuntimeError(f"Workload of employee {employee.id} is {employee.workload}, schedule gives {workloads[employee.id]}")
+        if self.total_workload != sum(workloads):
+            raise RuntimeError(f"Total workload is {self.total_workload}, schedule gives {sum(workloads)}")
+        for (day_index, start_time, end_time), num_assignees in self.range_headcounts.items():
+            day_schedule = self.schedule[day_index]
+            if num_assignees != sum(len(day_schedule[shift_id]) for shift_id in self.get_shifts_covering_time_range(start_time, end_time)):
+                raise RuntimeError(f"Headcount of {start_time} - {end_time} on day {self.day_labels[day_index]} does not match the schedule")
+        if self.coverage_requirements is not None:
+            recounted = self.create_coverage_requirements(self.special_requirement)
+            if recounted.num_assignees != self.coverage_requirements.num_assignees:
+                raise RuntimeError("Special requirement headcounts do not match the schedule")
+        if self.slot_queue is not None:
+            for slot, num_candidates in self.slot_queue.num_candidates.items():
+                if num_candidates != self.slot_queue.count_candidates(*slot):
+                    raise RuntimeError(f"Slot {slot} has {num_candidates} candidates in the queue, {self.slot_queue.count_candidates(*slot)} in the schedule")
+        if self.schedule_objective is not None and self.schedule_objective.get_score_key() != ScheduleObjective(self).get_score_key():
+            raise RuntimeError("Schedule objective does not match the schedule")
+
+
+    def get_available_employee_mask_for_shift(self, day_index, shift_index):
+        return self.candidate_availability[day_index][shift_index]
 
 
     def get_available_employee_ids_for_shift(self, day_index, shift_index):
-        shift_ids = self.covering_shifts_map[shift_index]
-        available_employee_ids = []
-        for shift_id in shift_ids:
-            available_employee_ids.extend(self.shift_availability[day_index][shift_id])
-        return list(set(available_employee_ids))
+        # in the order of a set of the covering shifts' employees, as the employee lists were merged before the bitsets:
+        # the priority heap and exchange_assignment go through candidates in this order
+        return list(set(itertools.chain.from_iterable(
+            iter_bits(self.shift_availability[day_index][shift_id]) for shift_id in self.covering_shifts_map[shift_index]
+        )))
     
 
     def assign_employees_to_shift(self, day_index, shift_index, to_assign=1):
         if self.is_total_workload_exceeded(shift_index):
-            print(f"Total workload exceeded. Current workload: {self.total_workload}. Limit: {self.TOTAL_WORKLOAD_LIMIT}")
+            self.instrumentation.count("total_workload_exceeded")
+            if not self.total_workload_exceeded_reported:
+                self.total_workload_exceeded_reported = True
+                if self.instrumentation.enabled:
+                    self.instrumentation.event(
+                        "total_workload_exceeded",
+                        f"Total workload exceeded. Current workload: {self.total_workload}. Limit: {self.TOTAL_WORKLOAD_LIMIT}",
+                        total_workload=self.total_workload, limit=self.TOTAL_WORKLOAD_LIMIT,
+                    )
             return 0
 
-        available_employee_ids = self.get_available_employee_ids_for_shift(day_index, shift_index)
-        prioritized_employees = self.prioritize_employees(available_employee_ids, day_index, shift_index)
+        prioritized_employees = self.prioritize_employees(day_index, shift_index)
         assigned = len(self.schedule[day_index][shift_index])  # number of employees already assigned to the shift
 
+        popped_employee_ids = [] # a seeded heap is kept across calls, so popped employees are pushed back afterwards
+        num_rejections = 0
+        num_unpaired = 0
+        is_even_numbered_shift = self.get_shift(shift_index).is_even_numbered_shift
         while not prioritized_employees.is_empty() and assigned < to_assign:
-            employee = prioritized_employees.pop().employee
-
-            if self.can_assign(employee, day_index, shift_index):
+            employee = self.get_employee(prioritized_employees.pop())
+            popped_employee_ids.append(employee.id)
+
+            if not self.can_assign(employee, day_index, shift_index):
+                num_rejections += 1
+            elif is_even_numbered_shift:
+                # both days are planned before anything is put, an employee without a partner day is skipped
+                partner_day_index = self.find_even_numbered_partner_day(employee, day_index, shift_index)
+                if partner_day_index == -1:
+                    num_unpaired += 1
+                else:
+                    self.put_employee_to_shift(employee, day_index, shift_index)
+                    self.put_employee_to_shift(employee, partner_day_index, shift_index)
+                    assigned += 1
+            else:
                 self.put_employee_to_shift(employee, day_index, shift_index)
                 assigned += 1
 
-                handled = self.handle_even_numbered_shifts(employee, day_index, shift_index)
-                if not handled:
-                    self.remove_employee_from_shift(employee, day_index, shift_index)
-                    assigned -= 1
-                
+        if self.ordering_random is not None:
+            for employee_id in popped_employee_ids:
+                key = self.get_employee_priority_key(self.get_employee(employee_id), day_index, shift_index)
+                if self.deferred_heap_workloads and employee_id in self.deferred_heap_workloads:
+                    # the employee's other heaps are not updated yet, this one is kept like them
+                    key = (self.deferred_heap_workloads[employee_id], *key[1:])
+                prioritized_employees.push(employee_id, key)
+        self.instrumentation.count("heap_pops", len(popped_employee_ids))
+        self.instrumentation.count("can_assign_rejections", num_rejections)
+        if num_unpaired:
+            self.instrumentation.count("even_numbered_unpaired", num_unpaired)
         
         # if no one is available for the shift, look for backup shift
         if assigned < to_assign:
             backup_shift_id = self.get_shift(shift_index).backup_shift_id
             if backup_shift_id != -1:
+                self.instrumentation.count("backup_fallbacks")
                 self.assign_employees_to_shift(day_index, backup_shift_id, to_assign)
         return assigned
 
 
-    def handle_even_numbered_shifts(self, employee, day_index, shift_index):
+    def get_even_numbered_partner_days(self, employee_id, shift_index):
+        """
+        Days the employee is available for the even numbered shift, in the order partner days are picked:
+        scarcest first (fewest employees available for the shift that day), then earliest.
+        Built on first use, and dropped with the employee heaps when availability changes.
+        """
+        partner_days = self.even_numbered_partner_days.get((employee_id, shift_index))
+        if partner_days is None:
+            day_order = self.even_numbered_day_orders.get(shift_index)
+            if day_order is None:
+                day_order = sorted(range(self.num_days), key=lambda day: (self.count_available_employees(day, shift_index), day))
+                self.even_numbered_day_orders[shift_index] = day_order
+            availability_mask = self.get_employee(employee_id).availability_mask
+            partner_days = [day for day in day_order if (availability_mask[day] >> shift_index) & 1]
+            self.even_numbered_partner_days[(employee_id, shift_index)] = partner_days
+        return partner_days
+
+
+    def find_even_numbered_partner_day(self, employee, day_index, shift_index, num_shifts=2):
+        """
+        Return the day after day_index to pair the even numbered shift with, or -1 if there is none:
+        the first of get_even_numbered_partner_days the employee is free on and whose backup shift is not staffed
+        (the day's slot may have been filled already, with the backup), provided the employee's workload
+        leaves room for num_shifts more shifts (2 when neither day is assigned yet)
+        """
         shift = self.get_shift(shift_index)
-
-        # Handle even-numbered shifts
-        if shift.is_even_numbered_shift:
-            # Check if employee is available for another shift in the week
-            if day_index == self.num_days - 1:
-                return False
-
-            available_day_ids = [
-                day for day in range(day_index + 1, self.num_days)
-                if shift_index in employee.availability_in_week[day] and self.can_assign(employee, day, shift_index)
-            ]
-
-            if not available_day_ids:
-                return False
-
-            second_day_id = min(available_day_ids, key=lambda day: len(self.shift_availability[day][shift_index]))
-            self.put_employee_to_shift(employee, second_day_id, shift_index)
-        return True
+        shift_workload = shift.get_workload_value()
+        # as can_assign checks the second shift once the first one is put
+        workload = self.workloads[employee.id] + (num_shifts - 1) * shift_workload
+        if workload >= self.WORKLOAD_LIMIT_PER_PERSON or workload + shift_workload > self.WORKLOAD_LIMIT_PER_PERSON:
+            return -1
+        employee_assignment = self.assignment[employee.id]
+        for partner_day_index in self.get_even_numbered_partner_days(employee.id, shift_index):
+            if partner_day_index > day_index and employee_assignment[partner_day_index] == -1 \
+                    and (shift.backup_shift_id == -1 or not self.schedule[partner_day_index][shift.backup_shift_id]):
+                return partner_day_index
+        return -1
 
     def validate_special_requirement(self, special_requirement):
         if special_requirement:        
@@ -482,29 +1713,670 @@ class Scheduler:
             priorities.append((day_index, shift_index))
         return priorities
     
-    def assign_work(self, scheduling_priority=None, special_requirement=None):
-        special_requirement = self.validate_special_requirement(special_requirement)
+    def assign_work(self, scheduling_priority=None, special_requirement=None, repair="exchange", engine="greedy", time_budget=None, seed=None,
+                    max_seconds=None, max_steps=None, slot_order="static"):
+        """
+        seed, if given, randomizes the day, shift and employee orderings (see set_ordering_seed).
+        engine="greedy" assigns shift by shift in priority order.
+        engine="flow" first assigns main shifts, backup shifts and special requirement headcounts at once
+        by min-cost flow (assign_shifts_with_flow), then tops up with the greedy pass; if the flow does not finish
+        within time_budget seconds, the schedule is reset and the greedy result is returned instead.
+        time_budget is only for the flow engine, ValueError is raised if it is given with engine="greedy".
+        slot_order="static" fills the main shifts day by day, each day's shifts by their number of available employees (prioritize_shifts);
+        slot_order="most_constrained" fills the main shifts of all days from a ConstrainedSlotQueue, the slot with the fewest
+        remaining candidates first, then the special requirements day by day.
+        With max_seconds or max_steps, stop early (see iter_assign_work).
+        Return the (day, shift) slots left unprocessed, empty unless stopped early.
+        """
+        events = self.iter_assign_work(scheduling_priority, special_requirement, repair=repair, engine=engine, time_budget=time_budget,
+                                       seed=seed, max_seconds=max_seconds, max_steps=max_steps, slot_order=slot_order)
+        while True:
+            try:
+                next(events)
+            except StopIteration as stop:
+                return stop.value
+
+
+    def iter_assign_work(self, scheduling_priority=None, special_requirement=None, repair="exchange", engine="greedy", time_budget=None, seed=None,
+                         max_seconds=None, max_steps=None, slot_order="static"):
+        """
+        Generator version of assign_work, yielding each assignment change as it is made: (day_index, shift_index, employee_id, reason),
+        with shift_index -1 when the employee is taken off that day. reason is the step that made the change:
+        "priority", "flow", "main_shift", "special_requirement" or "repair"; "backup" and "even_numbered" for the backup shift
+        or the second day of an even numbered shift a step assigned, and "removed" for an assignment a step took back.
+        Steps are one (day, shift) slot, the special requirements of a day, the flow and the repair (validate_schedule).
+        With max_seconds (wall-clock time from the first next()) or max_steps, the generator stops between two steps,
+        leaving a consistent partial schedule, and returns (as StopIteration.value) the slots it did not process.
+        Invalid arguments raise ValueError here, before the generator is created.
+        """
+        if engine not in ("greedy", "flow"):
+            raise ValueError(f"Invalid engine: {engine}")
+        if time_budget is not None and engine != "flow":
+            raise ValueError(f"time_budget is only used by the flow engine, not by the {engine} engine")
+        if slot_order not in ("static", "most_constrained"):
+            raise ValueError(f"Invalid slot order: {slot_order}")
+        if repair not in ("exchange", "matching"):
+            raise ValueError(f"Invalid repair mode: {repair}")
+        if max_steps is not None and max_steps < 0:
+            raise ValueError(f"Invalid max_steps: {max_steps}")
+        if max_seconds is not None and max_seconds < 0:
+            raise ValueError(f"Invalid max_seconds: {max_seconds}")
         scheduling_priority = self.validate_scheduling_priority(scheduling_priority)
-        for day_index, shift_index in scheduling_priority:
+        return self.iter_assign_steps(scheduling_priority, special_requirement, repair, engine, time_budget, seed, max_seconds, max_steps, slot_order)
+
+
+    def iter_assign_steps(self, scheduling_priority, special_requirement, repair, engine, time_budget, seed, max_seconds, max_steps, slot_order):
+        # the generator of iter_assign_work, once its arguments are validated; scheduling_priority is (day, shift) indexes
+        stop_time = time.perf_counter() + max_seconds if max_seconds is not None else None
+        if seed is not None:
+            self.set_ordering_seed(seed)
+        deadline = time.perf_counter() + time_budget if time_budget is not None else None
+        coverage_requirements = self.create_coverage_requirements(special_requirement)
+        self.special_requirement = special_requirement
+        self.coverage_requirements = coverage_requirements
+        self.total_workload_exceeded_reported = False
+
+        # (reason, day, shift): day and shift are None for steps that are not about one slot
+        # ("most_constrained", None, None) stands for the main shift slots of the slot queue, popped one step at a time
+        steps = collections.deque(("priority", day_index, shift_index) for day_index, shift_index in scheduling_priority)
+        if engine == "flow":
+            steps.append(("flow", None, None))
+        if slot_order == "most_constrained":
+            steps.append(("most_constrained", None, None))
+            steps.extend(("special_requirement", day_index, None) for day_index in range(self.num_days))
+        else:
+            for day_index in self.prioritize_days():
+                shift_ids = self.prioritize_shifts(day_index)
+                steps.extend(("main_shift", day_index, shift_index) for shift_index in shift_ids if self.get_shift(shift_index).is_main_shift)
+                steps.append(("special_requirement", day_index, None))
+        steps.append(("repair", None, None))
+
+        try:
+            engine = yield from self.run_assign_steps(steps, scheduling_priority, repair, engine, deadline, time_budget, stop_time, max_steps)
+            return self.get_unprocessed_slots(steps, engine)
+        finally:
+            self.slot_queue = None
+
+
+    def run_assign_steps(self, steps, scheduling_priority, repair, engine, deadline, time_budget, stop_time, max_steps):
+        # the steps of iter_assign_work, popped from the steps deque until it is empty or the budget is spent;
+        # return the engine, which is "greedy" if the flow ran out of time
+        instrumentation = self.instrumentation
+        num_steps = 0
+        while steps:
+            if (max_steps is not None and num_steps >= max_steps) or (stop_time is not None and time.perf_counter() >= stop_time):
+                return engine
+            reason, day_index, shift_index = steps.popleft()
+            if reason == "most_constrained":
+                if self.slot_queue is None:
+                    # built once the priority slots and the flow are assigned
+                    self.slot_queue = self.create_slot_queue(self.get_open_main_shift_slots(engine))
+                if not self.slot_queue:
+                    self.slot_queue = None
+                    continue
+                steps.appendleft((reason, None, None))
+                reason = "main_shift"
+                day_index, shift_index = self.slot_queue.pop()
+            num_steps += 1
+            with self.track_changes() as changes:
+                if reason == "priority":
+                    with instrumentation.phase("scheduling_priority"):
+                        self.assign_employees_to_shift(day_index, shift_index, to_assign=1)
+                elif reason == "flow":
+                    with instrumentation.phase("flow"):
+                        solved = self.assign_shifts_with_flow(deadline)
+                    if not solved:
+                        # out of time budget, fall back to the greedy result
+                        if instrumentation.enabled:
+                            instrumentation.event("flow_time_budget_exceeded", f"Min-cost flow did not finish within {time_budget}s, using the greedy engine", time_budget=time_budget)
+                        engine = "greedy"
+                        self.reset_assignments()
+                        for priority_day_index, priority_shift_index in scheduling_priority:
+                            self.assign_employees_to_shift(priority_day_index, priority_shift_index, to_assign=1)
+                elif reason == "main_shift":
+                    with instrumentation.phase("assign_days"):
+                        if engine == "greedy" or self.is_unassigned_shift(day_index, shift_index):
+                            self.assign_employees_to_shift(day_index, shift_index, to_assign=1)
+                elif reason == "special_requirement":
+                    with instrumentation.phase("assign_days"):
+                        self.handle_special_requirement(day_index)
+                else:
+                    self.validate_schedule(repair=repair)
+            yield from self.get_assignment_events(changes, day_index, shift_index, reason)
+        return engine
+
+
+    def get_open_main_shift_slots(self, engine):
+        # main shift slots the main pass of assign_work tries to fill
+        return [
+            (day_index, shift_index)
+            for day_index in range(self.num_days)
+            for shift_index in range(self.num_shifts)
+            if self.get_shift(shift_index).is_main_shift and (engine == "greedy" or self.is_unassigned_shift(day_index, shift_index))
+        ]
+
+
+    def create_slot_queue(self, slots):
+        return ConstrainedSlotQueue(
+            slots, self.candidate_availability, self.occupancy, self.workloads,
+            [shift.get_workload_value() for shift in self.shifts], self.WORKLOAD_LIMIT_PER_PERSON,
+        )
+
+
+    def get_assignment_events(self, changes, day_index, shift_index, reason):
+        # events of the changes made by one step of iter_assign_work, see track_changes for changes
+        backup_shift_id = self.get_shift(shift_index).backup_shift_id if shift_index is not None else -1
+        events = []
+        for employee_id, change_day_index, _, new_shift_index in changes:
+            if new_shift_index == -1:
+                change_reason = "removed"
+            elif backup_shift_id != -1 and new_shift_index == backup_shift_id:
+                change_reason = "backup"
+            elif day_index is not None and change_day_index != day_index:
+                change_reason = "even_numbered"
+            else:
+                change_reason = reason
+            events.append((change_day_index, new_shift_index, employee_id, change_reason))
+        return events
+
+
+    def get_unprocessed_slots(self, steps, engine):
+        """
+        Return the (day, shift) slots of the steps left by iter_assign_work: priority and open main shift slots,
+        and the extra shifts of the special requirements not met yet
+        """
+        slots = []
+        for reason, day_index, shift_index in steps:
+            if reason == "priority" or (reason == "main_shift" and (engine == "greedy" or self.is_unassigned_shift(day_index, shift_index))):
+                slots.append((day_index, shift_index))
+            elif reason == "most_constrained":
+                slots.extend(self.slot_queue.get_slots() if self.slot_queue is not None else self.get_open_main_shift_slots(engine))
+            elif reason == "special_requirement" and self.coverage_requirements is not None:
+                requirements = self.coverage_requirements
+                slots.extend(
+                    (day_index, requirements.extra_shift_ids[requirement_id])
+                    for requirement_id in requirements.requirement_ids_by_day[day_index]
+                    if requirements.get_deficit(requirement_id) > 0
+                )
+        return list(dict.fromkeys(slots))
+
+
+    def reset_assignments(self):
+        # remove every assignment, keeping employees, shifts and their configuration
+        for day_index in range(self.num_days):
+            for shift_index in range(self.num_shifts):
+                for employee_id in list(self.schedule[day_index][shift_index]):
+                    self.remove_employee_from_shift(self.get_employee(employee_id), day_index, shift_index)
+
+
+    def assign_shifts_with_flow(self, deadline=None):
+        """
+        Assign the open main shifts of every day, their backup shifts and the special requirement headcounts (coverage_requirements)
+        as min-cost flow problems (see solve_shift_flow). Flow counts shifts, not hours: the number of shifts of each employee
+        is bounded by the hours left divided by the mean workload of the shifts to assign (at least one if the shortest fits),
+        and the number of shifts in total by the total workload left divided by the mean. Of the shifts the flow gives an employee, those that fit in the hours left are kept,
+        shortest first; an employee that had shifts dropped is then bounded by the longest shift instead, and the flow is solved
+        again for the demand left open, so what the flow assigns is within WORKLOAD_LIMIT_PER_PERSON. Once the total workload
+        left is used, the shortest shifts that fit are kept and the flow stops. The even-numbered shift rules are enforced
+        afterwards (balance_even_numbered_shifts) and the greedy pass uses any workload left.
+        Return False if the deadline is passed before the flow is solved.
+        """
+        demand_shift_ids = set()
+        for shift in self.shifts:
+            if shift.is_main_shift:
+                demand_shift_ids.add(shift.id)
+                if shift.backup_shift_id != -1:
+                    demand_shift_ids.add(shift.backup_shift_id)
+        requirements = self.coverage_requirements
+        if requirements is not None:
+            demand_shift_ids.update(requirements.extra_shift_ids)
+        if not demand_shift_ids:
+            return True
+        mean_shift_workload = sum(self.get_shift(shift_id).get_workload_value() for shift_id in demand_shift_ids) / len(demand_shift_ids)
+        min_shift_workload = min(self.get_shift(shift_id).get_workload_value() for shift_id in demand_shift_ids)
+        max_shift_workload = max(self.get_shift(shift_id).get_workload_value() for shift_id in demand_shift_ids)
+        if mean_shift_workload <= 0:
+            return True
+        get_shift_workload = lambda assigned_shift: self.get_shift(assigned_shift[2]).get_workload_value()
+
+        capped_employee_ids = set() # employees the flow went over the workload limit for
+        while True:
+            # number of shifts each employee, and all of them, can still take
+            num_shifts_left = []
+            for employee in self.employees:
+                free_days = sum(1 for shift_index in self.assignment[employee.id] if shift_index == -1)
+                remaining_workload = self.WORKLOAD_LIMIT_PER_PERSON - employee.workload
+                if employee.id in capped_employee_ids:
+                    # as many shifts as fit if all are the longest
+                    num_shifts = int(remaining_workload // max_shift_workload)
+                else:
+                    # at least one if the shortest fits
+                    num_shifts = max(int(remaining_workload // mean_shift_workload), int(remaining_workload >= min_shift_workload))
+                num_shifts_left.append(max(0, min(free_days, num_shifts)))
+            remaining_total_workload = self.TOTAL_WORKLOAD_LIMIT - self.total_workload
+            max_total_shifts = max(0, min(sum(num_shifts_left), int(remaining_total_workload // mean_shift_workload)))
+
+            assigned_shifts = self.solve_shift_flow(num_shifts_left, max_total_shifts, deadline)
+            if assigned_shifts is None:
+                return False
+            assigned_shifts_by_employee = collections.defaultdict(list)
+            for assigned_shift in assigned_shifts:
+                assigned_shifts_by_employee[assigned_shift[0]].append(assigned_shift)
+            kept_shifts = []
+            for employee_id, employee_assigned_shifts in assigned_shifts_by_employee.items():
+                remaining_workload = self.WORKLOAD_LIMIT_PER_PERSON - self.get_employee(employee_id).workload
+                fitting_shifts = take_fitting(employee_assigned_shifts, remaining_workload, get_shift_workload)
+                if len(fitting_shifts) < len(employee_assigned_shifts):
+                    capped_employee_ids.add(employee_id)
+                kept_shifts.extend(fitting_shifts)
+            fitting_shifts = take_fitting(kept_shifts, remaining_total_workload, get_shift_workload)
+            for employee_id, day_index, shift_index in fitting_shifts:
+                self.put_employee_to_shift(self.get_employee(employee_id), day_index, shift_index)
+            if len(fitting_shifts) == len(assigned_shifts) or len(fitting_shifts) < len(kept_shifts):
+                break
+            self.instrumentation.count("flow_resolves")
+
+        self.balance_even_numbered_shifts()
+        return True
+
+
+    def solve_shift_flow(self, num_shifts_left, max_total_shifts, deadline=None):
+        """
+        Min-cost flow of assign_shifts_with_flow:
+            source -> shift pool -> employee -> (employee, day) -> (day, demand) -> sink
+        The shift pool has capacity max_total_shifts and each employee num_shifts_left[employee].
+        The k-th shift of an employee costs k, so workload is spread evenly, a backup shift costs more than any main shift
+        and an extra shift for the special requirement costs more than any backup shift.
+        (employee, day) has capacity 1 (one shift per day).
+        Return the list of (employee_id, day, shift) the flow assigns, or None if the deadline is passed.
+        """
+        requirements = self.coverage_requirements
+        max_shifts_left = max(num_shifts_left, default=0)
+        if max_shifts_left == 0 or max_total_shifts == 0:
+            return []
+        BACKUP_COST = max_shifts_left + self.num_days + 1
+        EXTRA_COST = 2 * BACKUP_COST
+
+        SOURCE, SINK, SHIFT_POOL = 0, 1, 2
+        flow = MinCostFlow(3)
+        flow.add_edge(SOURCE, SHIFT_POOL, max_total_shifts, 0)
+        employee_nodes = {}
+        employee_day_nodes = {}
+        usable_employees = 0
+        for employee in self.employees:
+            if num_shifts_left[employee.id] > 0:
+                usable_employees |= 1 << employee.id
+                employee_nodes[employee.id] = node = flow.add_node()
+                num_assigned_days = self.num_days - self.assignment[employee.id].count(-1)
+                for k in range(num_shifts_left[employee.id]):
+                    flow.add_edge(SHIFT_POOL, node, 1, num_assigned_days + k)
+
+        assignment_edges = [] # (edge id, employee id, day, shift) of every edge that stands for working a shift
+        def add_demand_edges(demand_node, day_index, shift_index, cost):
+            candidate_mask = self.get_available_employee_mask_for_shift(day_index, shift_index) & ~self.occupancy[day_index] & usable_employees
+            for employee_id in iter_bits(candidate_mask):
+                employee_day_node = employee_day_nodes.get((employee_id, day_index))
+                if employee_day_node is None:
+                    employee_day_node = employee_day_nodes[(employee_id, day_index)] = flow.add_node()
+                    flow.add_edge(employee_nodes[employee_id], employee_day_node, 1, 0)
+                edge_id = flow.add_edge(employee_day_node, demand_node, 1, cost)
+                assignment_edges.append((edge_id, employee_id, day_index, shift_index))
+
+        for day_index in range(self.num_days):
+            unassigned_shifts = self.get_unassigned_shifts(day_index)
+            for shift_index in unassigned_shifts:
+                demand_node = flow.add_node()
+                flow.add_edge(demand_node, SINK, 1, 0)
+                add_demand_edges(demand_node, day_index, shift_index, 0)
+                backup_shift_id = self.get_shift(shift_index).backup_shift_id
+                if backup_shift_id != -1:
+                    add_demand_edges(demand_node, day_index, backup_shift_id, BACKUP_COST)
+
+            if requirements is not None:
+                # headcount still missing once every open main shift covering the time range is filled
+                num_missing = {requirement_id: requirements.get_deficit(requirement_id) for requirement_id in requirements.requirement_ids_by_day[day_index]}
+                for shift_index in unassigned_shifts:
+                    for requirement_id in requirements.requirement_ids_by_shift[day_index][shift_index]:
+                        num_missing[requirement_id] -= 1
+                for requirement_id, requirement_num_missing in num_missing.items():
+                    if requirement_num_missing > 0:
+                        demand_node = flow.add_node()
+                        flow.add_edge(demand_node, SINK, requirement_num_missing, 0)
+                        add_demand_edges(demand_node, day_index, requirements.extra_shift_ids[requirement_id], EXTRA_COST)
+
+        if flow.solve(SOURCE, SINK, deadline) is None:
+            return None
+        return [
+            (employee_id, day_index, shift_index)
+            for edge_id, employee_id, day_index, shift_index in assignment_edges
+            if flow.get_flow(edge_id)
+        ]
+
+
+    def enforce_workload_limits(self):
+        """
+        Remove assignments until every employee is within WORKLOAD_LIMIT_PER_PERSON and the total within TOTAL_WORKLOAD_LIMIT.
+        An employee over the limit drops its longest shifts first; for the total limit, the most loaded employee
+        drops a shift, preferring shifts that have other assignees in that day.
+        """
+        for employee in self.employees:
+            while employee.workload > self.WORKLOAD_LIMIT_PER_PERSON:
+                day_index = max(
+                    (day for day in range(self.num_days) if self.assignment[employee.id][day] != -1),
+                    key=lambda day: self.get_shift(self.assignment[employee.id][day]).get_workload_value()
+                )
+                self.remove_employee_from_shift(employee, day_index, self.assignment[employee.id][day_index])
+
+        while self.total_workload > self.TOTAL_WORKLOAD_LIMIT:
+            employee = max(self.employees, key=lambda employee: employee.workload)
+            day_index = max(
+                (day for day in range(self.num_days) if self.assignment[employee.id][day] != -1),
+                key=lambda day: len(self.schedule[day][self.assignment[employee.id][day]])
+            )
+            self.remove_employee_from_shift(employee, day_index, self.assignment[employee.id][day_index])
+
+
+    def balance_even_numbered_shifts(self):
+        """
+        Make every employee work each even-numbered shift on an even number of days:
+        an employee with an odd count gets one more day of that shift (the day with fewest available employees),
+        or if none is possible, loses its last day of that shift.
+        """
+        for shift in self.shifts:
+            if shift.is_even_numbered_shift:
+                for employee in self.employees:
+                    self.balance_even_numbered_shift(employee, shift.id)
+
+
+    def balance_even_numbered_shift(self, employee, shift_index):
+        """
+        Make the employee work the even-numbered shift on an even number of days, see balance_even_numbered_shifts.
+        Return the (day, shift) left without the employee, or None.
+        """
+        day_ids = [day for day in range(self.num_days) if self.assignment[employee.id][day] == shift_index]
+        if len(day_ids) % 2 == 0:
+            return None
+        second_day_id = self.find_even_numbered_partner_day(employee, -1, shift_index, num_shifts=1)
+        if second_day_id != -1 and not self.is_total_workload_exceeded(shift_index):
+            self.put_employee_to_shift(employee, second_day_id, shift_index)
+            return None
+        self.remove_employee_from_shift(employee, day_ids[-1], shift_index)
+        return (day_ids[-1], shift_index)
+
+
+    @contextlib.contextmanager
+    def track_changes(self):
+        """
+        Collect the net assignment changes made inside the with block into the yielded list,
+        as (employee_id, day_index, old shift, new shift) with -1 for no shift, sorted by employee then day.
+        """
+        changes = []
+        own_journal = self.journal is None
+        if own_journal:
+            self.journal = []
+        start = len(self.journal)
+        try:
+            yield changes
+        finally:
+            old_shifts = {} # (employee, day) -> shift before the first operation on it
+            for operation, employee_id, day_index, shift_index, _ in self.journal[start:]:
+                old_shifts.setdefault((employee_id, day_index), shift_index if operation == "remove" else -1)
+            for (employee_id, day_index), old_shift in sorted(old_shifts.items()):
+                new_shift = self.assignment[employee_id][day_index]
+                if new_shift != old_shift:
+                    changes.append((employee_id, day_index, old_shift, new_shift))
+            if own_journal:
+                self.journal = None
+
+
+    @contextlib.contextmanager
+    def trial(self):
+        """
+        Yield a checkpoint to try changes against: rollback(checkpoint) inside the with block undoes the changes
+        made since, otherwise they are kept. Trials nest, and an exception in the block rolls its changes back.
+            with scheduler.trial() as checkpoint:
+                ... move employees ...
+                if worse:
+                    scheduler.rollback(checkpoint)
+        """
+        own_journal = self.journal is None
+        if own_journal:
+            self.journal = []
+        # heap updates wait until the heaps are used, so a change that is rolled back costs nothing there
+        own_deferral = self.deferred_heap_workloads is None
+        if own_deferral:
+            self.deferred_heap_workloads = {}
+        checkpoint = len(self.journal)
+        try:
+            yield checkpoint
+        except BaseException:
+            self.rollback(checkpoint)
+            raise
+        finally:
+            if own_journal:
+                self.journal = None
+            if own_deferral:
+                self.sync_deferred_employee_priorities()
+                self.deferred_heap_workloads = None
+
+
+    def rollback(self, checkpoint):
+        """
+        Undo every put and remove recorded since the checkpoint (see trial), newest first, through the same
+        operations, so the schedule, workloads and every index kept with them are as they were at the checkpoint,
+        employees in the same order within each shift. The cost is proportional to the number of changes undone.
+        """
+        journal = self.journal
+        self.journal = None # undoing is not recorded, the undone entries are dropped
+        try:
+            for operation, employee_id, day_index, shift_index, position in reversed(journal[checkpoint:]):
+                employee = self.get_employee(employee_id)
+                if operation == "put":
+                    self.remove_employee_from_shift(employee, day_index, shift_index)
+                else:
+                    self.put_employee_to_shift(employee, day_index, shift_index)
+                    employee_ids = self.schedule[day_index][shift_index]
+                    employee_ids.insert(position, employee_ids.pop())
+        finally:
+            del journal[checkpoint:]
+            self.journal = journal
+
+
+    def fork(self):
+        """
+        Return an independent Scheduler with the same configuration and schedule, for what-if runs that outlive a trial.
+        Availability and its indexes are shared (see copy_template); the schedule state is copied row by row
+        and the employee heaps are rebuilt on use.
+        """
+        scheduler = self.copy_template(self.total_workload_limit, self.instrumentation)
+        scheduler.schedule = [[list(employee_ids) for employee_ids in day_schedule] for day_schedule in self.schedule]
+        scheduler.assignment = [array.array('i', employee_assignment) for employee_assignment in self.assignment]
+        scheduler.occupancy = list(self.occupancy)
+        scheduler.coverage_changes = [list(day_coverage_changes) for day_coverage_changes in self.coverage_changes]
+        scheduler.workloads[:] = self.workloads
+        scheduler.total_workload = self.total_workload
+        scheduler.employee_tie_breakers = list(self.employee_tie_breakers)
+        if self.ordering_random:
+            scheduler.ordering_random = random.Random()
+            scheduler.ordering_random.setstate(self.ordering_random.getstate())
+        scheduler.special_requirement = self.special_requirement
+        scheduler.coverage_requirements = scheduler.create_coverage_requirements(self.special_requirement)
+        return scheduler
+
+
+    def update_availability(self, employee_id, day_index, shift_ids):
+        """
+        Set the shifts the employee is available for in that day and repair only what the change affects:
+        an assignment the employee can no longer work is removed (with its even-numbered pair if needed) and refilled,
+        and if the employee became available for more shifts, the unassigned main shifts of that day are retried.
+        Return the assignment changes (see track_changes).
+        """
+        with self.track_changes() as changes:
+            employee = self.get_employee(employee_id)
+            added_shift_mask = to_bitmask(shift_ids) & ~employee.availability_mask[day_index]
+            affected_slots = self.set_employee_day_availability(employee, day_index, shift_ids)
+            if added_shift_mask:
+                affected_slots.extend((day_index, shift_index) for shift_index in self.get_unassigned_shifts(day_index))
+            self.repair_slots(affected_slots)
+        return changes
+
+
+    def set_employee_day_availability(self, employee, day_index, shift_ids):
+        # update the availability indexes and drop the assignment the employee is no longer available for; return the slots left open
+        employee_bit = 1 << employee.id
+        for shift_index in range(self.num_shifts):
+            self.shift_availability[day_index][shift_index] &= ~employee_bit
+        for shift_index in shift_ids:
+            self.shift_availability[day_index][shift_index] |= employee_bit
+        employee.set_day_availability(day_index, shift_ids)
+        self.candidate_availability[day_index] = self.create_day_candidate_availability(day_index)
+        self.reset_employee_heaps()
+
+        affected_slots = []
+        shift_index = self.assignment[employee.id][day_index]
+        if shift_index != -1 and not (self.get_available_employee_mask_for_shift(day_index, shift_index) & employee_bit):
+            self.remove_employee_from_shift(employee, day_index, shift_index)
+            affected_slots.append((day_index, shift_index))
+            if self.get_shift(shift_index).is_even_numbered_shift:
+                open_slot = self.balance_even_numbered_shift(employee, shift_index)
+                if open_slot:
+                    affected_slots.append(open_slot)
+        return affected_slots
+
+
+    def add_employee(self, name, availability):
+        """
+        Add an employee with availability[day] = list of shift ids, and use it to fill unassigned main shifts.
+        The per-person workload limit stays as it is, so nobody else's assignments move; set_total_workload_limit
+        recomputes it for the new number of employees.
+        Return the id of the new employee and the assignment changes (see track_changes).
+        """
+        with self.track_changes() as changes:
+            employee_id = self.num_employees
+            self.workloads.append(0)
+            employee = Employee(employee_id, name, [sorted(day_availability) for day_availability in availability], self.workloads)
+            self.employees.append(employee)
+            self.num_employees += 1
+            self.assignment.append(self.create_employee_assignment())
+            self.employee_tie_breakers.append(employee_id)
+            self.employee_heap_memberships.append([])
+            for day_index in range(self.num_days):
+                for shift_index in employee.availability_in_week[day_index]:
+                    self.shift_availability[day_index][shift_index] |= 1 << employee_id
+                self.candidate_availability[day_index] = self.create_day_candidate_availability(day_index)
+            self.reset_employee_heaps()
+            self.repair_slots([
+                (day_index, shift_index)
+                for day_index in range(self.num_days)
+                for shift_index in self.get_unassigned_shifts(day_index)
+            ])
+        return employee_id, changes
+
+
+    def remove_employee(self, employee_id):
+        """
+        Remove the employee from the schedule and refill the shifts it worked.
+        The employee keeps its id (ids are indexes) but becomes inactive: it has no availability and is not written out.
+        The per-person workload limit stays as it is (see add_employee).
+        Return the assignment changes (see track_changes).
+        """
+        with self.track_changes() as changes:
+            employee = self.get_employee(employee_id)
+            employee.is_active = False
+            affected_slots = []
+            employee_bit = 1 << employee_id
+            available_day_ids = [day_index for day_index in range(self.num_days) if employee.availability_mask[day_index]]
+            for day_index in range(self.num_days):
+                shift_index = self.assignment[employee_id][day_index]
+                if shift_index != -1:
+                    self.remove_employee_from_shift(employee, day_index, shift_index)
+                    affected_slots.append((day_index, shift_index))
+                for shift_index in iter_bits(employee.availability_mask[day_index]):
+                    self.shift_availability[day_index][shift_index] &= ~employee_bit
+                employee.set_day_availability(day_index, [])
+            # the indexes derived from availability, once for all days
+            for day_index in available_day_ids:
+                self.candidate_availability[day_index] = self.create_day_candidate_availability(day_index)
+            self.reset_employee_heaps()
+            self.repair_slots(affected_slots)
+        return changes
+
+
+    def set_total_workload_limit(self, total_workload_limit):
+        """
+        Change the total workload limit (None for no limit) and the per-person limit derived from it,
+        the total divided among the active employees.
+        If the limits got tighter, assignments are removed until they hold; if they got looser, unassigned main shifts are retried.
+        Return the assignment changes (see track_changes).
+        """
+        with self.track_changes() as changes:
+            self.total_workload_limit = total_workload_limit
+            affected_slots = self.update_workload_limits()
+            affected_slots.extend(
+                (day_index, shift_index)
+                for day_index in range(self.num_days)
+                for shift_index in self.get_unassigned_shifts(day_index)
+            )
+            self.repair_slots(affected_slots)
+        return changes
+
+
+    def update_workload_limits(self):
+        # recompute the limits from total_workload_limit and the active employees, enforce them and return the slots left open
+        num_active_employees = sum(1 for employee in self.employees if employee.is_active)
+        self.TOTAL_WORKLOAD_LIMIT = self.total_workload_limit if self.total_workload_limit else sys.maxsize
+        self.WORKLOAD_LIMIT_PER_PERSON = self.total_workload_limit / max(1, num_active_employees) if self.total_workload_limit else sys.maxsize
+        if self.journal is None:
+            self.enforce_workload_limits()
+            self.balance_even_numbered_shifts()
+            return []
+        start = len(self.journal)
+        self.enforce_workload_limits()
+        self.balance_even_numbered_shifts()
+        return [(day_index, shift_index) for operation, _, day_index, shift_index, _ in self.journal[start:] if operation == "remove"]
+
+
+    def repair_slots(self, slots):
+        """
+        Refill the given (day, shift) slots that are left unassigned main shifts, first directly (assign_employees_to_shift),
+        then through augmenting paths; then top up the special requirement of the affected days.
+        Other assignments are only moved by augmenting paths, to keep the changes small.
+        """
+        affected_days = sorted({day_index for day_index, _ in slots})
+        open_slots = sorted({
+            (day_index, shift_index if self.get_shift(shift_index).is_main_shift else self.get_main_shift_id(shift_index))
+            for day_index, shift_index in slots
+        })
+        non_exchangeable_shift_mask = to_bitmask(shift.id for shift in self.shifts if shift.is_even_numbered_shift)
+        for day_index, shift_index in open_slots:
+            if shift_index == -1 or not self.is_unassigned_shift(day_index, shift_index):
+                continue
             self.assign_employees_to_shift(day_index, shift_index, to_assign=1)
+            if self.is_unassigned_shift(day_index, shift_index) and not (non_exchangeable_shift_mask >> shift_index) & 1 \
+                    and not self.is_total_workload_exceeded(shift_index):
+                chain = self.find_augmenting_path(day_index, shift_index, non_exchangeable_shift_mask)
+                if chain is not None:
+                    self.apply_augmenting_path(chain)
+        for day_index in affected_days:
+            self.handle_special_requirement(day_index)
+
 
-        day_ids = self.prioritize_days()
-        for day_index in day_ids:
-            shift_ids = self.prioritize_shifts(day_index)
-            for shift_index in shift_ids:
-                if self.get_shift(shift_index).is_main_shift:
-                    self.assign_employees_to_shift(day_index, shift_index, to_assign=1)
-            self.handle_special_requirement(day_index, special_requirement)
-        self.validate_schedule()
+    def get_main_shift_id(self, backup_shift_id):
+        # main shift the shift is backup for, or -1
+        for shift in self.shifts:
+            if shift.backup_shift_id == backup_shift_id:
+                return shift.id
+        return -1
 
 
     def exchange_assignment(self, day_index, shift_index):
         NON_EXCHANGEABLE_SHIFT = [shift.id for shift in self.shifts if shift.is_even_numbered_shift]
         if shift_index in NON_EXCHANGEABLE_SHIFT:
             return False
+        self.instrumentation.count("exchange_attempts")
 
         # get list of employees whose workload is less than WORKLOAD_LIMIT_PER_PERSON
-        under_workload_employee_ids = [employee.id for employee in self.employees if employee.workload < self.WORKLOAD_LIMIT_PER_PERSON]
+        under_workload_employee_ids = [employee_id for employee_id, workload in enumerate(self.workloads) if workload < self.WORKLOAD_LIMIT_PER_PERSON]
         if not under_workload_employee_ids:
             return False
         
@@ -512,7 +2384,7 @@ class Scheduler:
         available_employee_ids = self.get_available_employee_ids_for_shift(day_index, shift_index)
        
         # get available employees whose workload reaching WORKLOAD_LIMIT_PER_PERSON but not assigned to this shift in this day
-        candidates_for_exchange = [employee_id for employee_id in available_employee_ids if self.get_employee(employee_id).workload == self.WORKLOAD_LIMIT_PER_PERSON and self.assignment[employee_id][day_index] == -1]
+        candidates_for_exchange = [employee_id for employee_id in available_employee_ids if self.workloads[employee_id] == self.WORKLOAD_LIMIT_PER_PERSON and self.assignment[employee_id][day_index] == -1]
 
         if not candidates_for_exchange:
             return False
@@ -539,52 +2411,614 @@ class Scheduler:
 
                         # assign the candidate to the current shift
                         self.put_employee_to_shift(candidate, day_index, shift_index)
+                        self.instrumentation.count("exchanges")
                         return True
 
         return False
 
+    def find_augmenting_path(self, day_index, shift_index, non_exchangeable_shift_mask):
+        """
+        Search (breadth first, so the shortest chain is found) for a chain of reassignments that lets the shift be filled:
+        employee e0 takes the shift; if that would exceed e0's workload limit, e0 hands one of its other shifts to e1,
+        which may in turn hand one of its shifts to e2, and so on until the last employee has room for the shift it takes.
+        Even-numbered shifts are never handed over. Every employee appears at most once in the chain.
+        Return the chain as a list of (employee_id, (day, shift) taken, (day, shift) handed over or None), or None.
+        """
+        visited = 0 # bitmask of employees already in the search tree
+        # each node is (employee_id, slot taken, slot handed over, parent node index)
+        nodes = []
+        queue = [(day_index, shift_index, -1)] # slots to fill, with the node that handed them over
+        for day, shift, parent_index in queue:
+            shift_workload = self.get_shift(shift).get_workload_value()
+            candidate_mask = self.get_available_employee_mask_for_shift(day, shift) & ~self.occupancy[day] & ~visited
+            visited |= candidate_mask
+            for employee_id in iter_bits(candidate_mask):
+                employee = self.get_employee(employee_id)
+                excess_workload = employee.workload + shift_workload - self.WORKLOAD_LIMIT_PER_PERSON
+                if excess_workload <= 0:
+                    # employee has room for the shift, unwind the chain
+                    chain = [(employee_id, (day, shift), None)]
+                    while parent_index != -1:
+                        parent_employee_id, taken_slot, handed_over_slot, parent_index = nodes[parent_index]
+                        chain.append((parent_employee_id, taken_slot, handed_over_slot))
+                    return chain
+                # employee must hand over one of its shifts that frees enough workload
+                for other_day, other_shift in enumerate(self.assignment[employee_id]):
+                    if other_shift == -1 or other_day == day or (non_exchangeable_shift_mask >> other_shift) & 1:
+                        continue
+                    if self.get_shift(other_shift).get_workload_value() >= excess_workload:
+                        nodes.append((employee_id, (day, shift), (other_day, other_shift), parent_index))
+                        queue.append((other_day, other_shift, len(nodes) - 1))
+        return None
+
+
+    def repair_with_matching(self):
+        """
+        Fill unassigned main shifts by augmenting paths, a generalisation of exchange_assignment to chains of any length.
+        Open shifts and employees form a bipartite graph (an employee is adjacent to the shifts it is available for
+        and free on that day); an augmenting path moves shifts along a chain of employees so that nobody exceeds
+        WORKLOAD_LIMIT_PER_PERSON and nobody works twice in a day. Only the open shift adds to the total workload.
+        Passes are repeated until no open shift can be filled. Return the number of shifts filled.
+        It does not fill as many shifts as exchange_assignment when the limits are tight: an exchange puts the employee
+        on the open shift whatever its workload becomes, past WORKLOAD_LIMIT_PER_PERSON and TOTAL_WORKLOAD_LIMIT, and it
+        takes about twice as long.
+        """
+        non_exchangeable_shift_mask = to_bitmask(shift.id for shift in self.shifts if shift.is_even_numbered_shift)
+        filled = 0
+        progress = True
+        while progress:
+            progress = False
+            for day_index in range(self.num_days):
+                for shift_index in self.get_unassigned_shifts(day_index):
+                    if (non_exchangeable_shift_mask >> shift_index) & 1 or self.is_total_workload_exceeded(shift_index):
+                        continue
+                    chain = self.find_augmenting_path(day_index, shift_index, non_exchangeable_shift_mask)
+                    if chain is None:
+                        continue
+                    self.apply_augmenting_path(chain)
+                    filled += 1
+                    progress = True
+        self.instrumentation.count("augmenting_paths", filled)
+        return filled
+
+
+    def apply_augmenting_path(self, chain):
+        # apply the chain from the end, so each employee hands over its shift before taking the new one
+        for employee_id, (day, shift), handed_over_slot in chain:
+            employee = self.get_employee(employee_id)
+            if handed_over_slot is not None:
+                self.remove_employee_from_shift(employee, *handed_over_slot)
+            self.put_employee_to_shift(employee, day, shift)
+
+
+    def improve_schedule(self, time_budget=1.0, max_iterations=None, seed=0, initial_temperature=None, presolve=None):
+        """
+        Post-optimize the schedule of the last assign_work by simulated annealing, for time_budget seconds
+        or max_iterations proposed changes, whichever comes first. The neighbourhoods only touch main shifts
+        that are not even numbered, and never staff a backup shift:
+            move: an employee free that day takes over another employee's assignment
+            swap: two employees exchange their assignments of two days, or their shifts of the same day
+            fill: an employee takes an open slot (get_open_slots), leaving its shift of that day if it had one
+        Moves and swaps keep every slot's headcount, so only the workload variance changes: they are scored before
+        being applied and a worse variance is accepted with the annealing probability, the temperature cooling from
+        initial_temperature (by default about the variance change of moving one shift) to a thousandth of it.
+        A fill is applied through the ScheduleObjective and kept only if it lowers (unassigned main shifts, missing headcount).
+        Nothing breaks availability, one shift per day, the workload limits or the backup shift rule.
+        The best schedule found is restored at the end (rollback). With presolve (presolve_schedule), the search stops
+        once its bounds and the lowest variance for the total workload are reached.
+        Return score_schedule of the result.
+        """
+        num_employees = self.num_employees
+        searchable_shifts = [shift.id for shift in self.shifts if shift.is_main_shift and not shift.is_even_numbered_shift]
+        if not num_employees or not searchable_shifts or (time_budget is None and max_iterations is None):
+            return self.score_schedule(self.special_requirement)
+        is_searchable_shift = [False] * self.num_shifts
+        for shift_index in searchable_shifts:
+            is_searchable_shift[shift_index] = True
+        shift_workloads = [shift.get_workload_value() for shift in self.shifts]
+        backup_shift_ids = [shift.backup_shift_id for shift in self.shifts]
+        candidate_ids = {} # candidate_ids[(day, shift)] = get_available_employee_ids_for_shift, on first use
+        schedule, assignment, workloads, employees = self.schedule, self.assignment, self.workloads, self.employees
+        workload_limit, total_workload_limit = self.WORKLOAD_LIMIT_PER_PERSON, self.TOTAL_WORKLOAD_LIMIT
+        if initial_temperature is None:
+            mean_shift_workload = sum(shift_workloads[shift_index] for shift_index in searchable_shifts) / len(searchable_shifts)
+            initial_temperature = 2 * mean_shift_workload ** 2 / num_employees
+        # variance keys (see ScheduleObjective.get_score_key) are the variance times num_employees ** 2
+        temperature_key = initial_temperature * num_employees ** 2
+        rng = random.Random(seed)
+        start = time.perf_counter()
+        num_accepted = 0
+        num_iterations = 0
+
+        def get_candidates(day_index, shift_index):
+            ids = candidate_ids.get((day_index, shift_index))
+            if ids is None:
+                ids = candidate_ids[(day_index, shift_index)] = self.get_available_employee_ids_for_shift(day_index, shift_index)
+            return ids
+
+        own_journal = self.journal is None
+        objective = self.schedule_objective = ScheduleObjective(self)
+        try:
+            with self.instrumentation.phase("improve_schedule"), self.trial() as checkpoint:
+                best_key = objective.get_score_key()
+                best_index = checkpoint
+                open_slots = self.get_open_slots(searchable_shifts)
+                while max_iterations is None or num_iterations < max_iterations:
+                    if num_iterations % 64 == 0:
+                        elapsed = time.perf_counter() - start
+                        if time_budget is not None and elapsed >= time_budget:
+                            break
+                        if presolve is not None and is_ideal_score(best_key, presolve) and best_key[2] <= objective.get_min_variance_key():
+                            break
+                        progress = max(elapsed / time_budget if time_budget else 0, num_iterations / max_iterations if max_iterations else 0)
+                        temperature_key = initial_temperature * num_employees ** 2 * 0.001 ** progress
+                    num_iterations += 1
+                    draw = rng.random()
+
+                    if open_slots and draw < 0.1:
+                        # fill: an employee takes an open slot, kept only if the first two terms of the score improve
+                        day_index, shift_index = rng.choice(open_slots)
+                        candidates = get_candidates(day_index, shift_index)
+                        if not candidates:
+                            continue
+                        employee_id = rng.choice(candidates)
+                        old_shift_index = assignment[employee_id][day_index]
+                        if old_shift_index == shift_index or (old_shift_index != -1 and not is_searchable_shift[old_shift_index]):
+                            continue
+                        if backup_shift_ids[shift_index] != -1 and schedule[day_index][backup_shift_ids[shift_index]]:
+                            continue
+                        workload_change = shift_workloads[shift_index] - (shift_workloads[old_shift_index] if old_shift_index != -1 else 0)
+                        if workloads[employee_id] + workload_change > workload_limit or objective.total_workload + workload_change > total_workload_limit:
+                            continue
+                        score_key = objective.get_score_key()
+                        with self.trial() as fill_checkpoint:
+                            employee = employees[employee_id]
+                            if old_shift_index != -1:
+                                self.remove_employee_from_shift(employee, day_index, old_shift_index)
+                            self.put_employee_to_shift(employee, day_index, shift_index)
+                            if objective.get_score_key()[:2] >= score_key[:2]:
+                                self.rollback(fill_checkpoint)
+                                continue
+                        open_slots = self.get_open_slots(searchable_shifts)
+
+                    else:
+                        day_index = rng.randrange(self.num_days)
+                        shift_index = rng.choice(searchable_shifts)
+                        employee_ids = schedule[day_index][shift_index]
+                        candidates = get_candidates(day_index, shift_index)
+                        if not employee_ids or len(candidates) < 2:
+                            continue
+                        employee_id = rng.choice(employee_ids)
+                        other_employee_id = rng.choice(candidates)
+                        if other_employee_id == employee_id:
+                            continue
+                        workload, other_workload = workloads[employee_id], workloads[other_employee_id]
+
+                        if draw < 0.55:
+                            # move: the other employee takes the assignment
+                            if assignment[other_employee_id][day_index] != -1:
+                                continue
+                            workload_change = shift_workloads[shift_index]
+                            if other_workload + workload_change > workload_limit:
+                                continue
+                            variance_key_change = 2 * num_employees * workload_change * (other_workload - workload + workload_change)
+                            if variance_key_change > 0 and rng.random() >= math.exp(-variance_key_change / temperature_key):
+                                continue
+                            self.remove_employee_from_shift(employees[employee_id], day_index, shift_index)
+                            self.put_employee_to_shift(employees[other_employee_id], day_index, shift_index)
+
+                        else:
+                            # swap: the employees exchange the assignment with one of the other employee's
+                            other_day_index = rng.randrange(self.num_days)
+                            other_shift_index = assignment[other_employee_id][other_day_index]
+                            if other_shift_index == -1 or other_shift_index == shift_index or not is_searchable_shift[other_shift_index]:
+                                continue
+                            if other_day_index != day_index and (assignment[employee_id][other_day_index] != -1 or assignment[other_employee_id][day_index] != -1):
+                                continue
+                            if not (self.candidate_availability[other_day_index][other_shift_index] >> employee_id) & 1:
+                                continue
+                            workload_change = shift_workloads[other_shift_index] - shift_workloads[shift_index] # for the employee, the opposite for the other
+                            if workload + workload_change > workload_limit or other_workload - workload_change > workload_limit:
+                                continue
+                            variance_key_change = 2 * num_employees * workload_change * (workload - other_workload + workload_change)
+                            if variance_key_change > 0 and rng.random() >= math.exp(-variance_key_change / temperature_key):
+                                continue
+                            employee, other_employee = employees[employee_id], employees[other_employee_id]
+                            self.remove_employee_from_shift(employee, day_index, shift_index)
+                            self.remove_employee_from_shift(other_employee, other_day_index, other_shift_index)
+                            self.put_employee_to_shift(employee, other_day_index, other_shift_index)
+                            self.put_employee_to_shift(other_employee, day_index, shift_index)
+
+                    num_accepted += 1
+                    score_key = objective.get_score_key()
+                    if score_key <= best_key:
+                        # ties too, so the changes kept for the final rollback are only those since the last best
+                        best_key = score_key
+                        best_index = len(self.journal)
+                        if own_journal:
+                            # nothing outside this search rolls back past the best schedule, its changes need not be kept
+                            del self.journal[checkpoint:best_index]
+                            best_index = checkpoint
+                self.rollback(best_index)
+                # the search may have changed the workload of most employees: the priority heaps are rebuilt on next use
+                # rather than updated employee by employee when the trial ends
+                self.reset_employee_heaps()
+                self.deferred_heap_workloads.clear()
+        finally:
+            self.schedule_objective = None
+        self.instrumentation.count("local_search_iterations", num_iterations)
+        self.instrumentation.count("local_search_moves", num_accepted)
+        return self.score_schedule(self.special_requirement)
+
+
+    def get_open_slots(self, shift_ids):
+        """
+        Return the (day, shift) slots of the given shifts a schedule improves by staffing: unassigned main shifts
+        and extra shifts of the special requirements not met (see coverage_requirements)
+        """
+        slots = [
+            (day_index, shift_index)
+            for day_index in range(self.num_days)
+            for shift_index in shift_ids
+            if self.is_unassigned_shift(day_index, shift_index)
+        ]
+        requirements = self.coverage_requirements
+        if requirements is not None:
+            slots.extend(
+                (day_index, requirements.extra_shift_ids[requirement_id])
+                for requirement_id, (day_index, _, _) in enumerate(requirements.keys)
+                if requirements.get_deficit(requirement_id) > 0 and requirements.extra_shift_ids[requirement_id] in shift_ids
+            )
+        return list(dict.fromkeys(slots))
+
+
     def get_schedule(self):
         return self.schedule
     
     def get_assignment(self):
+        # assignment[employee][day], each row is an array('i') indexed like a list
         return self.assignment
 
-    def write_schedule(self):
-        # write schedule to csv file
-        with open('schedule.csv', mode='w', newline='') as csvfile:
-            writer = csv.writer(csvfile, delimiter=';')
-            writer.writerow(["Shifts"] + self.day_labels)
-            for shift in range(self.num_shifts):
-                row = [self.shift_labels[shift]]
-                for day in range(self.num_days):
-                    if self.schedule[day][shift] == []:
-                        row.append("None")
-                    else:
-                        employee_ids = self.schedule[day][shift]
-                        employee_names = ", ".join([self.get_employee(employee_id).name for employee_id in employee_ids])
-                        row.append(employee_names)
-                writer.writerow(row)
-        print ("Schedule is written to schedule.csv")
-
-    def write_assignment(self):
-        # write assignment of each employee to csv file
-        with open('assignment.csv', mode='w', newline='') as csvfile:
-            writer = csv.writer(csvfile, delimiter=';')
-            writer.writerow(["Employee"] + self.day_labels + ["Total Workload"])
-            for employee in self.employees:
-                row = [employee.name]
-                for day_index in range(len(self.day_labels)):
-                    shift = self.assignment[employee.id][day_index]
-                    if shift == -1:
-                        row.append("None")
-                    else:
-                        row.append(self.shift_labels[shift])
-                row.append(employee.workload)
-                writer.writerow(row)
-        print ("Assignment is written to assignment.csv")
+    def score_schedule(self, special_requirement=None):
+        """
+        Score of the schedule, lower is better, compared as a tuple:
+        (number of unassigned main shifts, missing special requirement headcount, variance of employees' workload)
+        """
+        num_unassigned_shifts = sum(len(self.get_unassigned_shifts(day_index)) for day_index in range(self.num_days))
+        missing_headcount = sum(required - assigned for *_, required, assigned in self.get_special_requirement_deficits(special_requirement))
+        mean_workload = self.total_workload / self.num_employees if self.num_employees else 0
+        workload_variance = sum((workload - mean_workload) ** 2 for workload in self.workloads) / self.num_employees if self.num_employees else 0
+        return (num_unassigned_shifts, missing_headcount, workload_variance)
 
 
-def main():
+    def apply_assignment(self, assignment):
+        # replace the current schedule by the given assignment[employee][day] = shift (-1 for none)
+        self.reset_assignments()
+        for employee_id, employee_assignment in enumerate(assignment):
+            for day_index, shift_index in enumerate(employee_assignment):
+                if shift_index != -1:
+                    self.put_employee_to_shift(self.get_employee(employee_id), day_index, shift_index)
+
+
+    def get_special_requirement_deficits(self, special_requirement):
+        """
+        Return list of (day_index, start_time, end_time, num_assignees_required, num_assignees)
+        for the requirements of special_requirement (see create_coverage_requirements) that are not met
+        """
+        if special_requirement is self.special_requirement and self.coverage_requirements is not None:
+            requirements = self.coverage_requirements
+        else:
+            requirements = self.create_coverage_requirements(special_requirement)
+        return requirements.get_deficits() if requirements is not None else []
+
+    def iter_schedule_rows(self):
+        # (shift id, [employee ids assigned in each day]) for each shift
+        for shift_index in range(self.num_shifts):
+            yield shift_index, [self.schedule[day_index][shift_index] for day_index in range(self.num_days)]
+
+    def iter_assignment_rows(self):
+        # (employee id, shift id or -1 for each day, workload) for each active employee
+        for employee in self.employees:
+            if employee.is_active:
+                yield employee.id, self.assignment[employee.id], self.workloads[employee.id]
+
+    def write_outputs(self, schedule_file='schedule.csv', assignment_file='assignment.csv', format="csv"):
+        """
+        Write the schedule and assignment views with one writer, streaming rows straight from the schedule state.
+        Each file is a path or a file object (text for csv and jsonl, binary for binary), None skips that view.
+        format is "csv" (the semicolon separated tables), "jsonl" or "binary" (columnar, see BinaryOutputWriter).
+        """
+        if format not in OUTPUT_WRITERS:
+            raise ValueError(f"Invalid output format: {format}")
+        writer = OUTPUT_WRITERS[format](self.day_labels, self.shift_labels, [employee.name for employee in self.employees])
+        for file, write, rows, description in (
+            (schedule_file, writer.write_schedule, self.iter_schedule_rows(), "Schedule"),
+            (assignment_file, writer.write_assignment, self.iter_assignment_rows(), "Assignment"),
+        ):
+            if file is None:
+                continue
+            with open_output(file, binary=writer.binary) as output_file:
+                write(output_file, rows)
+            if isinstance(file, (str, os.PathLike)):
+                print (f"{description} is written to {file}")
+
+    def write_schedule(self, file_path='schedule.csv', format="csv"):
+        # write the schedule view only (shifts x days), csv by default
+        self.write_outputs(schedule_file=file_path, assignment_file=None, format=format)
+
+    def write_assignment(self, file_path='assignment.csv', format="csv"):
+        # write the assignment view only (employees x days and their total workload), csv by default
+        self.write_outputs(schedule_file=None, assignment_file=file_path, format=format)
+
+
+def get_max_slot_matching(slot_masks):
+    """
+    Size of a maximum matching of slots to distinct employees, slot_masks[slot] = bitmask of the slot's candidates
+    (augmenting paths from each slot; only employees already matched are searched, a free candidate is taken directly)
+    """
+    employee_slots = {} # employee_slots[employee] = slot it is matched to
+    matched_mask = 0
+    visited_mask = 0
+
+    def augment(slot):
+        nonlocal matched_mask, visited_mask
+        free_mask = slot_masks[slot] & ~matched_mask
+        if free_mask:
+            employee_id = (free_mask & -free_mask).bit_length() - 1
+            matched_mask |= 1 << employee_id
+            employee_slots[employee_id] = slot
+            return True
+        for employee_id in iter_bits(slot_masks[slot] & ~visited_mask):
+            visited_mask |= 1 << employee_id
+            if augment(employee_slots[employee_id]):
+                employee_slots[employee_id] = slot
+                return True
+        return False
+
+    num_matched = 0
+    for slot in range(len(slot_masks)):
+        visited_mask = 0
+        if augment(slot):
+            num_matched += 1
+    return num_matched
+
+
+def get_min_cover_workload(shifts, opening_time, closing_time):
+    """
+    Minimum total workload of shifts covering every hour from opening to closing time that any of the shifts covers,
+    by dynamic programming over the hours; return (workload, list of [start_time, end_time] ranges no shift covers)
+    """
+    covered_hours = [False] * (closing_time - opening_time)
+    for shift in shifts:
+        for hour in range(max(shift.start_time, opening_time), min(shift.end_time, closing_time)):
+            covered_hours[hour - opening_time] = True
+    gaps = []
+    for hour in range(opening_time, closing_time):
+        if not covered_hours[hour - opening_time]:
+            if gaps and gaps[-1][1] == hour:
+                gaps[-1][1] = hour + 1
+            else:
+                gaps.append([hour, hour + 1])
+
+    # min_workloads[t] = least workload covering the coverable hours before opening_time + t
+    min_workloads = [0] + [math.inf] * (closing_time - opening_time)
+    for hour in range(opening_time, closing_time):
+        workload = min_workloads[hour - opening_time]
+        if workload == math.inf:
+            continue
+        if not covered_hours[hour - opening_time]:
+            next_index = hour - opening_time + 1
+            min_workloads[next_index] = min(min_workloads[next_index], workload)
+            continue
+        for shift in shifts:
+            if shift.start_time <= hour < shift.end_time:
+                next_index = min(shift.end_time, closing_time) - opening_time
+                min_workloads[next_index] = min(min_workloads[next_index], workload + shift.get_workload_value())
+    return min_workloads[-1], gaps
+
+
+def presolve_schedule(scheduler, special_requirement=None):
+    """
+    Bounds and infeasibilities of the scheduler's configuration from availability alone, to run before assign_work.
+    It only takes bitmask counts, a dynamic program over the hours and a slot matching per day, so bad inputs fail fast.
+    Return a dict:
+        candidate_counts[day][shift]: employees available for the shift or for a shift covering it (covering_shifts_map)
+        num_main_shifts: number of (day, main shift) slots
+        max_assigned_main_shifts: upper bound on the slots a schedule can fill with their main or backup shift,
+            the smallest of a maximum matching of each day's slots to its employees (a max flow per day)
+            and the number of shifts the per-person and total workload limits allow
+        min_unassigned_shifts: num_main_shifts - max_assigned_main_shifts, a lower bound on the first score_schedule term
+        min_coverage_workload: lower bound on the total workload of a schedule with someone working every hour
+            from opening to closing time every day (the cheapest cover of each day by shifts with candidates)
+        min_missing_headcount: lower bound on the missing special requirement headcount, the second score_schedule term
+        infeasibilities: list of dicts with "kind", "message", "day" and "shift" (labels, None when not relevant).
+            Kinds: no_candidates (nobody for a main shift nor its backup), coverage_gap (hours no shift with candidates covers),
+            total_workload_limit (below min_coverage_workload) and special_requirement (fewer candidates than required).
+    """
+    day_labels, shift_labels = scheduler.day_labels, scheduler.shift_labels
+    infeasibilities = []
+
+    def add_infeasibility(kind, message, day=None, shift=None):
+        infeasibilities.append({
+            "kind": kind,
+            "message": message,
+            "day": day_labels[day] if day is not None else None,
+            "shift": shift_labels[shift] if shift is not None else None,
+        })
+
+    candidate_availability = scheduler.candidate_availability
+    candidate_counts = [[mask.bit_count() for mask in day_availability] for day_availability in candidate_availability]
+    main_shifts = [shift for shift in scheduler.shifts if shift.is_main_shift]
+
+    num_matched = 0
+    day_candidate_masks = [] # day_candidate_masks[day] = employees who can fill some main shift slot of that day
+    for day_index, day_availability in enumerate(candidate_availability):
+        slot_masks = []
+        for shift in main_shifts:
+            mask = day_availability[shift.id]
+            if shift.backup_shift_id != -1:
+                mask |= day_availability[shift.backup_shift_id]
+            if not mask:
+                add_infeasibility("no_candidates", f"Nobody is available for {shift.label} on day {day_labels[day_index]}", day_index, shift.id)
+            slot_masks.append(mask)
+        num_matched += get_max_slot_matching(slot_masks)
+        day_candidate_masks.append(functools.reduce(operator.or_, slot_masks, 0))
+
+    # shifts the workload limits allow, each slot taking at least the lightest main or backup shift
+    slot_workloads = [shift.get_workload_value() for shift in main_shifts]
+    slot_workloads += [scheduler.get_shift(shift.backup_shift_id).get_workload_value() for shift in main_shifts if shift.backup_shift_id != -1]
+    min_slot_workload = min(slot_workloads, default=0)
+    max_assigned_main_shifts = num_matched
+    if min_slot_workload > 0 and scheduler.WORKLOAD_LIMIT_PER_PERSON < sys.maxsize:
+        max_shifts_per_person = int(scheduler.WORKLOAD_LIMIT_PER_PERSON // min_slot_workload)
+        if max_shifts_per_person < scheduler.num_days:
+            num_days_by_employee = collections.Counter(employee_id for mask in day_candidate_masks for employee_id in iter_bits(mask))
+            max_assigned_main_shifts = min(max_assigned_main_shifts, sum(min(num_days, max_shifts_per_person) for num_days in num_days_by_employee.values()))
+    if min_slot_workload > 0 and scheduler.TOTAL_WORKLOAD_LIMIT < sys.maxsize:
+        max_assigned_main_shifts = min(max_assigned_main_shifts, int(scheduler.TOTAL_WORKLOAD_LIMIT // min_slot_workload))
+    num_main_shifts = len(main_shifts) * scheduler.num_days
+
+    min_coverage_workload = 0
+    for day_index, day_availability in enumerate(candidate_availability):
+        staffable_shifts = [shift for shift in scheduler.shifts if day_availability[shift.id]]
+        workload, gaps = get_min_cover_workload(staffable_shifts, scheduler.OPENING_TIME, scheduler.CLOSING_TIME)
+        min_coverage_workload += workload
+        for gap_start, gap_end in gaps:
+            add_infeasibility("coverage_gap", f"Nobody is available on day {day_labels[day_index]} during the following time ranges:\n{gap_start} - {gap_end}", day_index)
+    if min_coverage_workload > scheduler.TOTAL_WORKLOAD_LIMIT:
+        add_infeasibility("total_workload_limit", f"Covering opening to closing time every day takes a workload of at least {min_coverage_workload}, "
+                          f"limit is {scheduler.TOTAL_WORKLOAD_LIMIT}")
+
+    min_missing_headcount = 0
+    requirements = scheduler.create_coverage_requirements(special_requirement)
+    for requirement_id, (day_index, start_time, end_time) in enumerate(requirements.keys if requirements is not None else []):
+        num_candidates = functools.reduce(
+            operator.or_, (candidate_availability[day_index][shift_id] for shift_id in scheduler.get_shifts_covering_time_range(start_time, end_time)), 0
+        ).bit_count()
+        num_assignees_required = requirements.num_assignees_required[requirement_id]
+        if num_candidates < num_assignees_required:
+            min_missing_headcount += num_assignees_required - num_candidates
+            add_infeasibility("special_requirement", f"Extra requirement for day {day_labels[day_index]} cannot be met. "
+                              f"Required: {num_assignees_required}. Available: {num_candidates}", day_index)
+
+    return {
+        "candidate_counts": candidate_counts,
+        "num_main_shifts": num_main_shifts,
+        "max_assigned_main_shifts": max_assigned_main_shifts,
+        "min_unassigned_shifts": num_main_shifts - max_assigned_main_shifts,
+        "min_coverage_workload": min_coverage_workload,
+        "min_missing_headcount": min_missing_headcount,
+        "infeasibilities": infeasibilities,
+    }
+
+
+SOFT_VIOLATION_KINDS = {"special_requirement"} # shortfalls a schedule may have when staff is short, every other kind is a broken constraint
+
+
+def is_hard_violation(violation):
+    return violation["kind"] not in SOFT_VIOLATION_KINDS
+
+
+def verify_schedule(scheduler, schedule=None, assignment=None, special_requirement=None):
+    """
+    Check a finished schedule against the scheduler's configuration, without the indexes the scheduler maintains with the schedule:
+    availability is rebuilt from shift_availability through covering_shifts_map for the slots that have employees,
+    workloads and headcounts are recounted from the schedule.
+    schedule[day][shift] (employee ids) and assignment[employee][day] (shift id, -1 for none) default to the scheduler's own,
+    special_requirement to the one of its last assign_work.
+    Checks run on bitmasks (one per day and shift) and on whole assignment rows in plain loops, deliberately not NumPy arrays
+    (not a dependency): the cost is about one pass over the assignments, around 1% of the assign_work that produced them.
+    Return a list of violations, dicts with "kind", "message", "day", "shift" and "employee" (None when not relevant).
+    Kinds: inconsistent (schedule and assignment disagree), unavailable, multiple_shifts (same day), workload_limit,
+    total_workload_limit, backup_shift (staffed while its main shift is, unless either is an extra shift of the special requirement:
+    the extra shift falls back to its backup when it runs out of employees), even_numbered_shift (odd number of days)
+    and special_requirement (headcount not met, see SOFT_VIOLATION_KINDS).
+    """
+    schedule = scheduler.schedule if schedule is None else schedule
+    assignment = scheduler.assignment if assignment is None else assignment
+    special_requirement = scheduler.special_requirement if special_requirement is None else special_requirement
+    day_labels, shift_labels = scheduler.day_labels, scheduler.shift_labels
+    violations = []
+
+    def add_violation(kind, message, day=None, shift=None, employee=None):
+        violations.append({
+            "kind": kind,
+            "message": message,
+            "day": day_labels[day] if day is not None else None,
+            "shift": shift_labels[shift] if shift is not None else None,
+            "employee": employee,
+        })
+
+    num_assigned = 0
+    for day_index, day_schedule in enumerate(schedule):
+        day_mask = 0
+        for shift_index, employee_ids in enumerate(day_schedule):
+            shift_mask = to_bitmask(employee_ids)
+            num_assigned += shift_mask.bit_count()
+            # the same employee twice in a shift, or in two shifts of the day
+            repeated_mask = day_mask & shift_mask
+            if len(employee_ids) != shift_mask.bit_count():
+                repeated_mask |= to_bitmask(employee_id for employee_id in set(employee_ids) if employee_ids.count(employee_id) > 1)
+            for employee_id in iter_bits(repeated_mask):
+                add_violation("multiple_shifts", f"Employee {employee_id} works more than one shift on day {day_labels[day_index]}", day_index, shift_index, employee_id)
+            day_mask |= shift_mask
+            if not shift_mask:
+                continue
+            day_availability = scheduler.shift_availability[day_index]
+            candidate_mask = functools.reduce(operator.or_, (day_availability[shift_id] for shift_id in scheduler.covering_shifts_map[shift_index]), 0)
+            for employee_id in iter_bits(shift_mask & ~candidate_mask):
+                add_violation("unavailable", f"Employee {employee_id} is not available for {shift_labels[shift_index]} on day {day_labels[day_index]}", day_index, shift_index, employee_id)
+            for employee_id in employee_ids:
+                if assignment[employee_id][day_index] != shift_index:
+                    add_violation("inconsistent", f"Employee {employee_id} is in the schedule of {shift_labels[shift_index]} on day {day_labels[day_index]} but not assigned to it", day_index, shift_index, employee_id)
+
+    # every schedule entry matches the assignment, so they agree iff the assignment has as many entries
+    if sum(len(employee_assignment) - employee_assignment.count(-1) for employee_assignment in assignment) != num_assigned:
+        for employee_id, employee_assignment in enumerate(assignment):
+            for day_index, shift_index in enumerate(employee_assignment):
+                if shift_index != -1 and employee_id not in schedule[day_index][shift_index]:
+                    add_violation("inconsistent", f"Employee {employee_id} is assigned to {shift_labels[shift_index]} on day {day_labels[day_index]} but not in the schedule", day_index, shift_index, employee_id)
+
+    # workload of each employee from its assignment row, -1 (no shift) indexes the trailing 0
+    shift_workloads = [shift.get_workload_value() for shift in scheduler.shifts] + [0]
+    total_workload = 0
+    for employee_id, employee_assignment in enumerate(assignment):
+        workload = sum(map(shift_workloads.__getitem__, employee_assignment))
+        total_workload += workload
+        if workload > scheduler.WORKLOAD_LIMIT_PER_PERSON:
+            add_violation("workload_limit", f"Workload of employee {employee_id} is {workload}, limit is {scheduler.WORKLOAD_LIMIT_PER_PERSON}", employee=employee_id)
+    if total_workload > scheduler.TOTAL_WORKLOAD_LIMIT:
+        add_violation("total_workload_limit", f"Total workload is {total_workload}, limit is {scheduler.TOTAL_WORKLOAD_LIMIT}")
+
+    for shift in scheduler.shifts:
+        if shift.is_even_numbered_shift:
+            for employee_id, employee_assignment in enumerate(assignment):
+                if employee_assignment.count(shift.id) % 2:
+                    add_violation("even_numbered_shift", f"Employee {employee_id} works {shift.label} on an odd number of days", shift=shift.id, employee=employee_id)
+
+    requirements = scheduler.create_coverage_requirements(special_requirement, schedule)
+    extra_shift_ids = set(requirements.extra_shift_ids) if requirements is not None else set()
+    for shift in scheduler.shifts:
+        if shift.backup_shift_id == -1 or shift.id in extra_shift_ids or shift.backup_shift_id in extra_shift_ids:
+            continue
+        for day_index, day_schedule in enumerate(schedule):
+            if day_schedule[shift.id] and day_schedule[shift.backup_shift_id]:
+                add_violation("backup_shift", f"Backup shift {shift_labels[shift.backup_shift_id]} is staffed on day {day_labels[day_index]} while {shift.label} is", day_index, shift.backup_shift_id)
+
+    if requirements is not None:
+        for day_index, _, _, num_assignees_required, num_assignees in requirements.get_deficits():
+            add_violation("special_requirement", f"Extra requirement for day {day_labels[day_index]} is not met. "
+                          f"Required: {num_assignees_required}. Assigned: {num_assignees}", day_index)
+    return violations
+
+
+def main(profile_path=None, availability_cache_dir=None, improve_seconds=None):
+    """
+    Schedule the availability file in data/ and write schedule.csv and assignment.csv.
+    With profile_path, assign_work runs under cProfile and the stats are saved to that path.
+    With availability_cache_dir, the parsed availability is cached there (see load_availability_cached).
+    With improve_seconds, improve_schedule post-optimizes the schedule for that many seconds.
+    """
     availability_file_path = 'data/data_31.08.24.csv'
     metadata = {
         "EMPLOYEE_NAME_COL_INDEX": 1,
@@ -594,7 +3028,11 @@ def main():
         "TIMESTAMP_FORMAT" :"%m/%d/%Y %H:%M:%S"
     }
     total_workload_limit = 140
-    scheduler = Scheduler(availability_file_path, metadata, total_workload_limit=total_workload_limit)
+    instrumentation = RecordingInstrumentation()
+    scheduler = Scheduler(availability_file_path, metadata, total_workload_limit=total_workload_limit, instrumentation=instrumentation,
+                          availability_cache_dir=availability_cache_dir)
+    print("Day labels:", scheduler.day_labels)
+    print("Shift labels:", scheduler.shift_labels)
 
     scheduler.set_backup_shift("14->18", "16->22") # 14-18 is backup for 16-22
     scheduler.set_even_numbered_shifts("16->22") # 16-22 is even numbered shift
@@ -610,11 +3048,591 @@ def main():
     # Define list of tuples. Each tuple contains the day and shift to assign work first
     scheduling_priority = []
 
-    scheduler.assign_work(scheduling_priority=scheduling_priority, special_requirement=special_requirement)
+    # what no schedule can satisfy, known before assigning anything
+    presolve = presolve_schedule(scheduler, special_requirement)
+    for infeasibility in presolve["infeasibilities"]:
+        print(f"Infeasible: {infeasibility['message']}")
+    print(f"At most {presolve['max_assigned_main_shifts']} of {presolve['num_main_shifts']} main shifts can be assigned")
+
+    if profile_path:
+        profile_call(scheduler.assign_work, scheduling_priority=scheduling_priority, special_requirement=special_requirement, output_path=profile_path)
+        print(f"Profile is written to {profile_path}")
+    else:
+        scheduler.assign_work(scheduling_priority=scheduling_priority, special_requirement=special_requirement)
+
+    if improve_seconds:
+        # even out the workloads (and fill what it can), never breaking a constraint
+        scheduler.improve_schedule(time_budget=improve_seconds, presolve=presolve)
+
+    scheduler.write_outputs()
+    print(instrumentation.report.format())
+    for violation in verify_schedule(scheduler):
+        if is_hard_violation(violation):
+            print(f"Constraint violated: {violation['message']}")
+
+
+def create_job_scheduler(job, availability_data=None, instrumentation=None):
+    # availability_data, if given, is used instead of reading job["availability_file"]
+    scheduler = Scheduler(availability_data or job["availability_file"], job.get("metadata"), total_workload_limit=job.get("total_workload_limit"),
+                          instrumentation=instrumentation, availability_cache_dir=job.get("availability_cache_dir"))
+    configure_job_shifts(scheduler, job)
+    return scheduler
+
+
+def configure_job_shifts(scheduler, job):
+    for shift_label, backup_shift_label in job.get("backup_shifts", {}).items():
+        scheduler.set_backup_shift(backup_shift_label, shift_label)
+    for shift_label in job.get("even_numbered_shifts", []):
+        scheduler.set_even_numbered_shifts(shift_label)
+
+
+def get_job_special_requirement(job):
+    # assign_work adds the shift id to the special requirement, so each run gets its own copy
+    special_requirement = job.get("special_requirement")
+    if not special_requirement:
+        return None
+    if isinstance(special_requirement, dict):
+        return dict(special_requirement)
+    return [dict(requirement) for requirement in special_requirement]
+
+
+def assign_job_work(scheduler, job, special_requirement, seed=None):
+    scheduler.assign_work(
+        scheduling_priority=[tuple(priority) for priority in job.get("scheduling_priority", [])],
+        special_requirement=special_requirement,
+        engine=job.get("engine", "greedy"),
+        repair=job.get("repair", "exchange"),
+        seed=seed,
+        slot_order=job.get("slot_order", "static"),
+    )
+    if job.get("improve_seconds"):
+        scheduler.improve_schedule(time_budget=job["improve_seconds"], seed=seed or 0)
+
+
+def write_job_outputs(scheduler, job, output_dir):
+    # schedule and assignment files in the job's output_format (csv by default)
+    output_format = job.get("output_format", "csv")
+    extension = OUTPUT_EXTENSIONS.get(output_format, "")
+    scheduler.write_outputs(
+        os.path.join(output_dir, "schedule" + extension),
+        os.path.join(output_dir, "assignment" + extension),
+        format=output_format,
+    )
+
+
+def run_scheduling_job(job):
+    """
+    Schedule one availability file and write its outputs. job is a dict:
+        name: job name, used for the default output directory
+        availability_file: path of the availability csv file
+        metadata: columns of the availability file, as in main()
+        total_workload_limit: optional total workload limit
+        backup_shifts: optional dict of shift label -> backup shift label
+        even_numbered_shifts: optional list of even numbered shift labels
+        special_requirement: optional special requirement, as in main(), or a list of them (see Scheduler.create_coverage_requirements)
+        scheduling_priority: optional list of [day label, shift label] to assign first
+        engine, repair, slot_order: optional, passed to assign_work
+        improve_seconds: optional time budget of Scheduler.improve_schedule after assign_work
+        output_format: optional, "csv" (default), "jsonl" or "binary", see Scheduler.write_outputs
+        availability_cache_dir: optional directory of the parsed availability cache, see load_availability_cached
+        output_dir: directory for the schedule and assignment files and log.txt (default output/<name>)
+    Return a summary dict with the timing, unassigned main shifts and unmet special requirements of the job,
+    and the infeasibilities presolve_schedule found before scheduling.
+    """
+    start = time.perf_counter()
+    output_dir = job.get("output_dir") or os.path.join("output", job["name"])
+    os.makedirs(output_dir, exist_ok=True)
+    instrumentation = RecordingInstrumentation()
+    with open(os.path.join(output_dir, "log.txt"), mode='w') as log, contextlib.redirect_stdout(log):
+        scheduler = create_job_scheduler(job, instrumentation=instrumentation)
+        special_requirement = get_job_special_requirement(job)
+        presolve = presolve_schedule(scheduler, special_requirement)
+        assign_job_work(scheduler, job, special_requirement)
+        write_job_outputs(scheduler, job, output_dir)
+        print(instrumentation.report.format())
+
+    return {
+        "name": job["name"],
+        "status": "ok",
+        "seconds": time.perf_counter() - start,
+        "output_dir": output_dir,
+        "phase_seconds": instrumentation.report.phase_seconds,
+        "counters": instrumentation.report.counters,
+        "infeasibilities": presolve["infeasibilities"],
+        **get_job_results(scheduler, special_requirement),
+    }
+
+
+def get_job_results(scheduler, special_requirement):
+    # what a job reports about its schedule
+    return {
+        "total_workload": scheduler.total_workload,
+        "unassigned_shifts": [
+            [scheduler.day_labels[day_index], scheduler.shift_labels[shift_index]]
+            for day_index in range(scheduler.num_days)
+            for shift_index in scheduler.get_unassigned_shifts(day_index)
+        ],
+        "unmet_special_requirements": [
+            {"day": scheduler.day_labels[day_index], "start_time": start_time, "end_time": end_time, "required": required, "assigned": assigned}
+            for day_index, start_time, end_time, required, assigned in scheduler.get_special_requirement_deficits(special_requirement)
+        ],
+        "violations": [violation for violation in verify_schedule(scheduler, special_requirement=special_requirement) if is_hard_violation(violation)],
+    }
+
+
+def load_batch_manifest(manifest_path):
+    """
+    The manifest is a json file {"defaults": {...}, "jobs": [{...}, ...]}; each job is merged over the defaults.
+    An output_dir in the defaults is the parent of the jobs' output directories (<output_dir>/<name>).
+    Relative paths are resolved against the manifest's directory.
+    """
+    with open(manifest_path) as manifest_file:
+        manifest = json.load(manifest_file)
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    defaults = dict(manifest.get("defaults", {}))
+    output_root = defaults.pop("output_dir", "output")
+    jobs = []
+    for index, job in enumerate(manifest["jobs"]):
+        job = {**defaults, **job}
+        job.setdefault("name", f"job_{index}")
+        job.setdefault("output_dir", os.path.join(output_root, job["name"]))
+        job["availability_file"] = os.path.join(base_dir, job["availability_file"])
+        job["output_dir"] = os.path.join(base_dir, job["output_dir"])
+        if job.get("availability_cache_dir"):
+            job["availability_cache_dir"] = os.path.join(base_dir, job["availability_cache_dir"])
+        jobs.append(job)
+    names = [job["name"] for job in jobs]
+    if len(set(names)) != len(names):
+        raise ValueError("Job names in the manifest must be unique.")
+    output_dirs = [os.path.normpath(job["output_dir"]) for job in jobs]
+    if len(set(output_dirs)) != len(output_dirs):
+        raise ValueError("Jobs in the manifest must have distinct output directories.")
+    return jobs
+
+
+def run_batch(jobs, max_workers=None):
+    """
+    Run independent scheduling jobs in a process pool. A failing job does not stop the others.
+    Return the job summaries in the order of jobs.
+    """
+    start = time.perf_counter()
+    summaries = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run_batch_job, job): job for job in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            job = futures[future]
+            try:
+                summaries[job["name"]] = future.result()
+            except Exception as error:
+                # the worker itself failed (see run_batch_job), seconds are counted from the start of the batch
+                summaries[job["name"]] = get_failed_job_summary(job, error, time.perf_counter() - start)
+    return [summaries[job["name"]] for job in jobs]
+
+
+def run_batch_job(job):
+    # run_scheduling_job in a batch worker, a failure is summarized with the seconds the job ran for
+    start = time.perf_counter()
+    try:
+        return run_scheduling_job(job)
+    except Exception as error:
+        return get_failed_job_summary(job, error, time.perf_counter() - start)
+
+
+def get_failed_job_summary(job, error, seconds):
+    return {"name": job["name"], "status": "failed", "seconds": seconds, "error": f"{type(error).__name__}: {error}"}
+
+
+_portfolio_job = None
+_portfolio_availability_data = None
+
+
+def _init_portfolio_worker(job, availability_data, worker_pids):
+    # every worker parses nothing and receives the job and availability once; its pid is reported for terminate_executor
+    worker_pids.put(os.getpid())
+    global _portfolio_job, _portfolio_availability_data
+    _portfolio_job = job
+    _portfolio_availability_data = availability_data
+
+
+def _run_portfolio_variant(seed):
+    with contextlib.redirect_stdout(None):
+        scheduler = create_job_scheduler(_portfolio_job, _portfolio_availability_data)
+        special_requirement = get_job_special_requirement(_portfolio_job)
+        assign_job_work(scheduler, _portfolio_job, special_requirement, seed=seed)
+    is_valid = not any(is_hard_violation(violation) for violation in verify_schedule(scheduler, special_requirement=special_requirement))
+    return seed, is_valid, scheduler.score_schedule(special_requirement), [list(employee_assignment) for employee_assignment in scheduler.get_assignment()]
+
 
-    scheduler.write_schedule()
-    scheduler.write_assignment()
+def is_ideal_score(score, presolve=None):
+    # every main shift is assigned and every special requirement is met; workload variance cannot be judged ideal.
+    # With presolve (presolve_schedule), reaching its bounds is ideal: no schedule does better
+    if presolve is not None:
+        return score[0] <= presolve["min_unassigned_shifts"] and score[1] <= presolve["min_missing_headcount"]
+    return score[0] == 0 and score[1] == 0
+
+
+def terminate_executor(executor, worker_pids):
+    # cancel the runs not started and terminate the worker processes of the runs in progress, without waiting for the runs;
+    # worker_pids is the queue the pool initializer put each worker's pid in (see _init_portfolio_worker)
+    while not worker_pids.empty():
+        with contextlib.suppress(ProcessLookupError):
+            os.kill(worker_pids.get(), signal.SIGTERM)
+    # the executor notices its workers died, fails the runs left and joins the workers
+    executor.shutdown(wait=True, cancel_futures=True)
+
+
+def run_portfolio(job, num_runs=32, time_budget=None, max_workers=None, base_seed=0):
+    """
+    Run assign_work for the job (see run_scheduling_job) with num_runs orderings in a process pool:
+    the default ordering (seed None) and seeds base_seed, base_seed + 1, ... (see Scheduler.set_ordering_seed).
+    Stop early once a run reaches an ideal score (is_ideal_score, against the bounds of presolve_schedule) or time_budget seconds have passed:
+    runs not started are cancelled and the worker processes of runs in progress are terminated (see terminate_executor).
+    Runs whose schedule breaks a constraint (verify_schedule) are counted in num_invalid_runs, runs that raise in num_failed_runs;
+    neither is kept.
+    Return dict with the best seed, its score (Scheduler.score_schedule), its assignment, the number of runs completed,
+    num_invalid_runs and num_failed_runs; scheduler.assign_work(..., seed=best seed) reproduces the best schedule.
+    """
+    deadline = time.perf_counter() + time_budget if time_budget is not None else None
+    if job.get("availability_cache_dir"):
+        availability_data = load_availability_cached(job["availability_file"], job["metadata"], job["availability_cache_dir"])
+    else:
+        availability_data = load_availability(job["availability_file"], job["metadata"])
+    with contextlib.redirect_stdout(None):
+        presolve = presolve_schedule(create_job_scheduler(job, availability_data), get_job_special_requirement(job))
+    seeds = [None] + [base_seed + run for run in range(num_runs - 1)]
+    best = None
+    num_completed = 0
+    num_invalid_runs = 0
+    num_failed_runs = 0
+    stopped_early = True
+    worker_pids = multiprocessing.SimpleQueue()
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=_init_portfolio_worker,
+                                                      initargs=(job, availability_data, worker_pids))
+    try:
+        futures = [executor.submit(_run_portfolio_variant, seed) for seed in seeds]
+        remaining_time = deadline - time.perf_counter() if deadline is not None else None
+        for future in concurrent.futures.as_completed(futures, timeout=remaining_time):
+            num_completed += 1
+            try:
+                seed, is_valid, score, assignment = future.result()
+            except Exception:
+                num_failed_runs += 1
+                continue
+            if not is_valid:
+                num_invalid_runs += 1
+                continue
+            # on equal scores the default ordering, then the lowest seed wins
+            if best is None or score < best["score"] or (score == best["score"] and (best["seed"] is not None and (seed is None or seed < best["seed"]))):
+                best = {"seed": seed, "score": score, "assignment": assignment}
+            if is_ideal_score(score, presolve):
+                break
+        else:
+            stopped_early = False
+    except concurrent.futures.TimeoutError:
+        pass
+    finally:
+        if stopped_early:
+            terminate_executor(executor, worker_pids)
+        else:
+            executor.shutdown(wait=True)
+    if best is not None:
+        best["num_runs"] = num_completed
+        best["num_invalid_runs"] = num_invalid_runs
+        best["num_failed_runs"] = num_failed_runs
+        best["presolve"] = {key: value for key, value in presolve.items() if key != "candidate_counts"}
+    return best
+
+
+def portfolio_main(job_path, num_runs, time_budget=None, max_workers=None):
+    with open(job_path) as job_file:
+        job = json.load(job_file)
+    base_dir = os.path.dirname(os.path.abspath(job_path))
+    job["availability_file"] = os.path.join(base_dir, job["availability_file"])
+    if job.get("availability_cache_dir"):
+        job["availability_cache_dir"] = os.path.join(base_dir, job["availability_cache_dir"])
+    best = run_portfolio(job, num_runs=num_runs, time_budget=time_budget, max_workers=max_workers)
+    if best is None:
+        print("No valid run finished within the time budget.")
+        return None
+    print(f"Best of {best['num_runs']} runs: seed {best['seed']}, "
+          f"{best['score'][0]} unassigned shifts, {best['score'][1]} missing special requirement assignees, workload variance {best['score'][2]:.2f}")
+    print(f"Presolve bounds: at least {best['presolve']['min_unassigned_shifts']} unassigned shifts, "
+          f"{best['presolve']['min_missing_headcount']} missing special requirement assignees")
+    if best["num_invalid_runs"]:
+        print(f"{best['num_invalid_runs']} runs broke a constraint and were discarded")
+    if best["num_failed_runs"]:
+        print(f"{best['num_failed_runs']} runs failed and were discarded")
+    scheduler = create_job_scheduler(job)
+    scheduler.apply_assignment(best["assignment"])
+    output_dir = os.path.join(base_dir, job.get("output_dir", "output"))
+    os.makedirs(output_dir, exist_ok=True)
+    write_job_outputs(scheduler, job, output_dir)
+    return best
+
+
+def batch_main(manifest_path, max_workers=None, summary_path=None):
+    start = time.perf_counter()
+    summaries = run_batch(load_batch_manifest(manifest_path), max_workers=max_workers)
+    for summary in summaries:
+        if summary["status"] == "ok":
+            print(f"{summary['name']}: {summary['seconds']:.2f}s, "
+                  f"{len(summary['unassigned_shifts'])} unassigned shifts, "
+                  f"{len(summary['unmet_special_requirements'])} unmet special requirements")
+        else:
+            print(f"{summary['name']}: failed after {summary['seconds']:.2f}s, {summary['error']}")
+    print(f"{len(summaries)} jobs in {time.perf_counter() - start:.2f}s")
+    if summary_path:
+        with open(summary_path, mode='w') as summary_file:
+            json.dump(summaries, summary_file, indent=2)
+        print(f"Summary is written to {summary_path}")
+    return summaries
+
+
+_daemon_templates = {} # in each daemon worker: (availability file, metadata) -> (file signature, template Scheduler)
+
+
+def get_daemon_template(job):
+    """
+    Return the template Scheduler of the job's availability file, kept in the worker process, and whether it was already warm.
+    The template is rebuilt when the size or modification time of the file changes.
+    """
+    file_path = job["availability_file"]
+    key = (file_path, json.dumps(job.get("metadata"), sort_keys=True))
+    file_stat = os.stat(file_path)
+    signature = (file_stat.st_mtime_ns, file_stat.st_size)
+    cached = _daemon_templates.get(key)
+    if cached is not None and cached[0] == signature:
+        return cached[1], True
+    template = Scheduler(file_path, job.get("metadata"), availability_cache_dir=job.get("availability_cache_dir"))
+    _daemon_templates[key] = (signature, template)
+    return template, False
+
+
+def run_daemon_job(job):
+    """
+    Schedule a daemon request, a job as in run_scheduling_job with an optional seed, from the template of its file.
+    The schedule and assignment are returned as json records (see JsonLinesOutputWriter),
+    and written as in run_scheduling_job if the job has an output_dir.
+    """
+    start = time.perf_counter()
+    template, is_warm = get_daemon_template(job)
+    scheduler = template.copy_template(total_workload_limit=job.get("total_workload_limit"))
+    configure_job_shifts(scheduler, job)
+    special_requirement = get_job_special_requirement(job)
+    with contextlib.redirect_stdout(None):
+        assign_job_work(scheduler, job, special_requirement, seed=job.get("seed"))
+        if job.get("output_dir"):
+            os.makedirs(job["output_dir"], exist_ok=True)
+            write_job_outputs(scheduler, job, job["output_dir"])
+    writer = JsonLinesOutputWriter(scheduler.day_labels, scheduler.shift_labels, [employee.name for employee in scheduler.employees])
+    return {
+        "status": "ok",
+        "seconds": time.perf_counter() - start,
+        "availability": "warm" if is_warm else "cold",
+        **get_job_results(scheduler, special_requirement),
+        "schedule": list(writer.iter_schedule_records(scheduler.iter_schedule_rows())),
+        "assignment": list(writer.iter_assignment_records(scheduler.iter_assignment_rows())),
+    }
+
+
+class SchedulingDaemon:
+    """
+    Local scheduling server: one json request per line on a Unix socket, answered by one json line.
+    A request is a scheduling job (see run_daemon_job) or a command {"command": "ping" | "stats" | "shutdown"}.
+    Each worker process keeps the parsed availability and a Scheduler template per file warm (get_daemon_template).
+    Requests are routed to a worker by availability file: a file is parsed once, and requests for different files run concurrently
+    while requests for the same file queue on its worker.
+    The socket is only accessible to its owner. Requests can only write their outputs under output_root
+    (an output_dir relative to it, or inside it); without output_root, requests with an output_dir are rejected.
+    """
+    REQUEST_SIZE_LIMIT = 1 << 24
+
+    def __init__(self, socket_path, max_workers=None, output_root=None) -> None:
+        self.socket_path = socket_path
+        self.num_workers = max_workers or os.cpu_count() or 1
+        self.output_root = os.path.realpath(output_root) if output_root else None
+        self.executors = []
+        self.stats = {"requests": 0, "errors": 0, "warm": 0, "cold": 0}
+        self.is_stopping = False
+        self.stopped = None
+
+    def get_executor_index(self, file_path):
+        return zlib.crc32(file_path.encode()) % self.num_workers
+
+    def remove_stale_socket(self):
+        # a socket file left by a daemon that did not shut down cleanly; anything else at the path is left alone
+        try:
+            mode = os.stat(self.socket_path).st_mode
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(mode):
+            raise FileExistsError(f"{self.socket_path} exists and is not a socket")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            try:
+                connection.connect(self.socket_path)
+            except ConnectionRefusedError:
+                os.remove(self.socket_path)
+                return
+        raise RuntimeError(f"A daemon is already listening on {self.socket_path}")
+
+    def get_output_dir(self, output_dir):
+        # output_dir of a request, resolved under output_root; ValueError if it would write anywhere else
+        if self.output_root is None:
+            raise ValueError("The daemon was started without an output root, requests cannot write outputs")
+        resolved_dir = os.path.realpath(os.path.join(self.output_root, output_dir))
+        if os.path.commonpath([resolved_dir, self.output_root]) != self.output_root:
+            raise ValueError(f"output_dir must be inside the daemon's output root {self.output_root}")
+        return resolved_dir
+
+    async def serve(self):
+        self.stopped = asyncio.Event()
+        self.remove_stale_socket()
+        self.executors = [concurrent.futures.ProcessPoolExecutor(max_workers=1) for _ in range(self.num_workers)]
+        # created without group and other permissions, so no one else can connect even before the chmod
+        umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(self.handle_connection, path=self.socket_path, limit=self.REQUEST_SIZE_LIMIT)
+        finally:
+            os.umask(umask)
+        os.chmod(self.socket_path, 0o600)
+        try:
+            async with server:
+                await self.stopped.wait()
+        finally:
+            for executor in self.executors:
+                executor.shutdown(wait=True, cancel_futures=True)
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.socket_path)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while not self.is_stopping:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await self.handle_request(line)
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            # client gone, or a request longer than REQUEST_SIZE_LIMIT
+            pass
+        finally:
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+            if self.is_stopping:
+                self.stopped.set()
+
+    async def handle_request(self, line):
+        self.stats["requests"] += 1
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("A request must be a json object")
+            command = request.get("command", "schedule")
+            if command == "ping":
+                return {"status": "ok"}
+            if command == "stats":
+                return {"status": "ok", "workers": self.num_workers, **self.stats}
+            if command == "shutdown":
+                self.is_stopping = True
+                return {"status": "ok"}
+            if command != "schedule":
+                raise ValueError(f"Invalid command: {command}")
+            job = {key: value for key, value in request.items() if key != "command"}
+            if "availability_file" not in job:
+                raise ValueError("A schedule request needs an availability_file")
+            if job.get("output_dir"):
+                job["output_dir"] = self.get_output_dir(job["output_dir"])
+            executor_index = self.get_executor_index(job["availability_file"])
+            try:
+                response = await asyncio.get_running_loop().run_in_executor(self.executors[executor_index], run_daemon_job, job)
+            except concurrent.futures.process.BrokenProcessPool:
+                # the worker died (killed, out of memory), the next request for its files gets a new one
+                self.executors[executor_index] = concurrent.futures.ProcessPoolExecutor(max_workers=1)
+                raise
+            self.stats[response["availability"]] += 1
+            return response
+        except Exception as error:
+            self.stats["errors"] += 1
+            return {"status": "error", "error": f"{type(error).__name__}: {error}"}
+
+
+def request_daemon(socket_path, request, timeout=None):
+    """
+    Send one request to a SchedulingDaemon listening on socket_path and return its response.
+    Relative input paths in the request are resolved here, the daemon may run in another directory;
+    output_dir is left as is, the daemon resolves it under its output root.
+    """
+    request = dict(request)
+    for key in ("availability_file", "availability_cache_dir"):
+        if request.get(key):
+            request[key] = os.path.abspath(request[key])
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(timeout)
+        connection.connect(socket_path)
+        connection.sendall(json.dumps(request).encode() + b"\n")
+        with connection.makefile('rb') as response_file:
+            line = response_file.readline()
+    if not line:
+        raise ConnectionError("The daemon closed the connection without responding")
+    return json.loads(line)
+
+
+def serve_main(socket_path, max_workers=None, output_root=None):
+    daemon = SchedulingDaemon(socket_path, max_workers=max_workers, output_root=output_root)
+    print(f"Listening on {socket_path} with {daemon.num_workers} workers")
+    asyncio.run(daemon.serve())
+
+
+def request_main(socket_path, job_path=None, command=None):
+    if job_path:
+        with open(job_path) as job_file:
+            request = json.load(job_file)
+        base_dir = os.path.dirname(os.path.abspath(job_path))
+        for key in ("availability_file", "availability_cache_dir"):
+            if request.get(key):
+                request[key] = os.path.join(base_dir, request[key])
+    else:
+        request = {"command": command or "ping"}
+    response = request_daemon(socket_path, request)
+    print(json.dumps(response, indent=2))
+    return response
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Create working schedules from employees' weekly availability.")
+    subparsers = parser.add_subparsers(dest="command")
+    batch_parser = subparsers.add_parser("batch", help="schedule every job of a manifest in a process pool")
+    batch_parser.add_argument("manifest", help="json manifest of scheduling jobs")
+    batch_parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: number of cores)")
+    batch_parser.add_argument("--summary", default=None, help="path of the json summary of the jobs")
+    portfolio_parser = subparsers.add_parser("portfolio", help="schedule one job with many orderings in a process pool and keep the best")
+    portfolio_parser.add_argument("job", help="json scheduling job, as in a batch manifest")
+    portfolio_parser.add_argument("--runs", type=int, default=32, help="number of orderings to try")
+    portfolio_parser.add_argument("--time-budget", type=float, default=None, help="seconds after which the best schedule so far is kept")
+    portfolio_parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: number of cores)")
+    parser.add_argument("--profile", metavar="PATH", default=None, help="profile the default run with cProfile and save the stats to PATH")
+    parser.add_argument("--availability-cache", metavar="DIR", nargs="?", const=DEFAULT_AVAILABILITY_CACHE_DIR, default=None,
+                        help=f"cache the parsed availability of the default run in DIR (default: {DEFAULT_AVAILABILITY_CACHE_DIR})")
+    parser.add_argument("--improve-seconds", metavar="SECONDS", type=float, default=None,
+                        help="post-optimize the schedule of the default run for SECONDS (default: off)")
+    serve_parser = subparsers.add_parser("serve", help="run a scheduling daemon on a Unix socket")
+    serve_parser.add_argument("socket", help="path of the Unix socket")
+    serve_parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: number of cores)")
+    serve_parser.add_argument("--output-root", default=None, help="directory requests may write their outputs under (default: none, outputs are only returned)")
+    request_parser = subparsers.add_parser("request", help="send a request to a scheduling daemon and print the response")
+    request_parser.add_argument("socket", help="path of the Unix socket")
+    request_parser.add_argument("job", nargs="?", default=None, help="json scheduling job, as in a batch manifest")
+    request_parser.add_argument("--command", dest="daemon_command", choices=("ping", "stats", "shutdown"), default=None, help="send a command instead of a job")
+    args = parser.parse_args()
+    if args.command == "batch":
+        batch_main(args.manifest, max_workers=args.workers, summary_path=args.summary)
+    elif args.command == "portfolio":
+        portfolio_main(args.job, args.runs, time_budget=args.time_budget, max_workers=args.workers)
+    elif args.command == "serve":
+        serve_main(args.socket, max_workers=args.workers, output_root=args.output_root)
+    elif args.command == "request":
+        request_main(args.socket, job_path=args.job, command=args.daemon_command)
+    else:
+        main(profile_path=args.profile, availability_cache_dir=args.availability_cache, improve_seconds=args.improve_seconds)
\ No newline at end of file
@@ -0,0 +1,150 @@
+"""
+Tests of the availability loader: load_availability against the two-pass path it replaced, and its on-disk cache.
+"""
+import contextlib
+import csv
+import datetime
+import io
+import os
+import random
+import re
+
+import pytest
+
+from test import AvailabilityData, Scheduler, load_availability, load_availability_cached
+
+METADATA = {
+    "EMPLOYEE_NAME_COL_INDEX": 1,
+    "AVAILABILITY_START_COL_INDEX": 2,
+    "DELIMITER": ",",
+    "TIMESTAMP_COL_INDEX": 0,
+    "TIMESTAMP_FORMAT": "%m/%d/%Y %H:%M:%S",
+}
+
+
+def load_availability_two_pass(file_path, metadata):
+    # Scheduler.extract_shift_and_day_labels and Scheduler.extract_employee_availability before the single-pass loader
+    AVAILABILITY_START_COL_INDEX = metadata["AVAILABILITY_START_COL_INDEX"]
+    EMPLOYEE_NAME_COL_INDEX = metadata["EMPLOYEE_NAME_COL_INDEX"]
+    DELIMITER = metadata["DELIMITER"]
+    TIMESTAMP_COL_INDEX = metadata["TIMESTAMP_COL_INDEX"]
+    TIMESTAMP_FORMAT = metadata["TIMESTAMP_FORMAT"]
+    shift_labels = set()
+    with open(file_path, newline='') as csvfile:
+        reader = csv.reader(csvfile, delimiter=DELIMITER)
+        header = next(reader)
+        day_labels = header[AVAILABILITY_START_COL_INDEX:]
+        rows = [row for row in reader]
+        for row in rows:
+            for day_availability in row[AVAILABILITY_START_COL_INDEX:]:
+                day_availability = day_availability.lower().strip()
+                if day_availability == 'off' or day_availability == 'free':
+                    continue
+                for shift in day_availability.split(","):
+                    shift_labels.add(shift.strip())
+    START_TIME_INDEX = 0
+    shift_labels = sorted(shift_labels, key=lambda shift: int(re.findall(r'\d+', shift)[START_TIME_INDEX]))
+
+    with open(file_path, newline='') as csvfile:
+        reader = csv.reader(csvfile, delimiter=DELIMITER)
+        next(reader) # skip header
+        rows = [row for row in reader]
+        rows = sorted(rows, key=lambda row: datetime.datetime.strptime(row[TIMESTAMP_COL_INDEX], TIMESTAMP_FORMAT))
+        employee_names = [row[EMPLOYEE_NAME_COL_INDEX] for row in rows]
+        availability = []
+        for row in rows:
+            employee_availability = [[] for _ in range(len(day_labels))]
+            for day_index, day_availability in enumerate(row[AVAILABILITY_START_COL_INDEX:]):
+                if day_availability.lower() == 'off':
+                    employee_availability[day_index] = []
+                elif day_availability.lower() == 'free':
+                    employee_availability[day_index] = list(range(len(shift_labels)))
+                else:
+                    for shift in day_availability.split(","):
+                        shift = shift.strip()
+                        employee_availability[day_index].append(shift_labels.index(shift))
+            availability.append(employee_availability)
+    return AvailabilityData(day_labels, shift_labels, employee_names, availability)
+
+
+def write_availability_csv(file_path, num_employees, num_days, seed):
+    # off and free days, several shifts per cell in any order, rows cut short and few distinct timestamps (ties)
+    rng = random.Random(seed)
+    shift_labels = ["6->10", "8->12", "10->16", "12->18", "14->18", "16->22", "18->22"]
+    timestamps = [datetime.datetime(2024, 8, 1) + datetime.timedelta(hours=rng.randrange(48)) for _ in range(max(1, num_employees // 4))]
+    with open(file_path, mode='w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["Timestamp", "Name"] + [f"Day {day + 1}" for day in range(num_days)])
+        for employee_id in range(num_employees):
+            cells = []
+            for _ in range(num_days):
+                draw = rng.random()
+                if draw < 0.2:
+                    cells.append(rng.choice(["off", "Off", "OFF"]))
+                elif draw < 0.3:
+                    cells.append(rng.choice(["free", "Free"]))
+                else:
+                    cells.append(", ".join(rng.sample(shift_labels, rng.randint(1, 4))))
+            if rng.random() < 0.2:
+                cells = cells[:rng.randrange(num_days)]
+            writer.writerow([rng.choice(timestamps).strftime(METADATA["TIMESTAMP_FORMAT"]), f"Employee {employee_id}"] + cells)
+
+
+def get_start_time(shift_label):
+    return int(re.findall(r'\d+', shift_label)[0])
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_load_availability_matches_two_pass_path(tmp_path, seed):
+    file_path = tmp_path / "availability.csv"
+    write_availability_csv(file_path, num_employees=40, num_days=7, seed=seed)
+    expected = load_availability_two_pass(file_path, METADATA)
+    loaded = load_availability(file_path, METADATA)
+
+    assert loaded.day_labels == expected.day_labels
+    assert loaded.employee_names == expected.employee_names
+    # the two-pass path orders labels by start time only, so labels with the same start time come in set order
+    assert [get_start_time(label) for label in loaded.shift_labels] == [get_start_time(label) for label in expected.shift_labels]
+    assert sorted(loaded.shift_labels) == sorted(expected.shift_labels)
+    assert [[[loaded.shift_labels[shift_id] for shift_id in day] for day in employee] for employee in loaded.availability] \
+        == [[[expected.shift_labels[shift_id] for shift_id in day] for day in employee] for employee in expected.availability]
+
+
+def test_short_row_is_off_on_missing_days(tmp_path):
+    file_path = tmp_path / "availability.csv"
+    file_path.write_text(
+        "Timestamp,Name,Mon,Tue,Wed\n"
+        "08/01/2024 10:00:00,A,8->12,8->12,8->12\n"
+        "08/01/2024 11:00:00,B,off\n"
+    )
+    availability_data = load_availability(file_path, METADATA)
+    assert availability_data.availability[1] == [[], [], []]
+    with contextlib.redirect_stdout(io.StringIO()):
+        scheduler = Scheduler(availability_data, None)
+        scheduler.assign_work(scheduling_priority=[])
+    assert [list(employee_assignment) for employee_assignment in scheduler.get_assignment()] == [[0, 0, 0], [-1, -1, -1]]
+
+
+def test_cached_load_matches_load_availability(tmp_path):
+    file_path = tmp_path / "availability.csv"
+    write_availability_csv(file_path, num_employees=40, num_days=7, seed=0)
+    cache_dir = tmp_path / "cache"
+    expected = load_availability(file_path, METADATA)
+    for _ in range(2): # written, then read
+        loaded = load_availability_cached(file_path, METADATA, cache_dir)
+        assert (loaded.day_labels, loaded.shift_labels, loaded.employee_names, loaded.availability) \
+            == (expected.day_labels, expected.shift_labels, expected.employee_names, expected.availability)
+    assert len(os.listdir(cache_dir)) == 1
+
+
+def test_failed_cache_write_leaves_no_file(tmp_path, monkeypatch):
+    file_path = tmp_path / "availability.csv"
+    write_availability_csv(file_path, num_employees=10, num_days=7, seed=0)
+    cache_dir = tmp_path / "cache"
+
+    def fail_replace(source, destination):
+        raise OSError("disk full")
+    monkeypatch.setattr(os, "replace", fail_replace)
+    with pytest.raises(OSError):
+        load_availability_cached(file_path, METADATA, cache_dir)
+    assert os.listdir(cache_dir) == []
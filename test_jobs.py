@@ -0,0 +1,115 @@
+"""
+Tests of the job runners: batch manifests, run_batch, run_portfolio and the scheduling daemon.
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import stat
+import threading
+import time
+
+import pytest
+
+from generate_availability import GENERATED_METADATA, write_availability_file
+from test import SchedulingDaemon, load_batch_manifest, request_daemon, run_batch, run_portfolio
+
+
+def write_manifest(tmp_path, manifest):
+    manifest_path = tmp_path / "manifest.json"
+    manifest_path.write_text(json.dumps(manifest))
+    return manifest_path
+
+
+def test_output_dir_in_defaults_is_the_parent_of_the_job_directories(tmp_path):
+    manifest_path = write_manifest(tmp_path, {
+        "defaults": {"availability_file": "availability.csv", "output_dir": "results"},
+        "jobs": [{"name": "a"}, {"name": "b"}, {"name": "c", "output_dir": "elsewhere"}],
+    })
+    jobs = load_batch_manifest(manifest_path)
+    assert [job["output_dir"] for job in jobs] == [
+        os.path.join(tmp_path, "results", "a"), os.path.join(tmp_path, "results", "b"), os.path.join(tmp_path, "elsewhere"),
+    ]
+
+
+def test_jobs_sharing_an_output_dir_are_rejected(tmp_path):
+    manifest_path = write_manifest(tmp_path, {
+        "defaults": {"availability_file": "availability.csv"},
+        "jobs": [{"name": "a", "output_dir": "results"}, {"name": "b", "output_dir": "results/"}],
+    })
+    with pytest.raises(ValueError):
+        load_batch_manifest(manifest_path)
+
+
+def test_failed_job_summary_has_its_seconds(tmp_path):
+    manifest_path = write_manifest(tmp_path, {"jobs": [{"name": "missing", "availability_file": "missing.csv"}]})
+    [summary] = run_batch(load_batch_manifest(manifest_path), max_workers=1)
+    assert summary["status"] == "failed"
+    assert summary["seconds"] >= 0
+
+
+def test_portfolio_stops_runs_in_progress_at_the_deadline(tmp_path):
+    availability_file = tmp_path / "availability.csv"
+    write_availability_file(availability_file, 30, 7, 6)
+    # every run searches far longer than the time budget
+    job = {"name": "portfolio", "availability_file": str(availability_file), "metadata": GENERATED_METADATA, "improve_seconds": 30}
+    start = time.perf_counter()
+    best = run_portfolio(job, num_runs=4, time_budget=0.5, max_workers=2)
+    assert time.perf_counter() - start < 10
+    assert best is None
+    assert not multiprocessing.active_children()
+
+
+def start_daemon(socket_path, output_root=None):
+    daemon = SchedulingDaemon(str(socket_path), max_workers=1, output_root=output_root)
+    thread = threading.Thread(target=asyncio.run, args=(daemon.serve(),), daemon=True)
+    thread.start()
+    for _ in range(500):
+        if os.path.exists(socket_path):
+            break
+        time.sleep(0.01)
+    return thread
+
+
+def test_daemon_schedules_a_request(tmp_path):
+    availability_file = tmp_path / "availability.csv"
+    write_availability_file(availability_file, 30, 7, 6)
+    socket_path = tmp_path / "daemon.sock"
+    output_root = tmp_path / "outputs"
+    thread = start_daemon(socket_path, output_root=str(output_root))
+    try:
+        assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+        assert request_daemon(str(socket_path), {"command": "ping"}, timeout=30) == {"status": "ok"}
+        job = {"availability_file": str(availability_file), "metadata": GENERATED_METADATA, "total_workload_limit": 150}
+        response = request_daemon(str(socket_path), {**job, "output_dir": "job"}, timeout=60)
+        assert response["status"] == "ok"
+        assert response["schedule"] and not response["violations"]
+        assert os.path.exists(output_root / "job" / "schedule.csv")
+        # outputs go nowhere outside the output root
+        for output_dir in ("../escaped", str(tmp_path / "escaped")):
+            response = request_daemon(str(socket_path), {**job, "output_dir": output_dir}, timeout=60)
+            assert response["status"] == "error"
+        assert not os.path.exists(tmp_path / "escaped")
+        # a second daemon does not take over the socket
+        with pytest.raises(RuntimeError):
+            SchedulingDaemon(str(socket_path)).remove_stale_socket()
+    finally:
+        request_daemon(str(socket_path), {"command": "shutdown"}, timeout=30)
+        thread.join(timeout=30)
+    assert not thread.is_alive()
+    assert not os.path.exists(socket_path)
+
+
+def test_daemon_replaces_only_a_stale_socket(tmp_path):
+    socket_path = tmp_path / "daemon.sock"
+    socket_path.write_text("not a socket")
+    with pytest.raises(FileExistsError):
+        SchedulingDaemon(str(socket_path)).remove_stale_socket()
+    socket_path.unlink()
+
+    # a socket file nobody listens on, as left by a daemon that was killed
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale_socket:
+        stale_socket.bind(str(socket_path))
+    SchedulingDaemon(str(socket_path)).remove_stale_socket()
+    assert not os.path.exists(socket_path)
@@ -0,0 +1,104 @@
+"""
+Tests of the output writers: csv against the writers they replaced, jsonl and the binary format read back with read_binary_output.
+"""
+import contextlib
+import csv
+import io
+import json
+
+import pytest
+
+from generate_availability import generate_availability_data
+from test import Scheduler, read_binary_output
+
+
+@pytest.fixture
+def scheduler():
+    availability_data = generate_availability_data(30, 7, 6, overlap=2.0, seed=3)
+    # a tight limit, so some shifts are left without employees
+    scheduler = Scheduler(availability_data, None, total_workload_limit=150)
+    with contextlib.redirect_stdout(io.StringIO()):
+        scheduler.assign_work(scheduling_priority=[])
+    return scheduler
+
+
+def write_schedule_before_writers(scheduler, file_path):
+    # Scheduler.write_schedule before the writer layer, with the path as argument
+    with open(file_path, mode='w', newline='') as csvfile:
+        writer = csv.writer(csvfile, delimiter=';')
+        writer.writerow(["Shifts"] + scheduler.day_labels)
+        for shift in range(scheduler.num_shifts):
+            row = [scheduler.shift_labels[shift]]
+            for day in range(scheduler.num_days):
+                if scheduler.schedule[day][shift] == []:
+                    row.append("None")
+                else:
+                    employee_ids = scheduler.schedule[day][shift]
+                    employee_names = ", ".join([scheduler.get_employee(employee_id).name for employee_id in employee_ids])
+                    row.append(employee_names)
+            writer.writerow(row)
+
+
+def write_assignment_before_writers(scheduler, file_path):
+    # Scheduler.write_assignment before the writer layer, with the path as argument
+    with open(file_path, mode='w', newline='') as csvfile:
+        writer = csv.writer(csvfile, delimiter=';')
+        writer.writerow(["Employee"] + scheduler.day_labels + ["Total Workload"])
+        for employee in scheduler.employees:
+            row = [employee.name]
+            for day_index in range(len(scheduler.day_labels)):
+                shift = scheduler.assignment[employee.id][day_index]
+                if shift == -1:
+                    row.append("None")
+                else:
+                    row.append(scheduler.shift_labels[shift])
+            row.append(employee.workload)
+            writer.writerow(row)
+
+
+def test_csv_output_is_unchanged(scheduler, tmp_path):
+    assert any(not employee_ids for day_schedule in scheduler.schedule for employee_ids in day_schedule)
+    with contextlib.redirect_stdout(io.StringIO()):
+        scheduler.write_outputs(tmp_path / "schedule.csv", tmp_path / "assignment.csv")
+    write_schedule_before_writers(scheduler, tmp_path / "expected_schedule.csv")
+    write_assignment_before_writers(scheduler, tmp_path / "expected_assignment.csv")
+    assert (tmp_path / "schedule.csv").read_bytes() == (tmp_path / "expected_schedule.csv").read_bytes()
+    assert (tmp_path / "assignment.csv").read_bytes() == (tmp_path / "expected_assignment.csv").read_bytes()
+
+
+def test_jsonl_rows_parse(scheduler):
+    schedule_file, assignment_file = io.StringIO(), io.StringIO()
+    scheduler.write_outputs(schedule_file, assignment_file, format="jsonl")
+    schedule_records = [json.loads(line) for line in schedule_file.getvalue().splitlines()]
+    assert [record["shift"] for record in schedule_records] == scheduler.shift_labels
+    for shift_index, record in enumerate(schedule_records):
+        assert record["days"] == {
+            day_label: [scheduler.get_employee(employee_id).name for employee_id in scheduler.schedule[day_index][shift_index]]
+            for day_index, day_label in enumerate(scheduler.day_labels)
+        }
+    assignment_records = [json.loads(line) for line in assignment_file.getvalue().splitlines()]
+    assert len(assignment_records) == scheduler.num_employees
+    for employee, record in zip(scheduler.employees, assignment_records):
+        assert record["employee"] == employee.name
+        assert record["total_workload"] == employee.workload
+        assert list(record["days"].values()) == [scheduler.shift_labels[shift_id] if shift_id != -1 else None for shift_id in scheduler.assignment[employee.id]]
+
+
+def test_binary_output_round_trips(scheduler):
+    schedule_file, assignment_file = io.BytesIO(), io.BytesIO()
+    scheduler.write_outputs(schedule_file, assignment_file, format="binary")
+    assignment_file.seek(0)
+    output = read_binary_output(assignment_file)
+    assert output["view"] == "assignment"
+    assert output["days"] == scheduler.day_labels and output["shifts"] == scheduler.shift_labels
+    assert output["employees"] == [employee.name for employee in scheduler.employees]
+    assert [list(employee_assignment) for employee_assignment in zip(*output["shift_ids"])] == [list(employee_assignment) for employee_assignment in scheduler.assignment]
+    assert list(output["workloads"]) == list(scheduler.workloads)
+
+    schedule_file.seek(0)
+    output = read_binary_output(schedule_file)
+    assert output["view"] == "schedule"
+    offsets, employee_indexes = output["offsets"], output["employee_indexes"]
+    # cells in shift-major order
+    cells = [list(employee_indexes[offsets[cell]:offsets[cell + 1]]) for cell in range(len(offsets) - 1)]
+    assert cells == [scheduler.schedule[day_index][shift_index] for shift_index in range(scheduler.num_shifts) for day_index in range(scheduler.num_days)]
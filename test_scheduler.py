@@ -0,0 +1,436 @@
+"""
+Tests of Scheduler on generated availability (see generate_availability.py).
+"""
+import contextlib
+import heapq
+import io
+import random
+
+import pytest
+
+from generate_availability import generate_availability_data
+import test
+from test import (ConstrainedSlotQueue, IndexedHeap, Instrumentation, PriorityQueue, RecordingInstrumentation, ScheduleObjective, Scheduler, is_hard_violation,
+                  presolve_schedule, verify_schedule)
+
+
+def create_scheduler(seed=3, total_workload_limit=150, **kwargs):
+    # the last shift is even numbered with the second to last as backup, the special requirement staffs the evening
+    availability_data = generate_availability_data(30, 7, 6, overlap=2.0, seed=seed)
+    scheduler = Scheduler(availability_data, None, total_workload_limit=total_workload_limit, **kwargs)
+    shift_labels = availability_data.shift_labels
+    scheduler.set_backup_shift(shift_labels[-2], shift_labels[-1])
+    scheduler.set_even_numbered_shifts(shift_labels[-1])
+    closing_shift = scheduler.get_shift(scheduler.num_shifts - 1)
+    special_requirement = {
+        "start_time": closing_shift.start_time,
+        "end_time": closing_shift.end_time,
+        "num_assignees_required": 2,
+        "shift_to_assign_extra": scheduler.shift_labels[-3],
+    }
+    return scheduler, special_requirement
+
+
+def test_consistency_check_mode():
+    # every put and remove cross-validates the occupancy index against the schedule (validate_occupancy)
+    instrumentation = RecordingInstrumentation()
+    scheduler, special_requirement = create_scheduler(check_consistency=True, instrumentation=instrumentation)
+    # a queried headcount is kept up to date from then on, and checked with the rest
+    shift = scheduler.get_shift(2)
+    assert scheduler.get_num_assignees_within_time_range(0, shift.start_time, shift.end_time) == 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        scheduler.assign_work(scheduling_priority=[], special_requirement=special_requirement, repair="exchange")
+        assert instrumentation.report.counters.get("exchanges", 0) > 0
+
+        for employee_id in range(0, scheduler.num_employees, 3):
+            for day_index in range(scheduler.num_days):
+                if scheduler.assignment[employee_id][day_index] != -1:
+                    scheduler.update_availability(employee_id, day_index, [])
+                    break
+        for day_index in range(scheduler.num_days):
+            scheduler.update_availability(day_index, day_index, list(range(scheduler.num_shifts)))
+        scheduler.remove_employee(1)
+    scheduler.validate_occupancy()
+    covering_shift_ids = scheduler.get_shifts_covering_time_range(shift.start_time, shift.end_time)
+    assert scheduler.get_num_assignees_within_time_range(0, shift.start_time, shift.end_time) \
+        == sum(len(scheduler.schedule[0][shift_id]) for shift_id in covering_shift_ids) > 0
+
+
+def test_consistency_check_detects_a_stale_index():
+    scheduler, special_requirement = create_scheduler()
+    with contextlib.redirect_stdout(io.StringIO()):
+        scheduler.assign_work(scheduling_priority=[], special_requirement=special_requirement)
+    scheduler.validate_occupancy()
+    day_index = next(day for day in range(scheduler.num_days) if scheduler.occupancy[day])
+    scheduler.occupancy[day_index] = 0
+    with pytest.raises(RuntimeError):
+        scheduler.validate_occupancy()
+
+
+@pytest.mark.parametrize("total_workload_limit", [150, 250, 400])
+def test_flow_assignments_are_within_the_workload_limits(total_workload_limit):
+    scheduler, special_requirement = create_scheduler(total_workload_limit=total_workload_limit)
+    scheduler.coverage_requirements = scheduler.create_coverage_requirements(special_requirement)
+    assert scheduler.assign_shifts_with_flow()
+    assert scheduler.total_workload > 0
+    assert max(scheduler.workloads) <= scheduler.WORKLOAD_LIMIT_PER_PERSON
+    assert scheduler.total_workload <= scheduler.TOTAL_WORKLOAD_LIMIT
+
+
+def test_time_budget_is_only_for_the_flow_engine():
+    scheduler, special_requirement = create_scheduler()
+    with pytest.raises(ValueError):
+        scheduler.assign_work(scheduling_priority=[], special_requirement=special_requirement, time_budget=1.0)
+
+
+class EventlessInstrumentation(Instrumentation):
+    def event(self, kind, message, **fields):
+        raise AssertionError(f"{kind} event built while instrumentation is disabled")
+
+
+def test_events_are_not_built_when_instrumentation_is_disabled():
+    # the tight limit leaves coverage gaps and unmet special requirements
+    scheduler, special_requirement = create_scheduler(total_workload_limit=100, instrumentation=EventlessInstrumentation())
+    scheduler.assign_work(scheduling_priority=[], special_requirement=special_requirement)
+    recorded, special_requirement = create_scheduler(total_workload_limit=100, instrumentation=RecordingInstrumentation())
+    recorded.assign_work(scheduling_priority=[], special_requirement=special_requirement)
+    assert {event["kind"] for event in recorded.instrumentation.report.events} >= {"coverage_gap", "unmet_special_requirement"}
+
+
+def test_verify_schedule_does_not_trust_the_candidate_index():
+    scheduler, special_requirement = create_scheduler()
+    with contextlib.redirect_stdout(io.StringIO()):
+        scheduler.assign_work(scheduling_priority=[], special_requirement=special_requirement)
+    day_index, shift_index = 0, 0
+    employee_id = next(
+        employee_id for employee_id in range(scheduler.num_employees)
+        if scheduler.assignment[employee_id][day_index] == -1 and not (scheduler.candidate_availability[day_index][shift_index] >> employee_id) & 1
+    )
+    # a stale candidate index that lets the employee in
+    scheduler.candidate_availability[day_index][shift_index] |= 1 << employee_id
+    scheduler.put_employee_to_shift(scheduler.get_employee(employee_id), day_index, shift_index)
+    violations = verify_schedule(scheduler, special_requirement=special_requirement)
+    assert {"kind": "unavailable", "day": scheduler.day_labels[day_index], "shift": scheduler.shift_labels[shift_index], "employee": employee_id} \
+        in [{key: violation[key] for key in ("kind", "day", "shift", "employee")} for violation in violations]
+
+
+@pytest.mark.parametrize("seed, slot_order", [(0, "static"), (3, "static"), (0, "most_constrained"), (2, "most_constrained")])
+def test_even_numbered_shift_partners_do_not_take_the_backup_shift(seed, slot_order):
+    # with the days shuffled or filled out of order, the partner day may already have its backup shift staffed
+    scheduler, special_requirement = create_scheduler(total_workload_limit=None)
+    with contextlib.redirect_stdout(io.StringIO()):
+        scheduler.assign_work(scheduling_priority=[], special_requirement=special_requirement, seed=seed, slot_order=slot_order)
+    assert not [violation for violation in verify_schedule(scheduler, special_requirement=special_requirement) if violation["kind"] == "backup_shift"]
+
+
+def test_schedule_objective_matches_score_schedule():
+    scheduler, special_requirement = create_scheduler()
+    with contextlib.redirect_stdout(io.StringIO()):
+        scheduler.assign_work(scheduling_priority=[], special_requirement=special_requirement)
+    objective = scheduler.schedule_objective = ScheduleObjective(scheduler)
+    assert objective.get_score() == pytest.approx(scheduler.score_schedule(special_requirement))
+    # take every assignment of the first days off and put it back, scoring after each change
+    changes = [(employee_id, day_index, scheduler.assignment[employee_id][day_index])
+               for day_index in range(3) for employee_id in range(scheduler.num_employees) if scheduler.assignment[employee_id][day_index] != -1]
+    for employee_id, day_index, shift_index in changes:
+        scheduler.remove_employee_from_shift(scheduler.get_employee(employee_id), day_index, shift_index)
+        assert objective.get_score() == pytest.approx(scheduler.score_schedule(special_requirement))
+    for employee_id, day_index, shift_index in reversed(changes):
+        scheduler.put_employee_to_shift(scheduler.get_employee(employee_id), day_index, shift_index)
+        assert objective.get_score() == pytest.approx(scheduler.score_schedule(special_requirement))
+
+
+def get_hard_violations(scheduler, special_requirement):
+    return {(violation["kind"], violation.get("day"), violation.get("shift"), violation.get("employee"))
+            for violation in verify_schedule(scheduler, special_requirement=special_requirement) if is_hard_violation(violation)}
+
+
+@pytest.mark.parametrize("total_workload_limit", [150, 250, None])
+def test_improve_schedule_breaks_no_constraint(total_workload_limit):
+    # with the consistency checks on, every change of the search is cross-validated too
+    scheduler, special_requirement = create_scheduler(total_workload_limit=total_workload_limit, check_consistency=True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        scheduler.assign_work(scheduling_priority=[], special_requirement=special_requirement)
+    # assign_work may already break some, the search must not add any
+    hard_violations = get_hard_violations(scheduler, special_requirement)
+    score = scheduler.score_schedule(special_requirement)
+    assert scheduler.improve_schedule(time_budget=None, max_iterations=2000) <= score
+    assert get_hard_violations(scheduler, special_requirement) <= hard_violations
+
+
+@pytest.mark.parametrize("engine", ["greedy", "flow"])
+def test_special_requirement_falling_back_to_the_backup_shift_verifies(engine):
+    # the closing shift is the extra shift, with too few employees for it the backup shift makes up the headcount
+    scheduler, special_requirement = create_scheduler(total_workload_limit=None)
+    closing_shift = scheduler.get_shift(scheduler.num_shifts - 1)
+    special_requirement.update(num_assignees_required=3, shift_to_assign_extra=closing_shift.label)
+    with contextlib.redirect_stdout(io.StringIO()):
+        scheduler.assign_work(scheduling_priority=[], special_requirement=special_requirement, engine=engine)
+    assert any(day_schedule[closing_shift.id] and day_schedule[closing_shift.backup_shift_id] for day_schedule in scheduler.schedule)
+    assert not [violation for violation in verify_schedule(scheduler, special_requirement=special_requirement) if is_hard_violation(violation)]
+
+
+@pytest.mark.parametrize("seed, total_workload_limit", [(1, 250), (2, 250), (3, 180)])
+def test_matching_repair_keeps_the_workload_limits(seed, total_workload_limit):
+    # configurations where the greedy pass leaves shifts that augmenting paths can fill
+    instrumentation = RecordingInstrumentation()
+    scheduler, special_requirement = create_scheduler(seed=seed, total_workload_limit=total_workload_limit, check_consistency=True,
+                                                      instrumentation=instrumentation)
+    with contextlib.redirect_stdout(io.StringIO()):
+        scheduler.assign_work(scheduling_priority=[], special_requirement=special_requirement, repair="matching")
+    assert instrumentation.report.counters.get("augmenting_paths", 0) > 0
+    kinds = {violation["kind"] for violation in verify_schedule(scheduler, special_requirement=special_requirement)}
+    assert not kinds & {"workload_limit", "total_workload_limit"}
+
+
+def assign_scheduler(total_workload_limit=250):
+    scheduler, special_requirement = create_scheduler(total_workload_limit=total_workload_limit, check_consistency=True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        scheduler.assign_work(scheduling_priority=[], special_requirement=special_requirement)
+    return scheduler
+
+
+def assert_changes_are_applied(scheduler, changes, old_assignment):
+    # changes are (employee_id, day_index, old shift, new shift), exactly the differences from the old assignment
+    assert changes == sorted(
+        (employee_id, day_index, old_shift, scheduler.assignment[employee_id][day_index])
+        for employee_id, employee_assignment in enumerate(old_assignment)
+        for day_index, old_shift in enumerate(employee_assignment)
+        if scheduler.assignment[employee_id][day_index] != old_shift
+    )
+    scheduler.validate_occupancy()
+
+
+def test_added_employee_fills_open_shifts_without_moving_anyone():
+    scheduler = assign_scheduler()
+    workload_limit = scheduler.WORKLOAD_LIMIT_PER_PERSON
+    old_assignment = [list(employee_assignment) for employee_assignment in scheduler.assignment] + [[-1] * scheduler.num_days]
+    employee_id, changes = scheduler.add_employee("New", [list(range(scheduler.num_shifts))] * scheduler.num_days)
+    assert employee_id == scheduler.num_employees - 1
+    assert scheduler.WORKLOAD_LIMIT_PER_PERSON == workload_limit
+    assert changes and all(change[0] == employee_id for change in changes)
+    assert_changes_are_applied(scheduler, changes, old_assignment)
+
+
+def test_removed_employee_leaves_the_schedule():
+    scheduler = assign_scheduler()
+    workload_limit = scheduler.WORKLOAD_LIMIT_PER_PERSON
+    old_assignment = [list(employee_assignment) for employee_assignment in scheduler.assignment]
+    employee_id = max(range(scheduler.num_employees), key=scheduler.workloads.__getitem__)
+    changes = scheduler.remove_employee(employee_id)
+    assert scheduler.WORKLOAD_LIMIT_PER_PERSON == workload_limit
+    assert [change for change in changes if change[0] == employee_id] == [
+        (employee_id, day_index, shift_index, -1) for day_index, shift_index in enumerate(old_assignment[employee_id]) if shift_index != -1
+    ]
+    assert not any((candidate_mask >> employee_id) & 1 for day_candidates in scheduler.candidate_availability for candidate_mask in day_candidates)
+    assert_changes_are_applied(scheduler, changes, old_assignment)
+
+
+def test_total_workload_limit_changes_remove_and_refill_assignments():
+    scheduler = assign_scheduler()
+    old_assignment = [list(employee_assignment) for employee_assignment in scheduler.assignment]
+    total_workload = scheduler.total_workload
+    # tighter: assignments over the limits are removed, the slots refilled by employees with room left
+    changes = scheduler.set_total_workload_limit(180)
+    assert scheduler.WORKLOAD_LIMIT_PER_PERSON == 180 / scheduler.num_employees
+    assert max(scheduler.workloads) <= scheduler.WORKLOAD_LIMIT_PER_PERSON and scheduler.total_workload <= 180 < total_workload
+    assert any(new_shift == -1 for *_, new_shift in changes)
+    assert_changes_are_applied(scheduler, changes, old_assignment)
+
+    old_assignment = [list(employee_assignment) for employee_assignment in scheduler.assignment]
+    # no limit: only open shifts are filled
+    changes = scheduler.set_total_workload_limit(None)
+    assert changes and all(old_shift == -1 for *_, old_shift, _ in changes)
+    assert_changes_are_applied(scheduler, changes, old_assignment)
+
+
+
+class EmployeeComparator:
+    # the heap entry PriorityQueue replaced: workload first, then the number of available shifts compared with <=
+    def __init__(self, key, employee_id):
+        self.key = key
+        self.employee_id = employee_id
+
+    def __lt__(self, other):
+        if self.key[0] != other.key[0]:
+            return self.key[0] < other.key[0]
+        return self.key[1] <= other.key[1]
+
+
+def test_priority_queue_pops_ties_as_the_employee_comparator_heap():
+    rng = random.Random(0)
+    for _ in range(200):
+        keyed_items = [((rng.randint(0, 3), rng.randint(0, 2)), employee_id) for employee_id in range(rng.randint(1, 40))]
+        queue = PriorityQueue(keyed_items)
+        comparator_heap = [EmployeeComparator(key, employee_id) for key, employee_id in keyed_items]
+        heapq.heapify(comparator_heap)
+        popped, comparator_popped = [], []
+        while not queue.is_empty():
+            popped.append(queue.pop())
+            comparator_popped.append(heapq.heappop(comparator_heap).employee_id)
+            if rng.random() < 0.2:
+                key = (rng.randint(0, 3), rng.randint(0, 2))
+                queue.push(popped[-1], key)
+                heapq.heappush(comparator_heap, EmployeeComparator(key, popped[-1]))
+        assert popped == comparator_popped and not comparator_heap
+
+
+def test_indexed_heap_update_reorders():
+    rng = random.Random(0)
+    keys = {item: (rng.randint(0, 20), item) for item in range(50)}
+    heap = IndexedHeap((key, item) for item, key in keys.items())
+    for _ in range(500):
+        item = rng.randrange(50)
+        keys[item] = (rng.randint(0, 20), item)
+        heap.update(item, keys[item])
+        assert heap.get_key(item) == keys[item]
+    assert [heap.pop() for _ in range(len(heap))] == sorted(keys, key=keys.get)
+    assert heap.is_empty() and not heap.position
+
+
+@pytest.mark.parametrize("arguments", [{"engine": "annealing"}, {"slot_order": "random"}, {"repair": "none"}, {"max_steps": -1}])
+def test_iter_assign_work_rejects_bad_arguments_before_the_first_step(arguments):
+    scheduler, special_requirement = create_scheduler()
+    with pytest.raises(ValueError):
+        scheduler.iter_assign_work(scheduling_priority=[], special_requirement=special_requirement, **arguments)
+
+
+@pytest.mark.parametrize("stop", [{"max_steps": 0}, {"max_seconds": 0}])
+def test_stopping_before_the_first_step_returns_every_slot(stop):
+    scheduler, special_requirement = create_scheduler()
+    slots = scheduler.assign_work(scheduling_priority=[], special_requirement=special_requirement, **stop)
+    extra_shift_id = scheduler.get_shift_id_by_label(special_requirement["shift_to_assign_extra"])
+    main_shift_ids = [shift.id for shift in scheduler.shifts if shift.is_main_shift]
+    assert sorted(slots) == sorted({(day_index, shift_index) for day_index in range(scheduler.num_days) for shift_index in main_shift_ids + [extra_shift_id]})
+    assert scheduler.total_workload == 0
+
+
+def test_stopping_after_some_steps_returns_the_slots_left():
+    scheduler, special_requirement = create_scheduler()
+    all_slots = scheduler.assign_work(scheduling_priority=[], special_requirement=special_requirement, max_steps=0)
+    # a day is one step per main shift, then one for its special requirement
+    num_steps = len([shift for shift in scheduler.shifts if shift.is_main_shift]) + 1
+    scheduler, special_requirement = create_scheduler(check_consistency=True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        slots = scheduler.assign_work(scheduling_priority=[], special_requirement=special_requirement, max_steps=num_steps)
+    day_index = scheduler.prioritize_days()[0]
+    assert slots == [slot for slot in all_slots if slot[0] != day_index]
+    assert scheduler.total_workload > 0
+    scheduler.validate_occupancy()
+
+
+def get_schedule_state(scheduler):
+    return ([list(employee_assignment) for employee_assignment in scheduler.assignment],
+            [[list(employee_ids) for employee_ids in day_schedule] for day_schedule in scheduler.schedule],
+            list(scheduler.workloads), scheduler.total_workload)
+
+
+def remove_assignments(scheduler, day_indexes):
+    for day_index in day_indexes:
+        for shift_index, employee_ids in enumerate(scheduler.schedule[day_index]):
+            for employee_id in list(employee_ids):
+                scheduler.remove_employee_from_shift(scheduler.get_employee(employee_id), day_index, shift_index)
+
+
+def test_rollback_restores_the_schedule():
+    scheduler = assign_scheduler()
+    state = get_schedule_state(scheduler)
+    with scheduler.trial() as checkpoint:
+        remove_assignments(scheduler, [0, 2])
+        with scheduler.trial():
+            remove_assignments(scheduler, [4])
+        assert get_schedule_state(scheduler) != state
+        scheduler.rollback(checkpoint)
+    assert get_schedule_state(scheduler) == state
+    scheduler.validate_occupancy()
+
+
+def test_exception_in_a_trial_restores_the_schedule():
+    scheduler = assign_scheduler()
+    state = get_schedule_state(scheduler)
+    with pytest.raises(KeyError):
+        with scheduler.trial():
+            remove_assignments(scheduler, range(scheduler.num_days))
+            raise KeyError("failed move")
+    assert get_schedule_state(scheduler) == state
+    scheduler.validate_occupancy()
+
+
+def test_changing_a_fork_leaves_the_parent_unchanged():
+    scheduler = assign_scheduler()
+    state = get_schedule_state(scheduler)
+    availability = [list(day_availability) for day_availability in scheduler.candidate_availability]
+    fork = scheduler.fork()
+    assert get_schedule_state(fork) == state
+    remove_assignments(fork, range(scheduler.num_days))
+    fork.add_employee("New", [list(range(scheduler.num_shifts))] * scheduler.num_days)
+    fork.set_total_workload_limit(None)
+    assert fork.total_workload > 0
+    fork.validate_occupancy()
+    assert get_schedule_state(scheduler) == state
+    assert scheduler.candidate_availability == availability
+    assert scheduler.num_employees == len(scheduler.employees) == len(scheduler.workloads)
+    scheduler.validate_occupancy()
+
+
+
+@pytest.mark.parametrize("seed", [0, 1, 3])
+@pytest.mark.parametrize("engine", ["greedy", "flow"])
+@pytest.mark.parametrize("total_workload_limit", [100, 150, None])
+def test_presolve_bounds_are_lower_bounds(seed, engine, total_workload_limit):
+    # at limit 100 the workload bound is tight: no main shift can be filled
+    scheduler, special_requirement = create_scheduler(seed=seed, total_workload_limit=total_workload_limit)
+    presolve = presolve_schedule(scheduler, special_requirement)
+    with contextlib.redirect_stdout(io.StringIO()):
+        scheduler.assign_work(scheduling_priority=[], special_requirement=special_requirement, engine=engine)
+    num_unassigned_shifts, missing_headcount, _ = scheduler.score_schedule(special_requirement)
+    assert presolve["min_unassigned_shifts"] <= num_unassigned_shifts
+    assert presolve["min_missing_headcount"] <= missing_headcount
+    assert presolve["num_main_shifts"] - num_unassigned_shifts <= presolve["max_assigned_main_shifts"]
+
+
+
+def test_slot_queue_orders_slots_by_remaining_candidates():
+    # 2 days, 2 shifts of 4 and 8 hours, 4 employees with a limit of 8 hours; the order depends on nothing else
+    candidate_availability = [[0b0111, 0b0011], [0b0001, 0b1111]]
+    occupancy = [0, 0]
+    workloads = [0, 0, 0, 0]
+    slot_queue = ConstrainedSlotQueue([(0, 0), (0, 1), (1, 0), (1, 1)], candidate_availability, occupancy, workloads, [4, 8], 8)
+    assert slot_queue.get_slots() == [(1, 0), (0, 1), (0, 0), (1, 1)]
+    assert slot_queue.pop() == (1, 0)
+    # employee 0 takes shift 0 of day 1: it leaves the candidates of day 1, and has no room left for shift 1 on any day
+    occupancy[1] |= 1
+    workloads[0] = 4
+    slot_queue.update_employee(0, 1, 0)
+    assert slot_queue.num_candidates == {(0, 0): 3, (0, 1): 1, (1, 1): 3}
+    assert all(num_candidates == slot_queue.count_candidates(*slot) for slot, num_candidates in slot_queue.num_candidates.items())
+    assert slot_queue.get_slots() == [(0, 1), (0, 0), (1, 1)]
+    assert [slot_queue.pop() for _ in range(len(slot_queue))] == [(0, 1), (0, 0), (1, 1)]
+
+
+@pytest.mark.parametrize("total_workload_limit", [150, None])
+def test_most_constrained_slot_order_pops_the_fewest_candidates_first(total_workload_limit, monkeypatch):
+    # with the consistency checks on, the queue's counts are recounted after every change (validate_occupancy)
+    popped = []
+    pop = ConstrainedSlotQueue.pop
+
+    def recording_pop(slot_queue):
+        fewest = min((num_candidates, slot) for slot, num_candidates in slot_queue.num_candidates.items())
+        slot = pop(slot_queue)
+        popped.append((slot, fewest))
+        return slot
+
+    monkeypatch.setattr(test.ConstrainedSlotQueue, "pop", recording_pop)
+    scheduler, special_requirement = create_scheduler(total_workload_limit=total_workload_limit, check_consistency=True)
+    main_shift_ids = [shift.id for shift in scheduler.shifts if shift.is_main_shift]
+    # before anything is assigned, the candidates of a slot are its available employees, if the shift fits in the per-person limit
+    fitting_shift_ids = [shift_index for shift_index in main_shift_ids
+                         if scheduler.get_shift(shift_index).get_workload_value() <= scheduler.WORKLOAD_LIMIT_PER_PERSON]
+    first_slot = min(((scheduler.candidate_availability[day_index][shift_index].bit_count() if shift_index in fitting_shift_ids else 0,
+                       (day_index, shift_index)) for day_index in range(scheduler.num_days) for shift_index in main_shift_ids))[1]
+    with contextlib.redirect_stdout(io.StringIO()):
+        scheduler.assign_work(scheduling_priority=[], special_requirement=special_requirement, slot_order="most_constrained", repair="matching")
+    assert popped[0][0] == first_slot
+    assert all(slot == fewest_slot for slot, (_, fewest_slot) in popped)
+    assert len(popped) == scheduler.num_days * len(main_shift_ids)
+    assert not [violation for violation in verify_schedule(scheduler, special_requirement=special_requirement) if is_hard_violation(violation)]